@@ -115,6 +115,13 @@ def create_app():
 
     _ensure_schema_and_bootstrap()
 
+    # --- Схема статистики + фоновая пачечная запись снимков ---
+    try:
+        from .services.stats_writer import writer as stats_writer
+        stats_writer.start()
+    except Exception as e:
+        app.logger.warning("stats writer not started: %s", e)
+
     # --- CLI команды ---
     register_cli(app)
 
@@ -4,6 +4,10 @@ from __future__ import annotations
 import os
 import json
 import time
+import threading
+import hashlib
+import zlib
+from collections import OrderedDict
 from datetime import datetime
 from typing import Optional, Iterable, Any, Sequence, Dict, List
 
@@ -32,6 +36,8 @@ __all__ = [
     "get_litebans_connection",
     "get_bcases_connection",
     "get_leader_connection",
+    "close_all_pools",
+    "pool_stats",
     # общая схема/настройки (panel)
     "init_db",
     "get_setting",
@@ -40,17 +46,22 @@ __all__ = [
     # статистика (оригинальные имена)
     "init_stats_schema",
     "save_server_stats",
+    "save_server_stats_many",
     "list_realms",
     "get_stats_recent",
     "get_stats_range",
     "get_stats_payloads_range",
     "get_stats_agg",
     "purge_old_stats",
+    "rebuild_stats_rollups",
+    "backfill_stats_rollups",
     # статистика (совместимые имена, которых ждут роуты)
     "ensure_stats_schema",
     "stats_save_snapshot",
     "stats_get_latest",
+    "stats_get_latest_all",
     "stats_get_series",
+    "stats_get_percentiles",
     # доменные хелперы (LuckPerms / EasyPayments / LiteBans / Leaderboards / BCases)
     "lp_find_uuid",
     "lp_get_player",
@@ -73,28 +84,57 @@ __all__ = [
 # MySQL wrapper
 # -------------------------
 class MySQLConnection:
-    """PyMySQL wrapper with sqlite-like API; converts '?' to '%s'."""
-    def __init__(self, conn: pymysql.connections.Connection):
+    """PyMySQL wrapper with sqlite-like API; converts '?' to '%s'.
+
+    Если соединение взято из пула, close() и выход из самого внешнего `with`
+    возвращают его обратно в пул вместо разрыва TCP.
+    """
+    def __init__(self, conn: pymysql.connections.Connection, pool: Optional["_MySQLPool"] = None):
         self._conn = conn
-        try:
-            self._conn.ping(reconnect=True)
-        except Exception:
-            pass
+        self._pool = pool
+        self._depth = 0
+        if pool is None:
+            try:
+                self._conn.ping(reconnect=True)
+            except Exception:
+                pass
 
     def __enter__(self) -> "MySQLConnection":
+        self._depth += 1
         return self
 
     def __exit__(self, exc_type, exc, tb):
+        self._depth = max(0, self._depth - 1)
         try:
-            (self._conn.commit() if exc_type is None else self._conn.rollback())
+            (self._raw().commit() if exc_type is None else self._raw().rollback())
         except Exception:
             pass
+        if self._depth == 0 and self._pool is not None:
+            self.close()
+
+    def __del__(self):
+        # страховка для кода, который берёт соединение без with/close()
+        if getattr(self, "_pool", None) is not None and getattr(self, "_conn", None) is not None:
+            try: self.close()
+            except Exception: pass
 
-    def commit(self) -> None: self._conn.commit()
-    def rollback(self) -> None: self._conn.rollback()
+    def _raw(self) -> pymysql.connections.Connection:
+        # после возврата в пул обёртку можно использовать дальше — возьмём соединение заново
+        if self._conn is None and self._pool is not None:
+            self._conn = self._pool.acquire()
+        return self._conn
+
+    def commit(self) -> None: self._raw().commit()
+    def rollback(self) -> None: self._raw().rollback()
 
     def close(self) -> None:
-        try: self._conn.close()
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        if self._pool is not None:
+            self._pool.release(conn)
+            return
+        try: conn.close()
         except Exception: pass
 
     @staticmethod
@@ -102,7 +142,7 @@ class MySQLConnection:
         return sql.replace("?", "%s")
 
     def _cursor(self):
-        return self._conn.cursor(DictCursor)
+        return self._raw().cursor(DictCursor)
 
     def execute(self, sql: str, params: Iterable[Any] | None = None):
         cur = self._cursor()
@@ -115,12 +155,13 @@ class MySQLConnection:
         return cur
 
     def executescript(self, script: str):
-        cur = self._conn.cursor()
+        conn = self._raw()
+        cur = conn.cursor()
         try:
             for stmt in [s.strip() for s in script.split(";")]:
                 if stmt:
                     cur.execute(stmt)
-            self._conn.commit()
+            conn.commit()
         finally:
             cur.close()
 
@@ -136,7 +177,7 @@ class MySQLConnection:
 
     @property
     def lastrowid(self) -> int:
-        try: return int(self._conn.insert_id())
+        try: return int(self._raw().insert_id())
         except Exception: return 0
 
 
@@ -238,8 +279,191 @@ def _connect_with_auto_create(prefix: str, create_if_missing: bool) -> pymysql.c
     return pymysql.connect(**_base_kwargs(host, port, user, password, database=db, use_ssl=use_ssl, ssl_ca=ssl_ca))
 
 
+# -------------------------
+# Connection pool
+# -------------------------
+def _pool_setting(prefix: str, key: str, default: float) -> float:
+    """{prefix}POOL_{key} -> DB_POOL_{key} -> default."""
+    raw = os.environ.get(f"{prefix}POOL_{key}")
+    if raw is None:
+        raw = os.environ.get(f"DB_POOL_{key}")
+    try:
+        return float(raw) if raw is not None and str(raw).strip() != "" else default
+    except ValueError:
+        return default
+
+
+def _pool_enabled(prefix: str) -> bool:
+    raw = os.environ.get(f"{prefix}POOL")
+    if raw is None:
+        raw = os.environ.get("DB_POOL", "1")
+    return (raw or "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+class _MySQLPool:
+    """
+    Пул соединений на один префикс окружения (DB_, AUTHME_, LUCKPERMS_, ...).
+      - min_size: сколько простаивающих соединений не выселяем по idle;
+      - max_size: верхний предел одновременно открытых соединений;
+      - ping при выдаче, если соединение простаивало дольше ping_after;
+      - выселение по idle_timeout и пересоздание по max_lifetime.
+    """
+    def __init__(self, prefix: str, create_if_missing: bool):
+        self.prefix = prefix
+        self.create_if_missing = create_if_missing
+        self.min_size = int(_pool_setting(prefix, "MIN", 1))
+        self.max_size = max(1, int(_pool_setting(prefix, "MAX", 10)))
+        self.idle_timeout = _pool_setting(prefix, "IDLE", 300.0)
+        self.max_lifetime = _pool_setting(prefix, "LIFETIME", 3600.0)
+        self.ping_after = _pool_setting(prefix, "PING_AFTER", 5.0)
+        self.acquire_timeout = _pool_setting(prefix, "TIMEOUT", 10.0)
+
+        self._cond = threading.Condition()
+        # LIFO: (conn, created_at, released_at) — «тёплые» соединения выдаём первыми
+        self._idle: list[tuple[pymysql.connections.Connection, float, float]] = []
+        self._born: dict[int, float] = {}  # id(conn) -> created_at для выданных и простаивающих
+        self._total = 0
+
+    def _open(self) -> pymysql.connections.Connection:
+        return _connect_with_auto_create(self.prefix, create_if_missing=self.create_if_missing)
+
+    @staticmethod
+    def _discard(conn: pymysql.connections.Connection) -> None:
+        try: conn.close()
+        except Exception: pass
+
+    def _evict_locked(self, now: float) -> list:
+        """Снять с idle-списка протухшие соединения (под локом). Закрываем их уже без лока."""
+        dead, keep = [], []
+        for item in self._idle:
+            conn, born, released = item
+            too_old = self.max_lifetime > 0 and now - born >= self.max_lifetime
+            too_idle = self.idle_timeout > 0 and now - released >= self.idle_timeout
+            if too_old or (too_idle and len(keep) >= self.min_size):
+                dead.append(conn)
+            else:
+                keep.append(item)
+        self._idle = keep
+        for conn in dead:
+            self._born.pop(id(conn), None)
+            self._total -= 1
+        return dead
+
+    def acquire(self) -> pymysql.connections.Connection:
+        deadline = time.monotonic() + max(0.0, self.acquire_timeout)
+        while True:
+            item = None
+            with self._cond:
+                now = time.time()
+                dead = self._evict_locked(now)
+                if self._idle:
+                    item = self._idle.pop()
+                elif self._total < self.max_size:
+                    self._total += 1
+                else:
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        raise mysql_err.OperationalError(
+                            2003, f"{self.prefix}pool exhausted (max_size={self.max_size})"
+                        )
+                    self._cond.wait(timeout=left)
+                    continue
+            for conn in dead:
+                self._discard(conn)
+
+            if item is None:
+                try:
+                    conn = self._open()
+                except Exception:
+                    with self._cond:
+                        self._total -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._born[id(conn)] = time.time()
+                return conn
+
+            conn, _born, released = item
+            if time.time() - released < self.ping_after:
+                return conn
+            try:
+                conn.ping(reconnect=False)
+                return conn
+            except Exception:
+                with self._cond:
+                    self._born.pop(id(conn), None)
+                    self._total -= 1
+                    self._cond.notify()
+                self._discard(conn)
+
+    def release(self, conn: pymysql.connections.Connection) -> None:
+        try:
+            # не оставляем открытую транзакцию/снимок REPEATABLE READ следующему владельцу
+            conn.rollback()
+            healthy = bool(getattr(conn, "open", True))
+        except Exception:
+            healthy = False
+        now = time.time()
+        with self._cond:
+            born = self._born.get(id(conn), now)
+            expired = self.max_lifetime > 0 and now - born >= self.max_lifetime
+            if healthy and not expired:
+                self._idle.append((conn, born, now))
+                self._cond.notify()
+                return
+            self._born.pop(id(conn), None)
+            self._total -= 1
+            self._cond.notify()
+        self._discard(conn)
+
+    def close_all(self) -> None:
+        with self._cond:
+            idle, self._idle = self._idle, []
+            for conn, _b, _r in idle:
+                self._born.pop(id(conn), None)
+                self._total -= 1
+        for conn, _b, _r in idle:
+            self._discard(conn)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"prefix": self.prefix, "total": self._total, "idle": len(self._idle),
+                    "in_use": self._total - len(self._idle), "max": self.max_size}
+
+
+_POOLS: dict[str, _MySQLPool] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def _get_pool(prefix: str, create_if_missing: bool) -> _MySQLPool:
+    pool = _POOLS.get(prefix)
+    if pool is None:
+        with _POOLS_LOCK:
+            pool = _POOLS.get(prefix)
+            if pool is None:
+                pool = _POOLS[prefix] = _MySQLPool(prefix, create_if_missing)
+    return pool
+
+
+def close_all_pools() -> None:
+    """Закрыть простаивающие соединения всех пулов (например, при остановке процесса)."""
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+    for pool in pools:
+        pool.close_all()
+
+
+def pool_stats() -> list[dict]:
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+    return [p.stats() for p in pools]
+
+
 def _mysql_connect(prefix: str, create_if_missing: bool) -> MySQLConnection:
-    return MySQLConnection(_connect_with_auto_create(prefix, create_if_missing=create_if_missing))
+    if not _pool_enabled(prefix):
+        return MySQLConnection(_connect_with_auto_create(prefix, create_if_missing=create_if_missing))
+    pool = _get_pool(prefix, create_if_missing)
+    return MySQLConnection(pool.acquire(), pool)
 
 
 def get_default_connection() -> MySQLConnection:
@@ -545,38 +769,504 @@ CREATE TABLE IF NOT EXISTS stats_samples (
     cpu_sys DECIMAL(6,3) NULL,
     cpu_proc DECIMAL(6,3) NULL,
 
-    -- исходный нормализованный объект — целиком
+    -- исходный нормализованный объект (в режиме dedup — без тяжёлых блоков)
     payload_json MEDIUMTEXT NULL,
+    -- {"players_list": <stats_blobs.id>, ...} — где лежат вынесенные тяжёлые блоки
+    payload_refs VARCHAR(1024) NULL,
 
     INDEX idx_stats_realm_ts (realm_id, collected_at),
     CONSTRAINT fk_stats_realm FOREIGN KEY (realm_id) REFERENCES realms(id) ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- тяжёлые блоки снимков: одна строка на уникальное содержимое, zlib(JSON)
+CREATE TABLE IF NOT EXISTS stats_blobs (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    hash CHAR(40) NOT NULL UNIQUE,
+    kind VARCHAR(64) NOT NULL,
+    data MEDIUMBLOB NOT NULL,
+    raw_size INT NULL,
+    created_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP,
+    last_seen TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_stats_blobs_seen (last_seen)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+"""
+
+# --- rollup-уровни: (шаг в секундах, таблица, env-ключ срока хранения, дней по умолчанию; 0 = вечно) ---
+# Строка rollup хранит суммы и число непустых значений, поэтому любые более крупные
+# бакеты считаются из неё точно: AVG = SUM(sum)/SUM(cnt), MAX = MAX(max).
+STATS_ROLLUP_TIERS = (
+    (60, "stats_rollup_1m", "STATS_RETENTION_1M_DAYS", 30),
+    (600, "stats_rollup_10m", "STATS_RETENTION_10M_DAYS", 180),
+    (3600, "stats_rollup_1h", "STATS_RETENTION_1H_DAYS", 0),
+)
+STATS_RAW_RETENTION = ("STATS_RETENTION_RAW_DAYS", 2)
+
+_ROLLUP_AVG = ("tps_1m", "tps_5m", "tps_15m", "mspt", "heap_used", "cpu_sys", "cpu_proc")
+_ROLLUP_MAX = ("players_online", "heap_max")
+
+# Гистограмма MSPT с фиксированными корзинами: складывается простым SUM, поэтому
+# p50/p95/p99 считаются по любому окну из rollup-уровней без сырых сэмплов.
+# Корзина i = [edges[i-1], edges[i]), первая — [0, edges[0]), последняя — [edges[-1], ∞).
+MSPT_HIST_EDGES = (5, 10, 15, 20, 25, 30, 35, 40, 45, 50, 60, 75, 100, 150, 200, 300, 500, 1000)
+_MSPT_HIST_COLS = tuple(f"mspt_h{i}" for i in range(len(MSPT_HIST_EDGES) + 1))
+
+def _mspt_bin(v: float) -> int:
+    for i, edge in enumerate(MSPT_HIST_EDGES):
+        if v < edge:
+            return i
+    return len(MSPT_HIST_EDGES)
+
+def _mspt_bin_sql(i: int, col: str = "mspt") -> str:
+    """Условие попадания сырого значения в корзину i (для SUM(...) по stats_samples)."""
+    lo = MSPT_HIST_EDGES[i - 1] if i > 0 else None
+    hi = MSPT_HIST_EDGES[i] if i < len(MSPT_HIST_EDGES) else None
+    parts = []
+    if lo is not None:
+        parts.append(f"{col} >= {lo}")
+    if hi is not None:
+        parts.append(f"{col} < {hi}")
+    return " AND ".join(parts) if lo is not None else f"{col} IS NOT NULL AND {parts[0]}"
+
+def hist_percentile(counts: Sequence[Any], q: float) -> Optional[float]:
+    """q-й перцентиль (0..100) по гистограмме MSPT, с линейной интерполяцией внутри корзины."""
+    counts = [int(c or 0) for c in counts]
+    total = sum(counts)
+    if total <= 0:
+        return None
+    rank = max(0.0, min(100.0, float(q))) / 100.0 * total
+    seen = 0
+    for i, c in enumerate(counts):
+        if c and seen + c >= rank:
+            lo = MSPT_HIST_EDGES[i - 1] if i > 0 else 0
+            if i >= len(MSPT_HIST_EDGES):
+                return float(lo)  # открытая сверху корзина — отдаём её нижнюю границу
+            hi = MSPT_HIST_EDGES[i]
+            return round(lo + (hi - lo) * (rank - seen) / c, 2)
+        seen += c
+    return float(MSPT_HIST_EDGES[-1])
+
+def _rollup_table_sql(table: str) -> str:
+    cols = []
+    for c in _ROLLUP_AVG:
+        cols.append(f"    {c}_sum DOUBLE NOT NULL DEFAULT 0,")
+        cols.append(f"    {c}_cnt INT NOT NULL DEFAULT 0,")
+    for c in _ROLLUP_MAX:
+        cols.append(f"    {c}_max BIGINT NULL,")
+    for c in _MSPT_HIST_COLS:
+        cols.append(f"    {c} INT NOT NULL DEFAULT 0,")
+    return f"""
+CREATE TABLE IF NOT EXISTS {table} (
+    realm_id INT NOT NULL,
+    bucket INT UNSIGNED NOT NULL,
+    samples INT NOT NULL DEFAULT 0,
+{chr(10).join(cols)}
+    PRIMARY KEY (realm_id, bucket),
+    CONSTRAINT fk_{table}_realm FOREIGN KEY (realm_id) REFERENCES realms(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 """
 
+STATS_ROLLUP_SCHEMA_SQL = "".join(_rollup_table_sql(t) for _, t, _, _ in STATS_ROLLUP_TIERS)
+
+_stats_migrated = False
+
 def init_stats_schema(conn: MySQLConnection) -> None:
     """Создать таблицы для статистики (idempotent)."""
+    global _stats_migrated
     conn.executescript(STATS_SCHEMA_SQL)
+    conn.executescript(STATS_ROLLUP_SCHEMA_SQL)
+    REALMS.load(conn)
+    if not _stats_migrated:
+        # таблицы, созданные до появления payload_refs, догоняем ALTER'ом
+        row = conn.query_one(
+            "SELECT COUNT(*) AS n FROM information_schema.COLUMNS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'stats_samples' AND COLUMN_NAME = 'payload_refs'"
+        )
+        if row and not int(row["n"]):
+            conn.execute("ALTER TABLE stats_samples ADD COLUMN payload_refs VARCHAR(1024) NULL AFTER payload_json")
+            conn.commit()
+        # rollup-таблицы без гистограммы MSPT — добавляем корзины (старые бакеты останутся нулевыми)
+        for _, table, _, _ in STATS_ROLLUP_TIERS:
+            row = conn.query_one(
+                "SELECT COUNT(*) AS n FROM information_schema.COLUMNS "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = ? AND COLUMN_NAME = ?",
+                (table, _MSPT_HIST_COLS[0]),
+            )
+            if row and not int(row["n"]):
+                adds = ", ".join(f"ADD COLUMN {c} INT NOT NULL DEFAULT 0" for c in _MSPT_HIST_COLS)
+                conn.execute(f"ALTER TABLE {table} {adds}")
+                conn.commit()
+        # сэмплы, записанные до rollup-уровней, иначе не видны графикам (серия берётся из rollup)
+        backfill_stats_rollups(conn)
+        _stats_migrated = True
+
+def _rollup_upsert_sql(table: str, step: int, rows: int = 1) -> str:
+    cols = ["realm_id", "bucket", "samples"]
+    upd = ["samples = samples + VALUES(samples)"]
+    for c in _ROLLUP_AVG:
+        cols += [f"{c}_sum", f"{c}_cnt"]
+        upd += [f"{c}_sum = {c}_sum + VALUES({c}_sum)", f"{c}_cnt = {c}_cnt + VALUES({c}_cnt)"]
+    for c in _ROLLUP_MAX:
+        cols.append(f"{c}_max")
+        upd.append(f"{c}_max = GREATEST(COALESCE({c}_max, VALUES({c}_max)), COALESCE(VALUES({c}_max), {c}_max))")
+    for c in _MSPT_HIST_COLS:
+        cols.append(c)
+        upd.append(f"{c} = {c} + VALUES({c})")
+    # бакет считает сам MySQL — так же, как в запросах по сырым данным (UNIX_TIMESTAMP в зоне сессии)
+    marks = "(" + ",".join(["?", f"FLOOR(UNIX_TIMESTAMP(?)/{step})*{step}"] + ["?"] * (len(cols) - 2)) + ")"
+    return (
+        f"INSERT INTO {table}({', '.join(cols)}) VALUES {','.join([marks] * rows)} "
+        f"ON DUPLICATE KEY UPDATE {', '.join(upd)}"
+    )
 
-def _realm_id(conn: MySQLConnection, name: str) -> int:
-    """Вернёт id realm, создаст при необходимости."""
-    name = (name or "").strip() or "default"
-    row = conn.query_one("SELECT id FROM realms WHERE name = ?", (name,))
-    if row:
-        return int(row["id"])
+def _rollup_values(rid: int, collected_at: str, sample: Dict[str, Any]) -> tuple:
+    vals: List[Any] = [rid, collected_at, 1]
+    for c in _ROLLUP_AVG:
+        v = _num(sample.get(c))
+        vals += [v or 0, 0 if v is None else 1]
+    for c in _ROLLUP_MAX:
+        v = _num(sample.get(c))
+        vals.append(None if v is None else int(v))
+    hist = [0] * len(_MSPT_HIST_COLS)
+    mspt = _num(sample.get("mspt"))
+    if mspt is not None:
+        hist[_mspt_bin(float(mspt))] = 1
+    vals.extend(hist)
+    return tuple(vals)
+
+def _update_rollups(conn: MySQLConnection, samples: Sequence[tuple]) -> None:
+    """Инкрементально добавить сырые сэмплы [(realm_id, collected_at, {col: value}), ...] во все rollup-уровни."""
+    if not samples:
+        return
+    vals: List[Any] = []
+    for rid, collected_at, sample in samples:
+        vals.extend(_rollup_values(rid, collected_at, sample))
+    for step, table, _, _ in STATS_ROLLUP_TIERS:
+        conn.execute(_rollup_upsert_sql(table, step, len(samples)), vals)
+
+def _rebuild_rollup_tier(conn: MySQLConnection, step: int, table: str, *, since_ts: Optional[int] = None,
+                         until_ts: Optional[int] = None, realm_id: Optional[int] = None) -> None:
+    bucket = f"(FLOOR(UNIX_TIMESTAMP(collected_at)/{step})*{step})"
+    sel = ["realm_id", bucket, "COUNT(*)"]
+    cols = ["realm_id", "bucket", "samples"]
+    for c in _ROLLUP_AVG:
+        sel += [f"COALESCE(SUM({c}),0)", f"COUNT({c})"]
+        cols += [f"{c}_sum", f"{c}_cnt"]
+    for c in _ROLLUP_MAX:
+        sel.append(f"MAX({c})")
+        cols.append(f"{c}_max")
+    for i, c in enumerate(_MSPT_HIST_COLS):
+        sel.append(f"SUM({_mspt_bin_sql(i)})")
+        cols.append(c)
+    upd = ", ".join(f"{c} = VALUES({c})" for c in cols[2:])
+    where: List[str] = []
+    params: List[Any] = []
+    if realm_id is not None:
+        where.append("realm_id = ?")
+        params.append(int(realm_id))
+    if since_ts:
+        # первый бакет окна может быть неполным — выравниваем начало по шагу
+        where.append("collected_at >= FROM_UNIXTIME(?)")
+        params.append(int(since_ts) - int(since_ts) % step)
+    if until_ts:
+        where.append("collected_at < FROM_UNIXTIME(?)")
+        params.append(int(until_ts))
+    w = f"WHERE {' AND '.join(where)}" if where else ""
     conn.execute(
-        "INSERT INTO realms(name) VALUES (?) "
-        "ON DUPLICATE KEY UPDATE name = VALUES(name)",
-        (name,),
+        f"INSERT INTO {table}({', '.join(cols)}) "
+        f"SELECT {', '.join(sel)} FROM stats_samples {w} GROUP BY realm_id, {bucket} "
+        f"ON DUPLICATE KEY UPDATE {upd}",
+        params,
     )
+
+def rebuild_stats_rollups(conn: MySQLConnection, *, since_ts: Optional[int] = None) -> None:
+    """
+    Пересчитать rollup-уровни из stats_samples (починка).
+    Бакеты, попавшие в окно, перезаписываются целиком.
+    """
+    for step, table, _, _ in STATS_ROLLUP_TIERS:
+        _rebuild_rollup_tier(conn, step, table, since_ts=since_ts)
+    conn.commit()
+
+def backfill_stats_rollups(conn: MySQLConnection) -> int:
+    """
+    Догнать rollup-уровни сырыми сэмплами старше первого бакета realm на уровне — история,
+    записанная до появления rollup. Уже заполненные бакеты не трогает (их сырые сэмплы могли
+    быть частично удалены по сроку хранения). Возвращает число дозаполненных пар (уровень, realm).
+    """
+    raw_first = {
+        int(r["realm_id"]): int(r["first_ts"] or 0)
+        for r in conn.query_all(
+            "SELECT realm_id, UNIX_TIMESTAMP(MIN(collected_at)) AS first_ts FROM stats_samples GROUP BY realm_id"
+        ) or []
+    }
+    filled = 0
+    for step, table, _, _ in STATS_ROLLUP_TIERS:
+        tier_first = {
+            int(r["realm_id"]): int(r["first_bucket"])
+            for r in conn.query_all(f"SELECT realm_id, MIN(bucket) AS first_bucket FROM {table} GROUP BY realm_id") or []
+        }
+        for rid, first_ts in raw_first.items():
+            until = tier_first.get(rid)
+            if until is not None and first_ts >= until:
+                continue
+            _rebuild_rollup_tier(conn, step, table, until_ts=until, realm_id=rid)
+            filled += 1
     conn.commit()
-    row = conn.query_one("SELECT id FROM realms WHERE name = ?", (name,))
-    return int(row["id"])
+    return filled
+
+class _RealmRegistry:
+    """
+    Потокобезопасный справочник realm name -> id в памяти процесса.
+
+    Загружается целиком при старте (init_stats_schema) и дальше обслуживает чтения без БД.
+    Новый realm создаётся только пишущим путём: один upsert, id — из LAST_INSERT_ID.
+    Читающие пути realm не создают: незнакомое имя — один SELECT (вдруг его завёл другой
+    процесс), отрицательный ответ кэшируется на SP_REALMS_MISS_TTL секунд.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids: Dict[str, int] = {}
+        self._misses: Dict[str, float] = {}
+        self._loaded_at = 0.0
+        self.refresh_every = float(os.getenv("SP_REALMS_REFRESH", "300"))
+        self.miss_ttl = float(os.getenv("SP_REALMS_MISS_TTL", "30"))
+
+    def load(self, conn: MySQLConnection) -> None:
+        rows = conn.query_all("SELECT id, name FROM realms")
+        with self._lock:
+            self._ids = {r["name"]: int(r["id"]) for r in rows}
+            self._misses.clear()
+            self._loaded_at = time.monotonic()
+
+    def _ensure_loaded(self, conn: MySQLConnection) -> None:
+        if not self._loaded_at or time.monotonic() - self._loaded_at > self.refresh_every:
+            self.load(conn)
+
+    def lookup(self, conn: MySQLConnection, name: str) -> Optional[int]:
+        """id существующего realm или None; никогда не пишет в БД."""
+        with self._lock:
+            rid = self._ids.get(name)
+            missed_at = self._misses.get(name)
+        if rid is not None:
+            return rid
+        if not self._loaded_at:
+            self._ensure_loaded(conn)
+            with self._lock:
+                rid = self._ids.get(name)
+            if rid is not None:
+                return rid
+        if missed_at is not None and time.monotonic() - missed_at < self.miss_ttl:
+            return None
+        row = conn.query_one("SELECT id FROM realms WHERE name = ?", (name,))
+        with self._lock:
+            if row:
+                rid = self._ids[name] = int(row["id"])
+                self._misses.pop(name, None)
+            else:
+                self._misses[name] = time.monotonic()
+        return rid
+
+    def get_or_create(self, conn: MySQLConnection, name: str) -> int:
+        with self._lock:
+            rid = self._ids.get(name)
+        if rid is not None:
+            return rid
+        conn.execute(
+            "INSERT INTO realms(name) VALUES (?) "
+            "ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id)",
+            (name,),
+        )
+        rid = int(conn.lastrowid)
+        # фиксируем сразу: закэшированный id не должен пропасть при откате вызывающей транзакции
+        conn.commit()
+        with self._lock:
+            self._ids[name] = rid
+            self._misses.pop(name, None)
+        return rid
+
+    def names(self, conn: Optional[MySQLConnection] = None) -> List[str]:
+        if conn is not None:
+            self._ensure_loaded(conn)
+        with self._lock:
+            return sorted(self._ids)
+
+REALMS = _RealmRegistry()
+
+def _realm_id(conn: MySQLConnection, name: str) -> int:
+    """Вернёт id realm, создаст при необходимости (только для пишущих путей)."""
+    return REALMS.get_or_create(conn, (name or "").strip() or "default")
+
+def _realm_lookup(conn: MySQLConnection, name: str) -> Optional[int]:
+    """id realm для читающих путей: None, если такого realm нет (ничего не создаёт)."""
+    return REALMS.lookup(conn, (name or "").strip() or "default")
+
+# ---- тяжёлые блоки снимка ----
+# STATS_PAYLOAD_MODE=dedup (по умолчанию): блоки ниже выносятся в stats_blobs (zlib, по хэшу
+# содержимого), сэмпл хранит только ссылки; full — старое поведение, весь объект в payload_json.
+STATS_PAYLOAD_MODE = os.getenv("STATS_PAYLOAD_MODE", "dedup").strip().lower()
+STATS_BLOB_ZLIB_LEVEL = int(os.getenv("STATS_BLOB_ZLIB_LEVEL", "6"))
+STATS_HEAVY_BLOCKS = (
+    ("players_list",),
+    ("worlds",),
+    ("worlds_map",),
+    ("entities_top_types",),
+    ("entities_total_types",),
+    ("plugins",),
+    ("jvm", "mem_pools"),
+)
+
+# hash -> [blob_id, когда последний раз продлевали last_seen]; экономит SELECT/INSERT на каждый сэмпл
+_BLOB_IDS: "OrderedDict[str, list]" = OrderedDict()
+_BLOB_IDS_MAX = 4096
+_BLOB_IDS_LOCK = threading.Lock()
+_BLOB_TOUCH_EVERY = 3600.0
+
+def _split_heavy(stats: dict) -> tuple[dict, dict]:
+    """Вернёт (лёгкая копия снимка, {"a.b": блок}) — пустые блоки остаются на месте."""
+    light = dict(stats)
+    heavy: Dict[str, Any] = {}
+    for path in STATS_HEAVY_BLOCKS:
+        parent = light
+        for key in path[:-1]:
+            node = parent.get(key)
+            if not isinstance(node, dict):
+                parent = None
+                break
+            parent[key] = node = dict(node)  # копируем по пути, исходник не трогаем
+            parent = node
+        if parent is None:
+            continue
+        value = parent.get(path[-1])
+        if value in (None, [], {}):
+            continue
+        heavy[".".join(path)] = value
+        del parent[path[-1]]
+    return light, heavy
+
+def _put_blob(conn: MySQLConnection, kind: str, value: Any, fresh: Dict[str, int]) -> int:
+    """id блока с таким содержимым; новые хэши складываются в fresh и попадут в кэш после commit."""
+    raw = json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    digest = hashlib.sha1(kind.encode("utf-8") + b"\0" + raw).hexdigest()
+    now = time.monotonic()
+    with _BLOB_IDS_LOCK:
+        hit = _BLOB_IDS.get(digest)
+        if hit:
+            _BLOB_IDS.move_to_end(digest)
+            touch = now - hit[1] >= _BLOB_TOUCH_EVERY
+            if touch:
+                hit[1] = now
+    if hit:
+        if not touch:
+            return int(hit[0])
+        # блок всё ещё используется — продлеваем, чтобы retention его не удалил
+        cur = conn.execute("UPDATE stats_blobs SET last_seen = CURRENT_TIMESTAMP WHERE id = ?", (hit[0],))
+        try:
+            touched = int(getattr(cur, "rowcount", 0) or 0)
+        finally:
+            cur.close()
+        if touched:
+            return int(hit[0])
+        # строку уже удалил purge_old_stats — id в кэше висячий, забываем его и идём через INSERT
+        # (0 бывает и при том же last_seen в ту же секунду — тогда INSERT просто вернёт тот же id)
+        with _BLOB_IDS_LOCK:
+            if _BLOB_IDS.get(digest) is hit:
+                del _BLOB_IDS[digest]
+
+    # LAST_INSERT_ID(id) отдаёт id и для уже существующей строки
+    conn.execute(
+        "INSERT INTO stats_blobs(hash, kind, data, raw_size) VALUES (?,?,?,?) "
+        "ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id), last_seen = CURRENT_TIMESTAMP",
+        (digest, kind, zlib.compress(raw, STATS_BLOB_ZLIB_LEVEL), len(raw)),
+    )
+    blob_id = int(conn.lastrowid)
+    fresh[digest] = blob_id
+    return blob_id
+
+def _remember_blobs(fresh: Dict[str, int]) -> None:
+    now = time.monotonic()
+    with _BLOB_IDS_LOCK:
+        for digest, blob_id in fresh.items():
+            _BLOB_IDS[digest] = [blob_id, now]
+        while len(_BLOB_IDS) > _BLOB_IDS_MAX:
+            _BLOB_IDS.popitem(last=False)
+
+def _load_blobs(conn: MySQLConnection, ids: Iterable[int], cache: Optional[Dict[int, Any]] = None) -> Dict[int, Any]:
+    cache = {} if cache is None else cache
+    need = sorted({int(i) for i in ids} - set(cache))
+    if need:
+        rows = conn.query_all(
+            f"SELECT id, data FROM stats_blobs WHERE id IN ({','.join('?' * len(need))})",
+            need,
+        )
+        for r in rows:
+            try:
+                cache[int(r["id"])] = json.loads(zlib.decompress(r["data"]).decode("utf-8"))
+            except Exception:
+                cache[int(r["id"])] = None
+    return cache
+
+def _attach_heavy(conn: MySQLConnection, payload: dict, refs_json: Optional[str],
+                  cache: Optional[Dict[int, Any]] = None) -> dict:
+    """Вернуть вынесенные блоки на их места в снимке (in-place)."""
+    if not refs_json:
+        return payload
+    try:
+        refs = json.loads(refs_json) or {}
+    except Exception:
+        return payload
+    blobs = _load_blobs(conn, refs.values(), cache)
+    for dotted, blob_id in refs.items():
+        value = blobs.get(int(blob_id))
+        if value is None:
+            continue
+        path = dotted.split(".")
+        node = payload
+        for key in path[:-1]:
+            node = node.setdefault(key, {})
+        node[path[-1]] = value
+    return payload
 
 def save_server_stats(conn: MySQLConnection, stats: dict, *, collected_at: datetime | None = None) -> int:
     """
     Сохранить результат normalize_server_stats(...).
     Возвращает id вставленной строки.
     """
+    return save_server_stats_many(conn, [(stats, collected_at)])
+
+def save_server_stats_many(conn: MySQLConnection, items: Sequence[tuple]) -> int:
+    """
+    Пакетная запись [(stats, collected_at|None), ...]: один многострочный INSERT в stats_samples
+    и по одному upsert на каждый rollup-уровень, один commit.
+    Возвращает id первой вставленной строки (ids пачки идут подряд).
+    """
+    if not items:
+        return 0
+    rows: List[tuple] = []
+    fresh: Dict[str, int] = {}
+    for stats, collected_at in items:
+        rows.append(_sample_row(conn, stats, collected_at, fresh))
+
+    marks = "(" + ",".join("?" * 14) + ")"
+    conn.execute(
+        f"""
+        INSERT INTO stats_samples(
+            realm_id, collected_at,
+            players_online, players_max,
+            tps_1m, tps_5m, tps_15m, mspt,
+            heap_used, heap_max, cpu_sys, cpu_proc,
+            payload_json, payload_refs
+        ) VALUES {",".join([marks] * len(rows))}
+        """,
+        [v for row in rows for v in row],
+    )
+    first_id = conn.lastrowid
+    _update_rollups(conn, [(row[0], row[1], dict(zip(_SAMPLE_COLS, row[2:12]))) for row in rows])
+    conn.commit()
+    _remember_blobs(fresh)  # только после commit: откатанный INSERT не должен попасть в кэш
+    return first_id
+
+def _sample_row(conn: MySQLConnection, stats: dict, collected_at: datetime | None, fresh: Dict[str, int]) -> tuple:
     realm = (stats.get("realm") or "").strip() or "default"
     rid = _realm_id(conn, realm)
 
@@ -586,7 +1276,14 @@ def save_server_stats(conn: MySQLConnection, stats: dict, *, collected_at: datet
     osb = stats.get("os") or {}
     cpu = osb.get("cpu_load") or {}
 
-    row = (
+    refs_json = None
+    payload = stats
+    if STATS_PAYLOAD_MODE != "full":
+        payload, heavy = _split_heavy(stats)
+        if heavy:
+            refs_json = json.dumps({k: _put_blob(conn, k, v, fresh) for k, v in heavy.items()})
+
+    return (
         rid,
         (collected_at or datetime.utcnow()).strftime("%Y-%m-%d %H:%M:%S"),
         players.get("online"),
@@ -599,31 +1296,22 @@ def save_server_stats(conn: MySQLConnection, stats: dict, *, collected_at: datet
         heap.get("max"),
         cpu.get("system"),
         cpu.get("process"),
-        json.dumps(stats, ensure_ascii=False),
+        json.dumps(payload, ensure_ascii=False),
+        refs_json,
     )
 
-    conn.execute(
-        """
-        INSERT INTO stats_samples(
-            realm_id, collected_at,
-            players_online, players_max,
-            tps_1m, tps_5m, tps_15m, mspt,
-            heap_used, heap_max, cpu_sys, cpu_proc,
-            payload_json
-        ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)
-        """,
-        row,
-    )
-    conn.commit()
-    return conn.lastrowid
+_SAMPLE_COLS = ("players_online", "players_max", "tps_1m", "tps_5m", "tps_15m", "mspt",
+                "heap_used", "heap_max", "cpu_sys", "cpu_proc")
 
-def list_realms(conn: MySQLConnection) -> list[str]:
-    rows = conn.query_all("SELECT name FROM realms ORDER BY name ASC")
-    return [r["name"] for r in rows]
+def list_realms(conn: Optional[MySQLConnection] = None) -> list[str]:
+    """Имена realm из реестра в памяти (conn нужен только для первой загрузки/обновления)."""
+    return REALMS.names(conn)
 
 def get_stats_recent(conn: MySQLConnection, realm: str, limit: int = 100) -> list[dict]:
     """Последние N записей по realm (от новых к старым)."""
-    rid = _realm_id(conn, realm)
+    rid = _realm_lookup(conn, realm)
+    if rid is None:
+        return []
     rows = conn.query_all(
         """
         SELECT id, collected_at, players_online, players_max,
@@ -640,7 +1328,9 @@ def get_stats_recent(conn: MySQLConnection, realm: str, limit: int = 100) -> lis
 
 def get_stats_range(conn: MySQLConnection, realm: str, start: datetime | str, end: datetime | str) -> list[dict]:
     """Все записи за интервал [start, end]."""
-    rid = _realm_id(conn, realm)
+    rid = _realm_lookup(conn, realm)
+    if rid is None:
+        return []
     s = _as_dt(start).strftime("%Y-%m-%d %H:%M:%S")
     e = _as_dt(end).strftime("%Y-%m-%d %H:%M:%S")
     rows = conn.query_all(
@@ -661,30 +1351,39 @@ def get_stats_payloads_range(conn: MySQLConnection, realm: str, start: datetime
     То же, что get_stats_range, но с полным JSON (может быть тяжёлым).
     Возвращает список словарей с payload_json уже распарсенным.
     """
-    rid = _realm_id(conn, realm)
+    rid = _realm_lookup(conn, realm)
+    if rid is None:
+        return []
     s = _as_dt(start).strftime("%Y-%m-%d %H:%M:%S")
     e = _as_dt(end).strftime("%Y-%m-%d %H:%M:%S")
     rows = conn.query_all(
         """
-        SELECT id, collected_at, payload_json
+        SELECT id, collected_at, payload_json, payload_refs
         FROM stats_samples
         WHERE realm_id = ? AND collected_at BETWEEN ? AND ?
         ORDER BY collected_at ASC
         """,
         (rid, s, e),
     )
+    blobs: Dict[int, Any] = {}  # соседние сэмплы обычно ссылаются на одни и те же блоки
     for r in rows:
+        refs = r.pop("payload_refs", None)
         try:
-            r["payload"] = json.loads(r.pop("payload_json") or "{}")
+            r["payload"] = _attach_heavy(conn, json.loads(r.pop("payload_json") or "{}"), refs, blobs)
         except Exception:
             r["payload"] = {}
     return rows
 
 def get_stats_agg(conn: MySQLConnection, realm: str, minutes: int = 60) -> dict:
     """
-    Сводная агрегация за последние N минут (avg/min/max основных метрик).
+    Сводная агрегация за последние N минут (avg/min/max основных метрик + p50/p95/p99 MSPT).
+    avg/min/max считаются по сырым сэмплам (живут STATS_RETENTION_RAW_DAYS) — from_ts показывает,
+    с какого момента они реально есть; перцентили — по rollup (None, если окно покрыто не целиком,
+    см. mspt_pct_complete / mspt_pct_from_ts).
     """
-    rid = _realm_id(conn, realm)
+    rid = _realm_lookup(conn, realm)
+    if rid is None:
+        return {}
     rows = conn.query_all(
         """
         SELECT
@@ -692,28 +1391,59 @@ def get_stats_agg(conn: MySQLConnection, realm: str, minutes: int = 60) -> dict:
           AVG(tps_1m) AS avg_tps1, MIN(tps_1m) AS min_tps1, MAX(tps_1m) AS max_tps1,
           AVG(mspt) AS avg_mspt, MIN(mspt) AS min_mspt, MAX(mspt) AS max_mspt,
           AVG(cpu_sys) AS avg_cpu_sys, AVG(cpu_proc) AS avg_cpu_proc,
-          AVG(heap_used) AS avg_heap_used, MAX(heap_used) AS peak_heap_used
+          AVG(heap_used) AS avg_heap_used, MAX(heap_used) AS peak_heap_used,
+          UNIX_TIMESTAMP(MIN(collected_at)) AS from_ts
         FROM stats_samples
         WHERE realm_id = ? AND collected_at >= (NOW() - INTERVAL ? MINUTE)
         """,
         (rid, int(minutes)),
     )
-    return rows[0] if rows else {}
+    out = dict(rows[0]) if rows else {}
+    try:
+        pct = stats_get_percentiles(conn, realm, since_ts=int(time.time()) - int(minutes) * 60)
+        out.update({f"{k}_mspt": v for k, v in pct.items() if k.startswith("p")})
+        out["mspt_pct_complete"] = pct.get("complete", False)
+        out["mspt_pct_from_ts"] = pct.get("from_ts")
+    except Exception:
+        pass  # rollup может ещё не существовать — сводка без перцентилей
+    return out
 
-def purge_old_stats(conn: MySQLConnection, days: int = 30) -> int:
-    """Удалить записи старше N дней. Возвращает число удалённых строк (если доступно)."""
-    cur = conn.execute(
-        "DELETE FROM stats_samples WHERE collected_at < (NOW() - INTERVAL ? DAY)",
-        (int(days),),
-    )
-    conn.commit()
+def _retention_days(env_key: str, default: int) -> int:
     try:
-        return int(getattr(cur, "rowcount", 0) or 0)
-    finally:
+        return max(0, int(os.getenv(env_key, str(default))))
+    except ValueError:
+        return default
+
+def purge_old_stats(conn: MySQLConnection, days: Optional[int] = None) -> int:
+    """
+    Ступенчатое хранение: сырые сэмплы живут STATS_RETENTION_RAW_DAYS (или days, если передан),
+    каждый rollup-уровень — свой срок из STATS_ROLLUP_TIERS (0 = без ограничения).
+    Возвращает суммарное число удалённых строк (если доступно).
+    """
+    plan = [("stats_samples", "collected_at < (NOW() - INTERVAL ? DAY)",
+             int(days) if days is not None else _retention_days(*STATS_RAW_RETENTION))]
+    for _, table, env_key, default in STATS_ROLLUP_TIERS:
+        plan.append((table, "bucket < UNIX_TIMESTAMP(NOW() - INTERVAL ? DAY)", _retention_days(env_key, default)))
+
+    # блок, который не встречался дольше срока жизни сырых сэмплов, уже ни на что не ссылается
+    # (+1 день запаса: last_seen продлевается не на каждом сэмпле, а раз в _BLOB_TOUCH_EVERY)
+    if plan[0][2] > 0:
+        plan.append(("stats_blobs", "last_seen < (NOW() - INTERVAL ? DAY)", plan[0][2] + 1))
+
+    removed = 0
+    for table, cond, keep_days in plan:
+        if keep_days <= 0:
+            continue
+        cur = conn.execute(f"DELETE FROM {table} WHERE {cond}", (keep_days,))
         try:
-            cur.close()
-        except Exception:
-            pass
+            removed += int(getattr(cur, "rowcount", 0) or 0)
+        finally:
+            try:
+                cur.close()
+            except Exception:
+                pass
+    conn.commit()
+    return removed
 
 # -------------
 # utils
@@ -740,8 +1470,15 @@ def _num(v):
 # Совместимые функции, которые ожидает gameservers.py
 # =========================================================
 
+_stats_schema_ready = False
+
 def ensure_stats_schema(conn: MySQLConnection) -> None:
+    """init_stats_schema один раз на процесс (обычно уже при старте приложения)."""
+    global _stats_schema_ready
+    if _stats_schema_ready:
+        return
     init_stats_schema(conn)
+    _stats_schema_ready = True
 
 def stats_save_snapshot(conn: MySQLConnection, realm: str, data: Dict[str, Any]) -> int:
     payload = dict(data or {})
@@ -754,12 +1491,14 @@ def stats_save_snapshot(conn: MySQLConnection, realm: str, data: Dict[str, Any])
     return save_server_stats(conn, payload)
 
 def stats_get_latest(conn: MySQLConnection, realm: str) -> Optional[Dict[str, Any]]:
-    rid = _realm_id(conn, realm)
+    rid = _realm_lookup(conn, realm)
+    if rid is None:
+        return None
     row = conn.query_one(
         """
         SELECT id, UNIX_TIMESTAMP(collected_at) AS ts_unix, players_online, players_max,
                tps_1m, tps_5m, tps_15m, mspt,
-               heap_used, heap_max, cpu_sys, cpu_proc, payload_json
+               heap_used, heap_max, cpu_sys, cpu_proc, payload_json, payload_refs
         FROM stats_samples
         WHERE realm_id = ?
         ORDER BY collected_at DESC, id DESC
@@ -774,7 +1513,7 @@ def stats_get_latest(conn: MySQLConnection, realm: str) -> Optional[Dict[str, An
         try:
             payload = json.loads(row["payload_json"] or "{}")
             if isinstance(payload, dict):
-                payload = dict(payload)
+                payload = _attach_heavy(conn, dict(payload), row.get("payload_refs"))
                 payload["realm"] = payload.get("realm") or realm
                 payload["ts"] = payload.get("ts") or int(row.get("ts_unix") or time.time())
                 return payload
@@ -798,6 +1537,177 @@ def stats_get_latest(conn: MySQLConnection, realm: str) -> Optional[Dict[str, An
         "fs": {},
     }
 
+def _pick_rollup_tier(step: int) -> Optional[tuple]:
+    """Самый крупный rollup-уровень, бакеты которого целиком укладываются в шаг."""
+    best = None
+    for tier in STATS_ROLLUP_TIERS:
+        if tier[0] <= step and step % tier[0] == 0:
+            best = tier
+    return best
+
+def _series_agg_sql(col: str) -> str:
+    if col in ("heap_max", "players_online"):
+        return f"MAX({col}) AS {col}"
+    return f"AVG({col}) AS {col}"
+
+def _series_from_raw(conn: MySQLConnection, rid: int, since_ts: Optional[int], step: int,
+                     fset: List[str], limit: int, hist: bool = False) -> List[Dict[str, Any]]:
+    where = ["realm_id = ?"]
+    params: List[Any] = [rid]
+    if since_ts:
+        where.append("collected_at >= FROM_UNIXTIME(?)")
+        params.append(int(since_ts))
+
+    bucket = f"(FLOOR(UNIX_TIMESTAMP(collected_at)/{step})*{step})"
+    select_cols = [f"{bucket} AS ts"] + [_series_agg_sql(c) for c in fset]
+    if hist:
+        select_cols += [f"SUM({_mspt_bin_sql(i)}) AS {c}" for i, c in enumerate(_MSPT_HIST_COLS)]
+
+    sql = f"""
+        SELECT {", ".join(select_cols)}
+        FROM stats_samples
+        WHERE {" AND ".join(where)}
+        GROUP BY {bucket}
+        ORDER BY ts ASC
+        LIMIT ?
+    """
+    params.append(int(limit or 720))
+    return conn.query_all(sql, params) or []
+
+def _series_from_rollup(conn: MySQLConnection, tier: tuple, rid: int, since_ts: Optional[int], step: int,
+                        fset: List[str], limit: int, hist: bool = False) -> List[Dict[str, Any]]:
+    tier_step, table = tier[0], tier[1]
+    where = ["realm_id = ?"]
+    params: List[Any] = [rid]
+    if since_ts:
+        # бакет уровня, в который попадает since_ts, тоже берём — как сырой запрос берёт его хвост
+        where.append("bucket >= ?")
+        params.append(int(since_ts) - int(since_ts) % tier_step)
+
+    def col_sql(col: str) -> str:
+        if col in _ROLLUP_MAX:
+            return f"MAX({col}_max) AS {col}"
+        return f"SUM({col}_sum) / NULLIF(SUM({col}_cnt), 0) AS {col}"
+
+    bucket = "bucket" if step == tier_step else f"(FLOOR(bucket/{step})*{step})"
+    cols = [col_sql(c) for c in fset]
+    if hist:
+        cols += [f"SUM({c}) AS {c}" for c in _MSPT_HIST_COLS]
+    sql = f"""
+        SELECT {bucket} AS ts, {", ".join(cols)}
+        FROM {table}
+        WHERE {" AND ".join(where)}
+        GROUP BY {bucket}
+        ORDER BY ts ASC
+        LIMIT ?
+    """
+    params.append(int(limit or 720))
+    return conn.query_all(sql, params) or []
+
+def stats_get_latest_all(conn: MySQLConnection) -> List[Dict[str, Any]]:
+    """
+    Последний сэмпл каждого realm одним запросом: MAX(collected_at) по realm_id берётся
+    из idx_stats_realm_ts (loose index scan), затем точечный join обратно. Только скалярные колонки.
+    """
+    rows = conn.query_all(
+        """
+        SELECT r.name AS realm, s.id, UNIX_TIMESTAMP(s.collected_at) AS ts_unix,
+               s.players_online, s.players_max, s.tps_1m, s.tps_5m, s.tps_15m, s.mspt,
+               s.heap_used, s.heap_max, s.cpu_sys, s.cpu_proc
+        FROM (SELECT realm_id, MAX(collected_at) AS last_at FROM stats_samples GROUP BY realm_id) m
+        JOIN stats_samples s ON s.realm_id = m.realm_id AND s.collected_at = m.last_at
+        JOIN realms r ON r.id = s.realm_id
+        ORDER BY s.id DESC
+        """
+    ) or []
+    out: List[Dict[str, Any]] = []
+    seen = set()
+    for row in rows:
+        if row["realm"] in seen:  # несколько сэмплов в одну секунду — берём последний по id
+            continue
+        seen.add(row["realm"])
+        out.append({
+            "realm": row["realm"],
+            "ts": int(row.get("ts_unix") or 0),
+            "mspt": _num(row.get("mspt")),
+            "tps": {
+                "1m": _num(row.get("tps_1m")),
+                "5m": _num(row.get("tps_5m")),
+                "15m": _num(row.get("tps_15m")),
+                "mspt": _num(row.get("mspt")),
+            },
+            "players": {"online": _num(row.get("players_online")), "max": _num(row.get("players_max"))},
+            "heap": {"used": _num(row.get("heap_used")), "max": _num(row.get("heap_max"))},
+            "os": {"cpu_load": {"system": _num(row.get("cpu_sys")), "process": _num(row.get("cpu_proc"))}},
+        })
+    return out
+
+def parse_percentile(agg: Optional[str]) -> Optional[float]:
+    """"p95" / "p99.9" -> 95.0 / 99.9; всё остальное (avg, None, мусор) -> None."""
+    a = (agg or "").strip().lower()
+    if len(a) < 2 or a[0] != "p":
+        return None
+    try:
+        q = float(a[1:])
+    except ValueError:
+        return None
+    return q if 0 < q < 100 else None
+
+def _rollup_tier_for_window(since_ts: int) -> tuple:
+    """Самый мелкий rollup-уровень, срок хранения которого ещё покрывает начало окна."""
+    age_days = (time.time() - int(since_ts)) / 86400.0
+    for tier in STATS_ROLLUP_TIERS:
+        keep = _retention_days(tier[2], tier[3])
+        if keep <= 0 or age_days <= keep:
+            return tier
+    return STATS_ROLLUP_TIERS[-1]
+
+def stats_get_percentiles(conn: MySQLConnection, realm: str, *, since_ts: int,
+                          until_ts: Optional[int] = None,
+                          qs: Sequence[float] = (50, 95, 99)) -> Dict[str, Any]:
+    """
+    Перцентили MSPT за окно [since_ts, until_ts) по rollup-уровню, который ещё хранит начало окна
+    (гистограммы бакетов складываются).
+    Возвращает {"samples", "tier", "from_ts", "to_ts", "missing", "complete", "p50", "p95", "p99"}:
+    from_ts/to_ts — границы бакетов с данными в окне; missing — сэмплы mspt без гистограммы (бакеты,
+    записанные до её появления). complete=False, если начало окна старше истории уровня для realm
+    или есть missing — тогда перцентили None (при желании перезапросить с since_ts=from_ts).
+    """
+    rid = _realm_lookup(conn, realm)
+    if rid is None:
+        return {}
+    step, table = _rollup_tier_for_window(since_ts)[:2]
+    start = int(since_ts) - int(since_ts) % step
+    where = ["realm_id = ?", "bucket >= ?"]
+    params: List[Any] = [rid, start]
+    if until_ts:
+        where.append("bucket < ?")
+        params.append(int(until_ts))
+    hist_sum = " + ".join(f"COALESCE(SUM({c}),0)" for c in _MSPT_HIST_COLS)
+    row = conn.query_one(
+        f"SELECT {', '.join(f'SUM({c}) AS {c}' for c in _MSPT_HIST_COLS)}, "
+        f"MIN(bucket) AS from_ts, MAX(bucket) AS last_bucket, "
+        f"COALESCE(SUM(mspt_cnt),0) - ({hist_sum}) AS missing "
+        f"FROM {table} WHERE {' AND '.join(where)}",
+        params,
+    ) or {}
+    first = conn.query_one(f"SELECT MIN(bucket) AS first_bucket FROM {table} WHERE realm_id = ?", (rid,)) or {}
+    counts = [row.get(c) for c in _MSPT_HIST_COLS]
+    missing = max(0, int(row.get("missing") or 0))
+    history_from = first.get("first_bucket")
+    complete = history_from is not None and int(history_from) <= start and not missing
+    out: Dict[str, Any] = {
+        "samples": sum(int(c or 0) for c in counts),
+        "tier": f"{step // 60}m" if step < 3600 else f"{step // 3600}h",
+        "from_ts": int(row["from_ts"]) if row.get("from_ts") is not None else None,
+        "to_ts": int(row["last_bucket"]) + step if row.get("last_bucket") is not None else None,
+        "missing": missing,
+        "complete": complete,
+    }
+    for q in qs:
+        out[f"p{q:g}"] = hist_percentile(counts, q) if complete else None
+    return out
+
 def stats_get_series(
     conn: MySQLConnection,
     realm: str,
@@ -806,9 +1716,14 @@ def stats_get_series(
     limit: int = 720,
     step_sec: Optional[int] = 60,
     fields: Optional[Iterable[str]] = None,
+    agg: Optional[str] = None,
 ) -> List[Dict[str, Any]]:
     """
     Возвращает [{"ts": <unix>, <field>: value, ...}, ...]
+    Если шаг кратен минуте, данные берутся из самого крупного подходящего rollup-уровня,
+    а не из сырых сэмплов.
+    agg="p95" (любой pNN / pNN.N) — mspt в каждой точке считается как перцентиль по
+    гистограмме бакета, а не среднее; остальные поля агрегируются как обычно.
     Разрешённые поля:
       mspt, tps_1m, tps_5м, tps_15m, players_online,
       heap_used, heap_max, cpu_sys, cpu_proc
@@ -825,38 +1740,31 @@ def stats_get_series(
         fset = ["tps_1m","tps_5m","tps_15m","players_online","mspt","cpu_sys","cpu_proc","heap_used","heap_max"]
 
     step = max(1, int(step_sec or 60))
-    rid = _realm_id(conn, realm)
-
-    where = ["realm_id = ?"]
-    params: List[Any] = [rid]
-    if since_ts:
-        where.append("collected_at >= FROM_UNIXTIME(?)")
-        params.append(int(since_ts))
-
-    def agg_sql(col: str) -> str:
-        if col in ("heap_max", "players_online"):
-            return f"MAX({col}) AS {col}"
-        return f"AVG({col}) AS {col}"
+    rid = _realm_lookup(conn, realm)
+    if rid is None:
+        return []
 
-    bucket = f"(FLOOR(UNIX_TIMESTAMP(collected_at)/{step})*{step})"
-    select_cols = [f"{bucket} AS ts"] + [agg_sql(c) for c in fset]
+    q = parse_percentile(agg)
+    hist = q is not None and "mspt" in fset
 
-    sql = f"""
-        SELECT {", ".join(select_cols)}
-        FROM stats_samples
-        WHERE {" AND ".join(where)}
-        GROUP BY {bucket}
-        ORDER BY ts ASC
-        LIMIT ?
-    """
-    params.append(int(limit or 720))
-    rows = conn.query_all(sql, params) or []
+    rows = None
+    tier = _pick_rollup_tier(step)
+    if tier is not None:
+        rows = _series_from_rollup(conn, tier, rid, since_ts, step, fset, limit, hist)
+    if not rows:
+        # шаг мельче минуты (или rollup ещё не заполнен) — агрегируем сырые сэмплы
+        rows = _series_from_raw(conn, rid, since_ts, step, fset, limit, hist)
 
     out: List[Dict[str, Any]] = []
     for r in rows:
         item: Dict[str, Any] = {"ts": int(r["ts"])}
         for k in fset:
             item[k] = _num(r.get(k))
+        if hist:
+            counts = [r.get(c) for c in _MSPT_HIST_COLS]
+            # бакеты, записанные до появления гистограммы, пустые — там остаётся среднее
+            if any(counts):
+                item["mspt"] = hist_percentile(counts, q)
         if "cpu_sys" in item:
             item["cpu_system_load"] = item["cpu_sys"]
         if "cpu_proc" in item:
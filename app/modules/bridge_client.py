@@ -5,18 +5,99 @@ import os
 import json
 import asyncio
 import contextlib
+import contextvars
+import concurrent.futures
+import itertools
+import secrets
 import threading
+import time
 import logging
+from collections import deque
 from logging import Logger
-from typing import Any, Dict, Optional, Sequence, Iterable, Union, Tuple, List, TYPE_CHECKING
+from typing import Any, Callable, Dict, Optional, Sequence, Iterable, Union, Tuple, List, TYPE_CHECKING
 
 import websockets
+from websockets.extensions.permessage_deflate import PerMessageDeflate, ClientPerMessageDeflateFactory
+from websockets.frames import CTRL_OPCODES, OP_CONT
+
+try:
+    import msgpack  # опционально: бинарные кадры с бриджем
+except Exception:
+    msgpack = None  # type: ignore
+try:
+    import orjson  # опционально: быстрый JSON
+except Exception:
+    orjson = None  # type: ignore
+try:
+    import ujson  # опционально: быстрый JSON, если нет orjson
+except Exception:
+    ujson = None  # type: ignore
+try:
+    import uvloop  # опционально: цикл фонового потока соединения
+except Exception:
+    uvloop = None  # type: ignore
 
 # -------- конфиг --------
 BRIDGE_URL: str = os.getenv("SP_BRIDGE_URL", "ws://127.0.0.1:8765/ws")
 BRIDGE_TOKEN: str = os.getenv("SP_TOKEN", "SUPER_SECRET")
 BRIDGE_TIMEOUT: float = float(os.getenv("BRIDGE_TIMEOUT", "8.0"))   # сек
 BRIDGE_MAX_SIZE: int = int(os.getenv("SP_MAX_SIZE", "131072"))      # 128 KiB (как у сервера по умолчанию)
+# кодировка кадров: auto — MessagePack, если установлен msgpack и бридж его принял, иначе JSON
+BRIDGE_ENCODING: str = (os.getenv("SP_BRIDGE_ENCODING") or "auto").strip().lower()
+_SUBPROTO_MSGPACK = "sp.msgpack"
+_SUBPROTO_JSON = "sp.json"
+
+# JSON-кодек кадров (как у бриджа): auto — orjson, затем ujson, затем stdlib json
+JSON_CODEC_WANTED: str = (os.getenv("SP_JSON_CODEC") or "auto").strip().lower()
+JSON_CODEC: str = (
+    "orjson" if JSON_CODEC_WANTED in ("auto", "orjson") and orjson is not None else
+    "ujson" if JSON_CODEC_WANTED in ("auto", "ujson") and ujson is not None else
+    "json"
+)
+# цикл событий потока соединения: auto — uvloop, если установлен
+UVLOOP_ENABLED: bool = uvloop is not None and (os.getenv("SP_UVLOOP") or "auto").strip().lower() not in (
+    "0", "", "false", "no", "off")
+
+# permessage-deflate: уровень/memLevel/порог — для того, что сжимает панель (панель -> бридж);
+# окна предлагаются бриджу по направлениям (SERVER — бридж -> панель, CLIENT — панель -> бридж)
+DEFLATE_ENABLED: bool = (os.getenv("SP_DEFLATE", "1").lower() not in ("0", "", "false", "no", "off"))
+DEFLATE_LEVEL: int = int(os.getenv("SP_DEFLATE_LEVEL", "6"))
+DEFLATE_MEM_LEVEL: int = int(os.getenv("SP_DEFLATE_MEM_LEVEL", "5"))
+DEFLATE_MIN_SIZE: int = int(os.getenv("SP_DEFLATE_MIN_SIZE", "256"))   # короче — без сжатия
+DEFLATE_SERVER_WBITS: int = int(os.getenv("SP_DEFLATE_SERVER_WBITS", "12"))
+DEFLATE_CLIENT_WBITS: int = int(os.getenv("SP_DEFLATE_CLIENT_WBITS", "12"))
+
+# admin.origin (аудит действий из панели) копится в очереди и уходит пачками
+ORIGIN_QUEUE_SIZE: int = int(os.getenv("SP_ORIGIN_QUEUE", "2000"))    # сверх этого — отбрасываем
+ORIGIN_BATCH_MAX: int = int(os.getenv("SP_ORIGIN_BATCH", "100"))      # записей в одном кадре
+ORIGIN_FLUSH_MS: int = int(os.getenv("SP_ORIGIN_FLUSH_MS", "250"))    # как долго копим пачку
+
+# console.batch: тысячи команд уходят кадрами по BATCH_CHUNK, по кадру — один итоговый ответ
+BATCH_CHUNK: int = int(os.getenv("SP_BATCH_CHUNK", "200"))             # команд в одном кадре
+BATCH_CMD_TIMEOUT: float = float(os.getenv("SP_BATCH_CMD_TIMEOUT", "10"))  # сек на console_done команды
+BATCH_OUTPUT_LINES: int = int(os.getenv("SP_BATCH_OUTPUT_LINES", "3"))  # строк вывода на команду в итоге
+
+# кто стоит за запросом на общем сокете: бридж считает лимиты по (соединение, actor), чтобы один
+# оператор или фоновый опрос не выбирал лимит за всех
+_ACTOR: contextvars.ContextVar[str] = contextvars.ContextVar("bridge_actor", default="background")
+
+def _current_actor() -> str:
+    """Пользователь сессии (или IP) внутри HTTP-запроса Flask, иначе "background"."""
+    try:
+        from flask import has_request_context, request, session
+        if has_request_context():
+            for key in ("username", "user", "login", "user_id"):
+                v = session.get(key)
+                if v:
+                    return f"user:{v}"
+            return f"ip:{request.remote_addr or '-'}"
+    except Exception:
+        pass
+    return _ACTOR.get()
+
+async def _as_actor(actor: str, coro) -> Any:
+    _ACTOR.set(actor)
+    return await coro
 
 # -------- логирование --------
 def _setup_logger() -> Logger:
@@ -67,44 +148,101 @@ def _safe_trunc(s: Any) -> str:
 
 # ====================== ВСПОМОГАТЕЛЬНОЕ ======================
 
-def _run(coro) -> Any:
-    try:
-        asyncio.get_running_loop()
-    except RuntimeError:
-        _log.debug("run: using asyncio.run for coroutine=%s", getattr(coro, "__name__", "<coro>"))
-        return asyncio.run(coro)
-
-    box: Dict[str, Any] = {}
+def _stdlib_dumps(obj: Any) -> str:
+    return json.dumps(obj, ensure_ascii=False)
 
-    def runner():
-        loop = asyncio.new_event_loop()
+if JSON_CODEC == "orjson":
+    def _json_dumps(obj: Any) -> str:
         try:
-            asyncio.set_event_loop(loop)
-            _log.debug("runner: new event loop started")
-            box["result"] = loop.run_until_complete(coro)
-        except Exception:
-            _log.exception("runner: coroutine crashed")
-            box["error"] = RuntimeError("bridge_client runner failed")
-        finally:
-            with contextlib.suppress(Exception):
-                loop.run_until_complete(asyncio.sleep(0))
-            loop.close()
-            _log.debug("runner: event loop closed")
-
-    t = threading.Thread(target=runner, name="bridge-client-runner", daemon=True)
-    t.start()
-    t.join()
-    if "error" in box:
-        raise box["error"]
-    return box.get("result")
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:
+            return _stdlib_dumps(obj)  # int больше 64 бит и прочее, что orjson не умеет
+    _loads = orjson.loads
+elif JSON_CODEC == "ujson":
+    def _json_dumps(obj: Any) -> str:
+        try:
+            return ujson.dumps(obj, ensure_ascii=False)
+        except (TypeError, OverflowError):
+            return _stdlib_dumps(obj)
+    _loads = ujson.loads
+else:
+    _json_dumps = _stdlib_dumps
+    _loads = json.loads
 
 def _json_loads(s: str) -> Dict[str, Any]:
     try:
-        return json.loads(s or "{}")
+        return _loads(s or "{}")
     except Exception:
         _log.warning("json_loads: bad json: %s", _safe_trunc(s))
         return {"type": "bridge.error", "error": "bad_json", "payload": {"raw": (s[:200] + "...") if s else ""}}
 
+def _binary_wanted() -> bool:
+    return msgpack is not None and BRIDGE_ENCODING in ("auto", "msgpack")
+
+def _encode(ws, message: Dict[str, Any]) -> Union[str, bytes]:
+    """Кадр в той кодировке, о которой договорились при рукопожатии."""
+    if getattr(ws, "subprotocol", None) == _SUBPROTO_MSGPACK:
+        return msgpack.packb(message, use_bin_type=True, default=str)
+    return _json_dumps(message)
+
+def _decode_binary(raw: bytes) -> Optional[Dict[str, Any]]:
+    if msgpack is None:
+        return None
+    try:
+        obj = msgpack.unpackb(raw, raw=False, strict_map_key=False)
+    except Exception:
+        _log.warning("ws.recv: bad msgpack frame len=%d", len(raw))
+        return None
+    return obj if isinstance(obj, dict) else None
+
+class _MeteredDeflate(PerMessageDeflate):
+    """permessage-deflate с порогом по размеру и счётчиками: raw — байты сообщений, wire — после сжатия."""
+
+    def __init__(self, *args, min_size: int = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.min_size = min_size
+        self.counters = {"out_raw": 0, "out_wire": 0, "out_skipped": 0, "in_raw": 0, "in_wire": 0}
+
+    def encode(self, frame):
+        if frame.opcode in CTRL_OPCODES:
+            return frame
+        raw = len(frame.data)
+        if frame.opcode is not OP_CONT and frame.fin and raw < self.min_size:
+            self.counters["out_skipped"] += 1
+            out = frame
+        else:
+            out = super().encode(frame)
+        self.counters["out_raw"] += raw
+        self.counters["out_wire"] += len(out.data)
+        return out
+
+    def decode(self, frame, *, max_size=None):
+        if frame.opcode in CTRL_OPCODES:
+            return frame
+        wire = len(frame.data)
+        out = super().decode(frame, max_size=max_size)
+        self.counters["in_wire"] += wire
+        self.counters["in_raw"] += len(out.data)
+        return out
+
+class _MeteredDeflateFactory(ClientPerMessageDeflateFactory):
+    def process_response_params(self, params, accepted_extensions):
+        ext = super().process_response_params(params, accepted_extensions)
+        return _MeteredDeflate(
+            ext.remote_no_context_takeover, ext.local_no_context_takeover,
+            ext.remote_max_window_bits, ext.local_max_window_bits, ext.compress_settings,
+            min_size=DEFLATE_MIN_SIZE,
+        )
+
+def _deflate_extensions() -> List[Any]:
+    if not DEFLATE_ENABLED:
+        return []
+    return [_MeteredDeflateFactory(
+        server_max_window_bits=DEFLATE_SERVER_WBITS,
+        client_max_window_bits=DEFLATE_CLIENT_WBITS,
+        compress_settings={"level": DEFLATE_LEVEL, "memLevel": DEFLATE_MEM_LEVEL},
+    )]
+
 # ====================== НИЗКОУРОВНЕВЫЙ WS ======================
 
 async def _connect():
@@ -117,10 +255,16 @@ async def _connect():
                 ping_interval=20,
                 ping_timeout=20,
                 max_size=BRIDGE_MAX_SIZE,
+                # старый бридж сабпротоколы не выбирает — тогда остаётся JSON
+                subprotocols=[_SUBPROTO_MSGPACK, _SUBPROTO_JSON] if _binary_wanted() else None,
+                compression=None,
+                extensions=_deflate_extensions(),
             ),
             timeout=BRIDGE_TIMEOUT,
         )
-        _log.info("ws.connect: connected")
+        _log.info("ws.connect: connected (encoding=%s, json=%s, loop=%s)",
+                  "msgpack" if ws.subprotocol == _SUBPROTO_MSGPACK else "json", JSON_CODEC,
+                  "uvloop" if UVLOOP_ENABLED else "asyncio")
         return ws
     except Exception:
         _log.exception("ws.connect: failed")
@@ -135,18 +279,337 @@ async def _graceful_close(ws, code: int = 1000, reason: str = "ok") -> None:
     except Exception:
         _log.exception("ws.close: failed")
 
-async def _recv_with_timeout(ws, timeout: float) -> Dict[str, Any]:
-    try:
-        raw = await asyncio.wait_for(ws.recv(), timeout=timeout)
-    except asyncio.TimeoutError:
-        _log.warning("ws.recv: timeout after %.2fs", timeout)
-        raise
-    if isinstance(raw, (bytes, bytearray)):
-        _log.debug("ws.recv: binary frame len=%d", len(raw))
-        return {"type": "bridge.binary", "len": len(raw)}
-    obj = _json_loads(raw)
-    _log.debug("ws.recv: type=%s", obj.get("type"))
-    return obj
+def _frame_realm(obj: Dict[str, Any]) -> Any:
+    return (
+        obj.get("realm")
+        or (obj.get("payload") or {}).get("realm")
+        or (obj.get("data") or {}).get("realm")
+    )
+
+class BridgeThrottled(RuntimeError):
+    """Бридж отклонил запрос по лимиту (bridge.throttled); retry_after — через сколько секунд можно снова."""
+
+    def __init__(self, frame: Dict[str, Any]):
+        p = frame.get("payload") or {}
+        self.frame = frame
+        self.retry_after = (p.get("retry_after_ms") or 0) / 1000.0
+        super().__init__(f"throttled by bridge: {p.get('type')} realm={p.get('realm')}, "
+                         f"retry after {self.retry_after:.2f}s")
+
+class _Waiter:
+    """Ожидание ответа на один запрос (req_id) внутри общего соединения."""
+    __slots__ = ("future", "expect_types", "realm")
+
+    def __init__(self, future: "asyncio.Future", expect_types: Optional[Sequence[str]], realm: Optional[str]):
+        self.future = future
+        self.expect_types = tuple(expect_types) if expect_types else None
+        self.realm = realm
+
+    def accepts(self, obj: Dict[str, Any]) -> bool:
+        """Кадр с нашим req_id: без expect_types подходит первый же (обычно bridge.ack)."""
+        return self.expect_types is None or obj.get("type") in self.expect_types or obj.get("type") == "bridge.throttled"
+
+    def matches_legacy(self, obj: Dict[str, Any]) -> bool:
+        """Кадр без req_id (старый плагин) — сопоставляем по type/realm, как раньше."""
+        if self.expect_types is None or obj.get("type") not in self.expect_types:
+            return False
+        return not self.realm or _frame_realm(obj) == self.realm
+
+class _BridgeConnection:
+    """
+    Одно долгоживущее admin-соединение с бриджем на процесс.
+
+    Свой event loop крутится в фоновом потоке; Flask-потоки передают туда корутины
+    через run_coroutine_threadsafe. Каждый запрос получает req_id, бридж возвращает
+    его в ack и прокидывает плагину, поэтому ответы раздаются по таблице ожидающих.
+    Кадры без req_id (старые плагины) сопоставляются по type/realm самому старому
+    ожидающему. При обрыве все ожидающие получают ConnectionError, следующий запрос
+    переподключается.
+
+    Потоковые кадры (консоль и т.п.) приходят по подпискам (realm, type): набор подписок
+    процесса держится здесь же, отправляется бриджу при каждом (пере)подключении, а пока
+    есть хоть одна подписка — соединение восстанавливается само, с нарастающей паузой.
+    После переподключения бридж досылает кадры, пропущенные за время обрыва (resume_from).
+    """
+
+    def __init__(self) -> None:
+        self._guard = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._pid = os.getpid()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._ws = None
+        self._reader_task: Optional["asyncio.Task"] = None
+        self._connect_lock: Optional[asyncio.Lock] = None
+        self._pending: Dict[str, _Waiter] = {}  # req_id -> waiter (порядок вставки = порядок запросов)
+        self._req_seq = itertools.count(1)
+        self._req_prefix = f"{os.getpid():x}-{secrets.token_hex(3)}"
+        self._streams: Dict[Tuple[str, str], List[Callable[[Dict[str, Any]], None]]] = {}
+        self._reconnect_task: Optional["asyncio.Task"] = None
+        # последний увиденный seq потоковых кадров и epoch бриджа — для досылки пропущенного
+        self._last_seq: Optional[int] = None
+        self._epoch: Optional[str] = None
+
+    # ---- event loop thread ----
+
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._guard:
+            if self._pid != os.getpid():
+                # после fork поток с циклом не наследуется — начинаем с чистого листа
+                self._reset()
+            if self._loop is None or not (self._thread and self._thread.is_alive()):
+                loop = uvloop.new_event_loop() if UVLOOP_ENABLED else asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def runner():
+                    asyncio.set_event_loop(loop)
+                    loop.call_soon(ready.set)
+                    _log.debug("bridge loop: started")
+                    loop.run_forever()
+
+                t = threading.Thread(target=runner, name="bridge-client-loop", daemon=True)
+                t.start()
+                ready.wait()
+                self._loop, self._thread = loop, t
+                self._connect_lock = None
+                self._ws = None
+            return self._loop
+
+    def run(self, coro, timeout: float) -> Any:
+        loop = self.loop()
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            coro.close()
+            raise RuntimeError("bridge_client: sync API called from the bridge loop itself")
+        fut = asyncio.run_coroutine_threadsafe(_as_actor(_current_actor(), coro), loop)
+        try:
+            # запас сверху: сама корутина ограничена своим timeout + временем коннекта
+            return fut.result(timeout=timeout + BRIDGE_TIMEOUT + 1.0)
+        except concurrent.futures.TimeoutError:
+            fut.cancel()
+            raise asyncio.TimeoutError(f"bridge call timed out after {timeout:.1f}s")
+
+    # ---- connection ----
+
+    async def _get_ws(self):
+        ws = self._ws
+        if ws is not None and ws.open:
+            return ws
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            ws = self._ws
+            if ws is not None and ws.open:
+                return ws
+            ws = await _connect()
+            # запрос/ответ адресуется по req_id, поэтому подписываемся только на нужные потоки;
+            # даже пустая подписка выключает для сокета firehose на стороне бриджа
+            await ws.send(_encode(ws, self._topics_frame(resume=True)))
+            self._ws = ws
+            self._reader_task = asyncio.get_running_loop().create_task(self._reader(ws))
+            return ws
+
+    async def _reader(self, ws) -> None:
+        reason: BaseException = ConnectionError("bridge connection closed")
+        try:
+            async for raw in ws:
+                if isinstance(raw, (bytes, bytearray)):
+                    obj = _decode_binary(raw)
+                    if obj is None:
+                        _log.debug("ws.recv: binary frame len=%d", len(raw))
+                        continue
+                    self._dispatch(obj)
+                    continue
+                self._dispatch(_json_loads(raw))
+        except Exception as e:
+            _log.warning("ws.reader: connection lost: %s", e)
+            reason = ConnectionError(f"bridge connection lost: {e}")
+        finally:
+            if self._ws is ws:
+                self._ws = None
+            self._fail_all(reason)
+            if self._streams:
+                self._notify_streams({"type": "bridge.error", "error": str(reason)})
+                self._schedule_reconnect()
+
+    # ---- stream subscriptions ----
+
+    def _topics_frame(self, resume: bool = False) -> Dict[str, Any]:
+        by_realm: Dict[str, List[str]] = {}
+        for realm, t in self._streams:
+            by_realm.setdefault(realm, []).append(t)
+        frame = {
+            "type": "admin.subscribe",
+            "replace": True,
+            "topics": [{"realm": r, "types": sorted(ts)} for r, ts in sorted(by_realm.items())],
+        }
+        # при переподключении просим только пропущенное; при смене подписок на живом сокете — нет,
+        # иначе уже полученные кадры пришли бы второй раз
+        if resume and self._last_seq is not None and self._streams:
+            frame["resume_from"] = self._last_seq
+            frame["epoch"] = self._epoch
+        return frame
+
+    def _notify_streams(self, obj: Dict[str, Any]) -> None:
+        seen = set()
+        for listeners in self._streams.values():
+            for cb in listeners:
+                if cb in seen:
+                    continue
+                seen.add(cb)
+                try:
+                    cb(obj)
+                except Exception:
+                    _log.exception("stream listener failed")
+
+    def _schedule_reconnect(self) -> None:
+        if self._reconnect_task is None or self._reconnect_task.done():
+            self._reconnect_task = asyncio.get_running_loop().create_task(self._reconnect_loop())
+
+    async def _reconnect_loop(self) -> None:
+        delay = 1.0
+        while self._streams:
+            await asyncio.sleep(delay)
+            try:
+                await self._get_ws()
+                return
+            except Exception:
+                delay = min(delay * 2, 30.0)
+
+    def _stream_change(self, realm: str, types: Tuple[str, ...],
+                       callback: Callable[[Dict[str, Any]], None], add: bool) -> None:
+        for t in types:
+            key = (realm, t)
+            listeners = self._streams.setdefault(key, [])
+            if add:
+                listeners.append(callback)
+            else:
+                with contextlib.suppress(ValueError):
+                    listeners.remove(callback)
+            if not listeners:
+                del self._streams[key]
+        asyncio.get_running_loop().create_task(self._sync_topics())
+
+    async def _sync_topics(self) -> None:
+        try:
+            await self._send(self._topics_frame())
+        except Exception as e:
+            _log.warning("stream subscribe failed: %s", e)
+            if self._streams:
+                self._notify_streams({"type": "bridge.error", "error": str(e)})
+                self._schedule_reconnect()
+
+    def stream_subscribe(self, realm: str, types: Sequence[str],
+                         callback: Callable[[Dict[str, Any]], None]) -> None:
+        """callback вызывается в потоке цикла бриджа — он должен быть быстрым и потокобезопасным."""
+        self.loop().call_soon_threadsafe(self._stream_change, realm, tuple(types), callback, True)
+
+    def stream_unsubscribe(self, realm: str, types: Sequence[str],
+                           callback: Callable[[Dict[str, Any]], None]) -> None:
+        self.loop().call_soon_threadsafe(self._stream_change, realm, tuple(types), callback, False)
+
+    # ---- dispatch ----
+
+    def _dispatch(self, obj: Dict[str, Any]) -> None:
+        t = obj.get("type")
+        rid = obj.get("req_id")
+        _log.debug("ws.recv: type=%s req_id=%s", t, rid)
+        seq = obj.get("seq")
+        if isinstance(seq, int) and (self._last_seq is None or seq > self._last_seq):
+            self._last_seq = seq
+        elif t == "admin.subscribe.ok":
+            self._on_subscribed(obj.get("payload") or {})
+        elif t == "bridge.resume":
+            p = obj.get("payload") or {}
+            if p.get("gap"):
+                _log.warning("bridge resume: frames lost (%s), from=%s to=%s", p.get("reason"), p.get("from"), p.get("to"))
+            else:
+                _log.info("bridge resume: replayed=%s from=%s to=%s", p.get("replayed"), p.get("from"), p.get("to"))
+        if self._streams:
+            listeners = self._streams.get((_frame_realm(obj), t))
+            for cb in list(listeners or ()):
+                try:
+                    cb(obj)
+                except Exception:
+                    _log.exception("stream listener failed")
+        if rid:
+            w = self._pending.get(str(rid))
+            if w is not None and not w.future.done() and w.accepts(obj):
+                if t == "bridge.throttled":
+                    w.future.set_exception(BridgeThrottled(obj))
+                else:
+                    w.future.set_result(obj)
+            return
+        for w in self._pending.values():
+            if not w.future.done() and w.matches_legacy(obj):
+                w.future.set_result(obj)
+                return
+
+    def _on_subscribed(self, p: Dict[str, Any]) -> None:
+        epoch, seq = p.get("epoch"), p.get("seq")
+        if not isinstance(seq, int):
+            return  # старый бридж без досылки
+        if epoch != self._epoch or self._last_seq is None:
+            # первое подключение или бридж перезапустился: отсчёт с текущего seq
+            self._epoch = epoch
+            self._last_seq = seq
+
+    def _fail_all(self, exc: BaseException) -> None:
+        for w in self._pending.values():
+            if not w.future.done():
+                w.future.set_exception(exc)
+
+    def next_req_id(self) -> str:
+        return f"{self._req_prefix}-{next(self._req_seq)}"
+
+    async def _send(self, message: Dict[str, Any]) -> None:
+        for attempt in (1, 2):
+            ws = await self._get_ws()
+            try:
+                await ws.send(_encode(ws, message))
+                return
+            except websockets.ConnectionClosed:
+                if attempt == 2:
+                    raise
+                _log.info("ws.send: connection was closed, reconnecting")
+
+    async def request(
+        self,
+        message: Dict[str, Any],
+        expect_types: Optional[Sequence[str]],
+        realm: Optional[str],
+        timeout: float,
+    ) -> Dict[str, Any]:
+        rid = str(message.get("req_id") or self.next_req_id())
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[rid] = _Waiter(fut, expect_types, realm)
+        try:
+            await self._send({**message, "req_id": rid, "actor": message.get("actor") or _ACTOR.get()})
+            return await asyncio.wait_for(fut, timeout=timeout)
+        except asyncio.TimeoutError:
+            _log.warning("ws.wait: timeout after %.2fs (type=%s req_id=%s)", timeout, message.get("type"), rid)
+            raise
+        finally:
+            self._pending.pop(rid, None)
+
+    async def send_only(self, message: Dict[str, Any]) -> None:
+        await self._send({**message, "req_id": str(message.get("req_id") or self.next_req_id())})
+
+    async def aclose(self) -> None:
+        ws, self._ws = self._ws, None
+        if ws is not None:
+            await _graceful_close(ws)
+
+_BRIDGE = _BridgeConnection()
+
+def _run(coro, timeout: float = BRIDGE_TIMEOUT) -> Any:
+    """Выполнить корутину в фоновом цикле общего соединения и дождаться результата."""
+    return _BRIDGE.run(coro, timeout)
 
 async def _send_and_wait(
     message: Dict[str, Any],
@@ -154,48 +617,109 @@ async def _send_and_wait(
     realm: Optional[str] = None,
     timeout: float = BRIDGE_TIMEOUT,
 ) -> Dict[str, Any]:
-    ws = await _connect()
-    try:
-        payload_for_log = dict(message)
-        if "headers" in payload_for_log:
-            payload_for_log["headers"] = "<hidden>"
-        _log.info("ws.send: %s", _safe_trunc(payload_for_log))
-        await ws.send(json.dumps(message, ensure_ascii=False))
+    payload_for_log = dict(message)
+    if "headers" in payload_for_log:
+        payload_for_log["headers"] = "<hidden>"
+    _log.info("ws.send: %s", _safe_trunc(payload_for_log))
+    obj = await _BRIDGE.request(message, expect_types, realm, timeout)
+    _log.info("ws.wait: got type=%s", obj.get("type"))
+    return obj
 
-        if not expect_types:
-            obj = await _recv_with_timeout(ws, timeout)
-            _log.info("ws.wait: first-frame type=%s", obj.get("type"))
-            return obj
+async def _send_only(message: Dict[str, Any]) -> None:
+    _log.info("ws.send-only: %s", _safe_trunc(message))
+    await _BRIDGE.send_only(message)
 
-        while True:
-            obj = await _recv_with_timeout(ws, timeout)
-            t = obj.get("type")
-            if t not in expect_types:
-                _log.debug("ws.wait: skip frame type=%s, expect=%s", t, expect_types)
-                continue
-            if realm:
-                r = (
-                    obj.get("realm")
-                    or (obj.get("payload") or {}).get("realm")
-                    or (obj.get("data") or {}).get("realm")
-                )
-                if r != realm:
-                    _log.debug("ws.wait: realm mismatch got=%s want=%s", r, realm)
-                    continue
-            _log.info("ws.wait: got expected type=%s", t)
-            return obj
-    finally:
-        await _graceful_close(ws)
+class _OriginBatcher:
+    """
+    Фоновая отправка admin.origin: HTTP-обработчик только кладёт запись в очередь,
+    раз в ORIGIN_FLUSH_MS накопленное уходит одним кадром admin.origin.batch по общему
+    соединению. Очередь ограничена: при перегрузе новые записи отбрасываются (счётчик
+    dropped уходит бриджу со следующей пачкой), запрос при этом не ждёт.
+    """
 
-async def _send_only(message: Dict[str, Any]) -> None:
-    ws = await _connect()
-    try:
-        _log.info("ws.send-only: %s", _safe_trunc(message))
-        await ws.send(json.dumps(message, ensure_ascii=False))
-        with contextlib.suppress(asyncio.TimeoutError):
-            await asyncio.wait_for(asyncio.sleep(0.02), timeout=0.05)
-    finally:
-        await _graceful_close(ws)
+    def __init__(self, conn: _BridgeConnection):
+        self._conn = conn
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._pid = os.getpid()
+        self._q: deque = deque()
+        self._dropped = 0
+        self._scheduled = False
+
+    def enqueue(self, item: Dict[str, Any]) -> bool:
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            if len(self._q) >= ORIGIN_QUEUE_SIZE:
+                self._dropped += 1
+                return False
+            self._q.append(item)
+            if self._scheduled:
+                return True
+            self._scheduled = True
+        try:
+            self._conn.loop().call_soon_threadsafe(self._start)
+        except Exception:
+            with self._lock:
+                self._scheduled = False
+            _log.exception("origin batcher: cannot schedule flush")
+        return True
+
+    def _start(self) -> None:
+        asyncio.get_running_loop().create_task(self._flush_loop())
+
+    def _take(self) -> Tuple[List[Dict[str, Any]], int]:
+        with self._lock:
+            n = min(len(self._q), ORIGIN_BATCH_MAX)
+            items = [self._q.popleft() for _ in range(n)]
+            dropped, self._dropped = self._dropped, 0
+            if not items and not dropped:
+                self._scheduled = False
+            return items, dropped
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(ORIGIN_FLUSH_MS / 1000.0)
+            items, dropped = self._take()
+            if not items and not dropped:
+                return
+            frame = {"type": "admin.origin.batch", "payload": {"items": items, "dropped": dropped}}
+            try:
+                await self._conn.send_only(frame)
+                _log.debug("origin batch sent: items=%d dropped=%d", len(items), dropped)
+            except Exception as e:
+                # бридж недоступен — аудит не критичен, пачку теряем, но считаем
+                _log.warning("origin batch lost (%d items): %s", len(items), e)
+                with self._lock:
+                    self._dropped += dropped + len(items)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"queued": len(self._q), "dropped": self._dropped}
+
+_ORIGINS = _OriginBatcher(_BRIDGE)
+
+def stream_subscribe(realm: str, types: Sequence[str], callback: Callable[[Dict[str, Any]], None]) -> None:
+    """Получать кадры types для realm по общему соединению (без отдельного WS)."""
+    _BRIDGE.stream_subscribe(realm, types, callback)
+
+def stream_unsubscribe(realm: str, types: Sequence[str], callback: Callable[[Dict[str, Any]], None]) -> None:
+    _BRIDGE.stream_unsubscribe(realm, types, callback)
+
+def call_in_bridge_loop(fn: Callable[[], Any]) -> None:
+    """Выполнить fn в потоке цикла общего соединения (для таймеров и колбэков потоковых хабов)."""
+    _BRIDGE.loop().call_soon_threadsafe(fn)
+
+def stream_send(message: Dict[str, Any]) -> None:
+    """Отправить кадр по общему соединению без ожидания (безопасно и из потока цикла бриджа)."""
+    async def send():
+        try:
+            await _BRIDGE.send_only(message)
+        except Exception as e:
+            _log.warning("stream_send failed: %s", e)
+    call_in_bridge_loop(lambda: asyncio.get_running_loop().create_task(send()))
 
 # ---- Sync aliases (compat) ----
 
@@ -204,7 +728,7 @@ def ws_send_and_wait(message: Dict[str, Any],
                      realm: Optional[str] = None,
                      timeout: float = BRIDGE_TIMEOUT) -> Dict[str, Any]:
     return _run(_send_and_wait(message, expect_types=tuple(expect) if expect else None,
-                               realm=realm, timeout=timeout))
+                               realm=realm, timeout=timeout), timeout=timeout)
 
 def send_and_wait(message: Dict[str, Any],
                   expect: Optional[Sequence[str]] = None,
@@ -214,131 +738,136 @@ def send_and_wait(message: Dict[str, Any],
 
 # ====================== УТИЛИТЫ ДЛЯ ФРОНТА ======================
 
-def normalize_server_stats(obj: Dict[str, Any]) -> Dict[str, Any]:
+_WORLD_ORDER: Dict[tuple, list] = {}
+_WORLD_ORDER_MAX = 256
+
+def _worlds_from_map(worlds_map: Dict[str, Any]) -> List[Dict[str, Any]]:
+    items = []
+    for name, info in worlds_map.items():
+        if not isinstance(info, dict):
+            continue
+        item = dict(info)
+        item.setdefault("name", name)
+        item.setdefault("type", item.get("environment") or "NORMAL")
+        item.setdefault("players", item.get("players") or 0)
+        items.append(item)
+    # порядок миров почти не меняется — сортируем один раз на набор имён
+    names = tuple(str(x.get("name", "")) for x in items)
+    order = _WORLD_ORDER.get(names)
+    if order is None:
+        if len(_WORLD_ORDER) >= _WORLD_ORDER_MAX:
+            _WORLD_ORDER.clear()
+        order = _WORLD_ORDER[names] = sorted(range(len(items)), key=lambda i: names[i].lower())
+    return [items[i] for i in order]
+
+def normalize_server_stats(obj: Dict[str, Any], *, heavy: bool = True) -> Dict[str, Any]:
+    """
+    Кадр server.stats/stats.report -> единый вложенный снимок для фронта и БД.
+    heavy=False — не трогать тяжёлые блоки (players_list, worlds, plugins, ...), они будут пустыми.
+    """
     t = obj.get("type")
     if t not in ("server.stats", "stats.report"):
         _log.warning("normalize_stats: unexpected frame type=%s", t)
         return {"type": "bridge.error", "error": "not_stats_frame", "payload": {}}
 
     d = obj.get("data") or obj.get("payload") or {}
-    realm = d.get("realm") or obj.get("realm")
-
-    players_block = d.get("players") or {}
-    players_online = d.get("players_online", players_block.get("online"))
-    players_max = d.get("players_max", players_block.get("max"))
-
-    players_list = d.get("players_list") or []
-
-    worlds_list = d.get("worlds") or []
-    worlds_map = d.get("worlds_map") or {}
-
-    if not worlds_list and isinstance(worlds_map, dict):
-        tmp = []
-        for name, info in worlds_map.items():
-            if not isinstance(info, dict):
-                continue
-            item = dict(info)
-            item.setdefault("name", name)
-            item.setdefault("type", item.get("environment") or "NORMAL")
-            item.setdefault("players", item.get("players") or 0)
-            tmp.append(item)
-        worlds_list = sorted(tmp, key=lambda x: str(x.get("name", "")).lower())
-
-    out = {
+    get = d.get
+    players_block = get("players") or {}
+    tps_block = get("tps") or {}
+
+    if heavy:
+        players_list = get("players_list") or []
+        worlds_map = get("worlds_map") or {}
+        worlds_list = get("worlds") or []
+        if not worlds_list and isinstance(worlds_map, dict) and worlds_map:
+            worlds_list = _worlds_from_map(worlds_map)
+        mem_pools = get("mem_pools") or {}
+        entities_top = get("entities_top_types") or {}
+        entities_total = get("entities_total_types") or {}
+        plugins = get("plugins") or {}
+    else:
+        # тяжёлые блоки не читаем — для сводок и лёгких потребителей
+        players_list, worlds_list, worlds_map = [], [], {}
+        mem_pools, entities_top, entities_total, plugins = {}, {}, {}, {}
+
+    return {
         "type": t,
-        "realm": realm,
+        "realm": get("realm") or obj.get("realm"),
         "players": {
-            "online": players_online,
-            "max": players_max,
+            "online": get("players_online", players_block.get("online")),
+            "max": get("players_max", players_block.get("max")),
         },
-        "motd": d.get("motd"),
+        "motd": get("motd"),
 
         "tps": {
-            "1m": d.get("tps_1m") if d.get("tps_1m") is not None else (d.get("tps") or {}).get("1m"),
-            "5m": d.get("tps_5m") if d.get("tps_5m") is not None else (d.get("tps") or {}).get("5m"),
-            "15m": d.get("tps_15m") if d.get("tps_15m") is not None else (d.get("tps") or {}).get("15m"),
-            "mspt": d.get("mspt") if d.get("mspt") is not None else (d.get("tps") or {}).get("mspt"),
+            "1m": v if (v := get("tps_1m")) is not None else tps_block.get("1m"),
+            "5m": v if (v := get("tps_5m")) is not None else tps_block.get("5m"),
+            "15m": v if (v := get("tps_15m")) is not None else tps_block.get("15m"),
+            "mspt": v if (v := get("mspt")) is not None else tps_block.get("mspt"),
         },
         "heap": {
-            "used": d.get("heap_used"),
-            "max": d.get("heap_max"),
+            "used": get("heap_used"),
+            "max": get("heap_max"),
         },
         "nonheap": {
-            "used": d.get("nonheap_used"),
-            "max": d.get("nonheap_max"),
+            "used": get("nonheap_used"),
+            "max": get("nonheap_max"),
         },
         "jvm": {
-            "uptime_ms": d.get("jvm_uptime_ms"),
+            "uptime_ms": get("jvm_uptime_ms"),
             "classes": {
-                "loaded": d.get("classes_loaded"),
-                "total_loaded": d.get("classes_total_loaded"),
-                "unloaded": d.get("classes_unloaded"),
+                "loaded": get("classes_loaded"),
+                "total_loaded": get("classes_total_loaded"),
+                "unloaded": get("classes_unloaded"),
             },
             "threads": {
-                "live": d.get("threads_live"),
-                "peak": d.get("threads_peak"),
-                "daemon": d.get("threads_daemon"),
+                "live": get("threads_live"),
+                "peak": get("threads_peak"),
+                "daemon": get("threads_daemon"),
             },
-            "gc": d.get("gc") or {},
-            "mem_pools": d.get("mem_pools") or {},
+            "gc": get("gc") or {},
+            "mem_pools": mem_pools,
         },
         "os": {
-            "name": d.get("os_name"),
-            "arch": d.get("os_arch"),
-            "cores": d.get("os_cores"),
+            "name": get("os_name"),
+            "arch": get("os_arch"),
+            "cores": get("os_cores"),
             "cpu_load": {
-                "system": d.get("cpu_system_load"),
-                "process": d.get("cpu_process_load"),
+                "system": get("cpu_system_load"),
+                "process": get("cpu_process_load"),
             },
         },
-        "fs": d.get("fs") or {},
-        "entities_top_types": d.get("entities_top_types") or {},
-        "entities_total_types": d.get("entities_total_types") or {},
-        "plugins": d.get("plugins") or {},
+        "fs": get("fs") or {},
+        "entities_top_types": entities_top,
+        "entities_total_types": entities_total,
+        "plugins": plugins,
         "players_list": players_list,
         "worlds": worlds_list,
         "worlds_map": worlds_map,
     }
-    return out
 
 # ====================== DB (soft import) ======================
 
-# По месту: безопасно подключаемся к твоему database.py и используем save_server_stats.
+# Снимки пишет буферизованный StatsWriter (пачками, со схлопыванием дублей за секунду).
 try:
-    # имена из твоего файла
-    from ..database import (
-        get_db_connection,         # -> MySQLConnection
-        init_stats_schema,         # (conn) -> None
-        save_server_stats,         # (conn, stats: dict, collected_at: datetime|None) -> int
-    )
+    from ..services.stats_writer import writer as _stats_writer
     _DB_OK = True
 except Exception:
-    get_db_connection = None       # type: ignore
-    init_stats_schema = None       # type: ignore
-    save_server_stats = None       # type: ignore
+    _stats_writer = None           # type: ignore
     _DB_OK = False
 
 def _maybe_save_stats_to_db(norm: Dict[str, Any]) -> Optional[int]:
     """
-    Best-effort сохранение нормализованной статистики в БД.
-    Возвращает id вставленной строки или None.
+    Best-effort: поставить нормализованную статистику в очередь записи в БД.
+    id строки появится только после фоновой записи, поэтому всегда возвращает None.
     """
-    if not _DB_OK or get_db_connection is None or save_server_stats is None:
+    if not _DB_OK or _stats_writer is None:
         return None
     try:
-        with get_db_connection() as conn:  # type: ignore[misc]
-            if init_stats_schema:
-                init_stats_schema(conn)    # type: ignore[misc]
-            rid = save_server_stats(conn, norm)  # type: ignore[misc]
-            conn.commit()
-            return int(rid)
+        _stats_writer.submit(norm)
     except Exception as e:
         _log.warning("db.save_stats failed: %s", e)
-        try:
-            conn.rollback()  # type: ignore[name-defined]
-        except Exception:
-            pass
-        return None
+    return None
 
 # ====================== ПУБЛИЧНЫЙ API ======================
 
@@ -364,6 +893,15 @@ def bridge_list() -> Dict[str, Any]:
 
 # ---- Stats ----
 
+def stats_overview(timeout: float = 3.0) -> Dict[str, Any]:
+    """Последние снимки всех realm из кэша бриджа одним запросом (плагины не опрашиваются)."""
+    msg = {"type": "stats.overview"}
+    try:
+        return _run(_send_and_wait(msg, expect_types=("stats.overview.result",), timeout=timeout), timeout=timeout)
+    except Exception as e:
+        _log.warning("stats_overview failed: %s", e)
+        return {"type": "bridge.error", "error": str(e), "payload": {}}
+
 def stats_query(realm: str) -> Dict[str, Any]:
     """
     Запрос статуса сервера.
@@ -410,6 +948,78 @@ def console_exec_lines(realm: str, lines: Sequence[str]) -> Dict[str, Any]:
             "payload": {"sent": False, "realm": realm, "lines": list(lines), "error": str(e)},
         }
 
+def _batch_item(c: Union[str, Dict[str, Any]]) -> Dict[str, Any]:
+    if isinstance(c, str):
+        return {"cmd": c}
+    item = {"cmd": c.get("cmd") or c.get("command") or c.get("command_text") or ""}
+    run_as = c.get("run_as")
+    if run_as and str(run_as).upper() != "CONSOLE":
+        item["run_as"] = str(run_as).upper()
+        item["player"] = c.get("player")
+    delay = c.get("delay_ms", c.get("run_delay_ms"))
+    if delay:
+        item["delay_ms"] = int(delay)
+    return item
+
+def console_batch(realm: str, commands: Sequence[Union[str, Dict[str, Any]]], *,
+                  stop_on_error: bool = False,
+                  output_lines: int = BATCH_OUTPUT_LINES,
+                  cmd_timeout: float = BATCH_CMD_TIMEOUT,
+                  chunk: int = BATCH_CHUNK) -> Dict[str, Any]:
+    """
+    Выполнить команды по порядку одним console.batch на каждые chunk штук (а не запросом на команду).
+    Команда — строка или {cmd, run_as: CONSOLE|PLAYER, player, delay_ms}; delay_ms — пауза перед ней.
+    Возвращает один console.batch.result: total/ok/failed/counts и results[i] = {i, cmd, status, error?, output?}
+    со статусами ok | error | timeout | skipped.
+    """
+    items = [_batch_item(c) for c in commands]
+    results: List[Dict[str, Any]] = []
+    started = time.monotonic()
+    chunk = max(1, chunk)
+    for off in range(0, len(items), chunk):
+        part = items[off:off + chunk]
+        if stop_on_error and any(r.get("status") != "ok" for r in results):
+            results.extend({"i": off + i, "cmd": c["cmd"], "status": "skipped"} for i, c in enumerate(part))
+            continue
+        msg = {"type": "console.batch", "realm": realm, "payload": {
+            "realm": realm, "commands": part, "stop_on_error": stop_on_error,
+            "timeout_ms": int(cmd_timeout * 1000), "output_lines": output_lines,
+        }}
+        # паузы + худший случай: каждое окно команд упирается в таймаут console_done
+        timeout = BRIDGE_TIMEOUT + sum(c.get("delay_ms", 0) for c in part) / 1000.0 + cmd_timeout * (1 + len(part) // 32)
+        try:
+            for attempt in range(5):
+                try:
+                    obj = _run(_send_and_wait(msg, expect_types=("console.batch.result", "bridge.warn"), realm=realm,
+                                              timeout=timeout), timeout=timeout)
+                    break
+                except BridgeThrottled as e:
+                    # пачки подряд упираются в лимит console.batch — ждём токен, а не теряем команды
+                    if attempt == 4:
+                        raise
+                    time.sleep(e.retry_after)
+            error = obj.get("error") or (obj.get("payload") or {}).get("message")
+            got = (obj.get("payload") or {}).get("results") if obj.get("type") == "console.batch.result" else None
+        except Exception as e:
+            _log.exception("console_batch failed: realm=%s chunk=%d..%d", realm, off, off + len(part))
+            error, got = str(e), None
+        if not isinstance(got, list):
+            results.extend({"i": off + i, "cmd": c["cmd"], "status": "error", "error": error or "no result"}
+                           for i, c in enumerate(part))
+            continue
+        for r in got:
+            if isinstance(r, dict):
+                results.append({**r, "i": off + int(r.get("i") or 0)})
+    counts: Dict[str, int] = {}
+    for r in results:
+        counts[r.get("status") or "?"] = counts.get(r.get("status") or "?", 0) + 1
+    return {
+        "type": "console.batch.result",
+        "realm": realm,
+        "payload": {"total": len(items), "ok": counts.get("ok", 0), "failed": len(items) - counts.get("ok", 0),
+                    "counts": counts, "elapsed_ms": int((time.monotonic() - started) * 1000), "results": results},
+    }
+
 # ---- Broadcast / Online ----
 
 def broadcast(realm: str, message: str) -> Dict[str, Any]:
@@ -423,7 +1033,8 @@ def broadcast(realm: str, message: str) -> Dict[str, Any]:
 def player_is_online(realm: str, name_or_uuid: str) -> Dict[str, Any]:
     msg = {"type": "player.is_online", "realm": realm, "name": name_or_uuid}
     try:
-        return _run(_send_and_wait(msg, expect_types=None, realm=realm))
+        return _run(_send_and_wait(msg, expect_types=("player.online", "player.is_online.result", "bridge.warn", "error"),
+                                   realm=realm))
     except Exception as e:
         _log.exception("player_is_online failed: realm=%s name=%s", realm, name_or_uuid)
         return {"type": "bridge.error", "error": str(e), "payload": {"realm": realm, "name": name_or_uuid}}
@@ -507,6 +1118,25 @@ def admin_origin_send(realm: str, action: str, *, extra: Optional[Dict[str, Any]
         _log.exception("admin_origin_send failed: realm=%s action=%s", realm, action)
         return {"type": "bridge.error", "error": str(e), "payload": {"realm": realm, "action": action}}
 
+def admin_origin_enqueue(realm: str, action: str, *, extra: Optional[Dict[str, Any]] = None,
+                         client: Optional[Dict[str, Any]] = None) -> bool:
+    """Аудит без ожидания: запись уйдёт в бридж в составе admin.origin.batch. False — отброшено."""
+    item = _admin_origin_payload(realm=realm, action=action, extra=extra, client=client)["payload"]
+    item["ts"] = time.time()
+    return _ORIGINS.enqueue(item)
+
+def admin_origin_stats() -> Dict[str, Any]:
+    return _ORIGINS.stats()
+
+def bridge_compression_stats() -> Dict[str, Any]:
+    """Сжатие на текущем соединении с бриджем (None в счётчиках — deflate не согласован)."""
+    ws = _BRIDGE._ws
+    counters = None
+    for ext in getattr(ws, "extensions", None) or ():
+        if isinstance(ext, _MeteredDeflate):
+            counters = dict(ext.counters)
+    return {"enabled": DEFLATE_ENABLED, "min_size": DEFLATE_MIN_SIZE, "counters": counters}
+
 def maintenance_whitelist(realm: str, op: str, players: Union[str, Iterable[str], None]) -> Dict[str, Any]:
     action = _normalize_op(op)
 
@@ -633,7 +1263,7 @@ def lp_group_perm_remove(realm: str, group: str, permission: str) -> Dict[str, A
 def lp_user_info(realm: str, user: str) -> Dict[str, Any]:
     msg = {"type": "lp.user.info", "realm": realm, "payload": {"realm": realm, "user": user}}
     try:
-        return _run(_send_and_wait(msg, expect_types=None, realm=realm))
+        return _run(_send_and_wait(msg, expect_types=("lp.user.info.result", "bridge.warn", "error"), realm=realm))
     except Exception as e:
         _log.exception("lp_user_info failed: realm=%s", realm)
         return {"type": "bridge.error", "error": str(e), "payload": {"realm": realm}}
@@ -641,7 +1271,7 @@ def lp_user_info(realm: str, user: str) -> Dict[str, Any]:
 def lp_group_info(realm: str, group: str) -> Dict[str, Any]:
     msg = {"type": "lp.group.info", "realm": realm, "payload": {"realm": realm, "group": group}}
     try:
-        return _run(_send_and_wait(msg, expect_types=None, realm=realm))
+        return _run(_send_and_wait(msg, expect_types=("lp.group.info.result", "bridge.warn", "error"), realm=realm))
     except Exception as e:
         _log.exception("lp_group_info failed: realm=%s", realm)
         return {"type": "bridge.error", "error": str(e), "payload": {"realm": realm}}
@@ -651,7 +1281,7 @@ def lp_group_info(realm: str, group: str) -> Dict[str, Any]:
 def jp_balance_get(realm: str, user: str) -> Dict[str, Any]:
     msg = {"type": "jp.balance.get", "realm": realm, "payload": {"realm": realm, "user": user}}
     try:
-        return _run(_send_and_wait(msg, expect_types=None, realm=realm))
+        return _run(_send_and_wait(msg, expect_types=("jp.balance", "jp.balance.get.result", "bridge.warn", "error"), realm=realm))
     except Exception as e:
         _log.exception("jp_balance_get failed: realm=%s user=%s", realm, user)
         return {"type": "bridge.error", "error": str(e), "payload": {"realm": realm, "user": user}}
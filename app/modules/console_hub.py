@@ -0,0 +1,122 @@
+# app/modules/console_hub.py
+"""
+Общий апстрим для SSE-стримов консоли.
+
+Вместо отдельного WS к бриджу на каждую вкладку браузера процесс держит одну подписку
+на realm поверх общего соединения bridge_client. Кадры раздаются зрителям через
+ограниченные очереди: медленный зритель теряет самые старые строки, а не тормозит
+остальных. Новый зритель сначала получает хвост последних строк (replay), подписка
+снимается, когда уходит последний зритель realm.
+
+Настройки (env):
+  SP_CONSOLE_REPLAY        — сколько последних строк отдавать новому зрителю (200)
+  SP_CONSOLE_VIEWER_QUEUE  — размер очереди одного зрителя (256)
+"""
+from __future__ import annotations
+
+import os
+import threading
+from collections import deque
+from queue import Queue, Empty, Full
+from typing import Any, Dict, List
+
+from .bridge_client import stream_subscribe, stream_unsubscribe
+
+CONSOLE_TYPES = ("console.stream", "bridge.log", "console.out")
+
+REPLAY_SIZE = max(0, int(os.getenv("SP_CONSOLE_REPLAY", "200")))
+VIEWER_QUEUE = max(1, int(os.getenv("SP_CONSOLE_VIEWER_QUEUE", "256")))
+
+
+class Viewer:
+    """Один SSE-клиент: снимок replay на момент подключения + живая очередь."""
+
+    def __init__(self, realm: str, replay: List[Dict[str, Any]]):
+        self.realm = realm
+        self.replay = replay
+        self.dropped = 0
+        self._q: Queue = Queue(maxsize=VIEWER_QUEUE)
+
+    def put(self, item: Dict[str, Any]) -> None:
+        while True:
+            try:
+                self._q.put_nowait(item)
+                return
+            except Full:
+                # вытесняем самый старый элемент, чтобы не блокировать поток бриджа
+                try:
+                    self._q.get_nowait()
+                    self.dropped += 1
+                except Empty:
+                    pass
+
+    def get(self, timeout: float) -> Dict[str, Any]:
+        """Кидает queue.Empty по таймауту."""
+        return self._q.get(timeout=timeout)
+
+
+class _Channel:
+    def __init__(self, hub: "ConsoleHub", realm: str):
+        self.hub = hub
+        self.realm = realm
+        self.ring: deque = deque(maxlen=REPLAY_SIZE or None)
+        self.viewers: set = set()
+        self.subscribed = False
+
+    def publish(self, obj: Dict[str, Any]) -> None:
+        # вызывается в потоке цикла bridge_client
+        if obj.get("type") == "bridge.error":
+            item = {"_err": obj.get("error") or "bridge connection lost"}
+            with self.hub._lock:
+                viewers = list(self.viewers)
+        else:
+            item = obj.get("payload") or obj
+            with self.hub._lock:
+                if REPLAY_SIZE:
+                    self.ring.append(item)
+                viewers = list(self.viewers)
+        for v in viewers:
+            v.put(item)
+
+
+class ConsoleHub:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._channels: Dict[str, _Channel] = {}
+
+    def open(self, realm: str) -> Viewer:
+        with self._lock:
+            ch = self._channels.get(realm)
+            if ch is None:
+                ch = self._channels[realm] = _Channel(self, realm)
+            viewer = Viewer(realm, list(ch.ring))
+            ch.viewers.add(viewer)
+            if not ch.subscribed:
+                # неблокирующий вызов; под локом, чтобы subscribe/unsubscribe не переставлялись
+                stream_subscribe(realm, CONSOLE_TYPES, ch.publish)
+                ch.subscribed = True
+        return viewer
+
+    def close(self, viewer: Viewer) -> None:
+        with self._lock:
+            ch = self._channels.get(viewer.realm)
+            if ch is None or viewer not in ch.viewers:
+                return
+            ch.viewers.discard(viewer)
+            if not ch.viewers and ch.subscribed:
+                stream_unsubscribe(viewer.realm, CONSOLE_TYPES, ch.publish)
+                ch.subscribed = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                realm: {
+                    "viewers": len(ch.viewers),
+                    "replay": len(ch.ring),
+                    "dropped": sum(v.dropped for v in ch.viewers),
+                }
+                for realm, ch in self._channels.items()
+            }
+
+
+hub = ConsoleHub()
@@ -0,0 +1,180 @@
+# app/modules/stats_hub.py
+"""
+Живой поток статистики realm для SSE (/gameservers/api/stats/stream).
+
+Одна подписка на stats.report/server.stats на realm поверх общего соединения bridge_client.
+Кадры нормализуются и схлопываются: зрителям уходит не чаще одного пуша в STATS_STREAM_INTERVAL
+секунд — сначала полный снимок, дальше только изменившиеся ключи верхнего уровня. Если плагин
+сам не присылает stats.report дольше STATS_STREAM_POLL секунд, хаб один раз на весь процесс
+запрашивает stats.query (ответ бридж берёт из своего кэша).
+
+Настройки (env):
+  SP_STATS_STREAM_INTERVAL — минимальный период пушей, сек (2)
+  SP_STATS_STREAM_POLL     — через сколько секунд тишины опросить плагин самим (10; 0 — никогда)
+"""
+from __future__ import annotations
+
+import os
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from .bridge_client import (
+    normalize_server_stats, stream_subscribe, stream_unsubscribe, stream_send, call_in_bridge_loop,
+)
+from .console_hub import Viewer
+
+log = logging.getLogger("stats_hub")
+
+STATS_STREAM_TYPES = ("stats.report", "server.stats")
+STREAM_INTERVAL = max(0.2, float(os.getenv("SP_STATS_STREAM_INTERVAL", "2")))
+STREAM_POLL = max(0.0, float(os.getenv("SP_STATS_STREAM_POLL", "10")))
+
+try:
+    from ..services.stats_writer import writer as _stats_writer
+except Exception:  # БД не настроена — поток работает и без истории
+    _stats_writer = None  # type: ignore
+
+
+def _merge(prev: Dict[str, Any], cur: Dict[str, Any]) -> Dict[str, Any]:
+    """Лёгкие кадры приходят без players_list/worlds — пустые значения не затирают прошлые."""
+    out = dict(prev)
+    out.update({k: v for k, v in cur.items() if v not in (None, [], {})})
+    return out
+
+
+def stats_delta(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """Ключи верхнего уровня, значение которых изменилось (вложенные блоки — целиком)."""
+    return {k: v for k, v in new.items() if old.get(k) != v}
+
+
+class _Channel:
+    def __init__(self, hub: "StatsHub", realm: str):
+        self.hub = hub
+        self.realm = realm
+        self.viewers: set = set()
+        self.subscribed = False
+        self.state: Dict[str, Any] = {}      # последний собранный снимок
+        self.sent: Dict[str, Any] = {}       # то, что уже ушло зрителям
+        self.last_push = 0.0
+        self.last_frame = 0.0
+        self.flush_handle: Optional[asyncio.TimerHandle] = None
+        self.poll_handle: Optional[asyncio.TimerHandle] = None
+
+    # ---- всё ниже выполняется в потоке цикла bridge_client ----
+
+    def on_frame(self, obj: Dict[str, Any]) -> None:
+        if obj.get("type") == "bridge.error":
+            self._broadcast({"_err": obj.get("error") or "bridge connection lost"})
+            return
+        norm = normalize_server_stats(obj)
+        if norm.get("type") == "bridge.error":
+            return
+        norm["ts"] = int(time.time())
+        self.state = _merge(self.state, norm)
+        self.last_frame = time.monotonic()
+        self._schedule_flush()
+        self._schedule_poll()
+
+    def _schedule_flush(self) -> None:
+        if self.flush_handle is not None:
+            return
+        delay = max(0.0, self.last_push + STREAM_INTERVAL - time.monotonic())
+        self.flush_handle = asyncio.get_running_loop().call_later(delay, self.flush)
+
+    def flush(self) -> None:
+        self.flush_handle = None
+        self.last_push = time.monotonic()
+        delta = stats_delta(self.sent, self.state)
+        if not delta:
+            return
+        self.sent = dict(self.state)
+        with self.hub._lock:
+            viewers = list(self.viewers)
+        for v in viewers:
+            self._push(v, delta)
+        if _stats_writer is not None:
+            try:
+                _stats_writer.submit(self.state, realm=self.realm)
+            except Exception as e:
+                log.warning("stats stream: save failed realm=%s: %s", self.realm, e)
+
+    def _push(self, v: Viewer, delta: Dict[str, Any]) -> None:
+        # зритель, потерявший элемент очереди, больше не может применять дельты — шлём ему всё
+        if not getattr(v, "primed", False) or v.dropped != getattr(v, "synced_drops", 0):
+            v.put({"event": "snapshot", "data": self.sent})
+            v.primed = True
+            v.synced_drops = v.dropped
+        else:
+            v.put({"event": "delta", "data": delta})
+
+    def _broadcast(self, item: Dict[str, Any]) -> None:
+        with self.hub._lock:
+            viewers = list(self.viewers)
+        for v in viewers:
+            v.put(item)
+
+    def _schedule_poll(self) -> None:
+        if not STREAM_POLL:
+            return
+        if self.poll_handle is not None:
+            self.poll_handle.cancel()
+        self.poll_handle = asyncio.get_running_loop().call_later(STREAM_POLL, self.poll)
+
+    def poll(self) -> None:
+        self.poll_handle = None
+        if not self.subscribed:
+            return
+        if time.monotonic() - self.last_frame >= STREAM_POLL:
+            stream_send({"type": "stats.query", "realm": self.realm, "payload": {"realm": self.realm}})
+        self._schedule_poll()
+
+    def start(self) -> None:
+        self._schedule_poll()
+        if not self.state:
+            # первый снимок не ждём до STREAM_POLL
+            stream_send({"type": "stats.query", "realm": self.realm, "payload": {"realm": self.realm}})
+
+    def stop(self) -> None:
+        for h in (self.flush_handle, self.poll_handle):
+            if h is not None:
+                h.cancel()
+        self.flush_handle = self.poll_handle = None
+
+
+class StatsHub:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._channels: Dict[str, _Channel] = {}
+
+    def open(self, realm: str) -> Viewer:
+        with self._lock:
+            ch = self._channels.get(realm)
+            if ch is None:
+                ch = self._channels[realm] = _Channel(self, realm)
+            # новый зритель сразу получает последний известный снимок
+            viewer = Viewer(realm, [{"event": "snapshot", "data": ch.sent}] if ch.sent else [])
+            viewer.primed = bool(ch.sent)
+            viewer.synced_drops = 0
+            ch.viewers.add(viewer)
+            if not ch.subscribed:
+                stream_subscribe(realm, STATS_STREAM_TYPES, ch.on_frame)
+                ch.subscribed = True
+                call_in_bridge_loop(ch.start)
+        return viewer
+
+    def close(self, viewer: Viewer) -> None:
+        with self._lock:
+            ch = self._channels.get(viewer.realm)
+            if ch is None or viewer not in ch.viewers:
+                return
+            ch.viewers.discard(viewer)
+            if not ch.viewers and ch.subscribed:
+                stream_unsubscribe(viewer.realm, STATS_STREAM_TYPES, ch.on_frame)
+                ch.subscribed = False
+                call_in_bridge_loop(ch.stop)
+
+
+hub = StatsHub()
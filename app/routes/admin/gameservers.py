@@ -3,6 +3,7 @@ from __future__ import annotations
 
 import os
 import io
+import re
 import json
 import base64
 import asyncio
@@ -20,7 +21,7 @@ from flask import render_template, jsonify, request, send_file, current_app
 
 from ...decorators import login_required
 from ...modules.bridge_client import (
-    bridge_list, bridge_info, stats_query, console_exec, bridge_send,
+    bridge_list, bridge_info, stats_query, stats_overview, console_exec, bridge_send, admin_origin_enqueue,
     maintenance_set, maintenance_whitelist, normalize_server_stats,
     # LuckPerms
     lp_web_open, lp_web_apply,
@@ -31,6 +32,8 @@ from ...modules.bridge_client import (
     # JustPoints
     jp_balance_get, jp_balance_set, jp_balance_add, jp_balance_take,
 )
+from ...modules.console_hub import hub as console_hub
+from ...modules.stats_hub import hub as stats_hub
 
 # --- DB: stats storage (soft import with fallbacks) ---
 try:
@@ -60,6 +63,21 @@ except Exception:  # ultimate fallback when db module is absent
     stats_get_latest = None  # type: ignore
     stats_get_series = None  # type: ignore
 
+try:
+    from ...database import purge_old_stats  # (conn, days=None) -> int
+except Exception:
+    purge_old_stats = None  # type: ignore
+
+try:
+    from ...database import stats_get_latest_all  # (conn) -> list[dict]
+except Exception:
+    stats_get_latest_all = None  # type: ignore
+
+try:
+    from ...services.stats_writer import writer as stats_writer
+except Exception:
+    stats_writer = None  # type: ignore
+
 from . import admin_bp  # Blueprint всего админ-раздела
 
 # ===================== HTML =====================
@@ -147,18 +165,10 @@ def _log_client(action: str, realm: str, meta: Dict[str, Any], extra: Optional[D
         pass
 
 def _bridge_origin(action: str, realm: str, meta: Dict[str, Any], extra: Optional[Dict[str, Any]] = None):
-    """Отправляем в бридж служебный кадр с происхождением действия (fire-and-forget)."""
-    try:
-        bridge_send({
-            "type": "admin.origin",
-            "realm": realm,
-            "payload": {
-                "realm": realm,
-                "action": action,
-                "client": meta,
-                "extra": extra or {}
-            }
-        })
+    """Ставим в очередь служебную запись о происхождении действия (уйдёт в бридж пачкой)."""
+    try:
+        if not admin_origin_enqueue(realm, action, client=meta, extra=extra or {}):
+            current_app.logger.warning("bridge admin.origin dropped: queue full (action=%s realm=%s)", action, realm)
     except Exception:
         current_app.logger.exception("bridge admin.origin failed")
 
@@ -204,7 +214,7 @@ def _merge_with_cache(realm: str, norm: Dict[str, Any]) -> Dict[str, Any]:
     def fresh(c) -> bool:
         return bool(c) and (now - c.get("ts", 0) <= _CACHE_TTL)
 
-    out = dict(norm)
+    out = norm  # свежий результат normalize_server_stats — копировать незачем
 
     # players_list fallback
     pl = (out.get("players_list") or [])
@@ -238,27 +248,39 @@ def _merge_with_cache(realm: str, norm: Dict[str, Any]) -> Dict[str, Any]:
 def _db_stats_enabled() -> bool:
     return bool(get_db_connection and stats_save_snapshot and stats_get_latest and stats_get_series)
 
+_STATS_PURGE_EVERY = float(os.getenv("STATS_PURGE_EVERY_SEC", "3600"))
+_stats_purged_at = 0.0
+
+def _maybe_purge_stats() -> None:
+    """Ступенчатая очистка истории не чаще раза в STATS_PURGE_EVERY_SEC на процесс."""
+    global _stats_purged_at
+    if not purge_old_stats or _STATS_PURGE_EVERY <= 0:
+        return
+    now = time.time()
+    if now - _stats_purged_at < _STATS_PURGE_EVERY:
+        return
+    _stats_purged_at = now
+    try:
+        with get_db_connection() as conn:  # type: ignore[misc]
+            removed = purge_old_stats(conn)  # type: ignore[misc]
+        if removed:
+            current_app.logger.info("stats retention: removed %s rows", removed)
+    except Exception as e:
+        current_app.logger.warning("stats retention failed: %s", e)
+
 def _try_save_stats_to_db(realm: str, norm: Dict[str, Any]) -> Optional[int]:
     """
-    Пытаемся сохранить снимок статистики в БД (если функции доступны).
-    Возвращает snapshot_id или None.
+    Ставим снимок статистики в буфер StatsWriter (запись в БД — пачками в фоне).
+    id строки на момент ответа ещё неизвестен, поэтому возвращает None.
     """
-    if not _db_stats_enabled():
+    if not _db_stats_enabled() or stats_writer is None:
         return None
     try:
-        with get_db_connection() as conn:  # type: ignore[misc]
-            if ensure_stats_schema:
-                ensure_stats_schema(conn)  # type: ignore[misc]
-            snap_id = stats_save_snapshot(conn, realm, norm)  # type: ignore[misc]
-            conn.commit()
-            return int(snap_id) if snap_id is not None else None
+        stats_writer.submit(norm, realm=realm)
     except Exception as e:
         current_app.logger.warning("stats DB save failed realm=%s: %s", realm, e)
-        try:
-            conn.rollback()  # type: ignore[name-defined]
-        except Exception:
-            pass
-        return None
+    _maybe_purge_stats()
+    return None
 
 @admin_bp.route("/gameservers/api/stats")
 @login_required
@@ -284,11 +306,8 @@ def api_stats():
         # Подмешаем players_list/worlds из кэша при необходимости
         norm = _merge_with_cache(realm, norm)
 
-        # Сохраняем слепок в БД (best-effort)
-        snap_id = _try_save_stats_to_db(realm, norm)
-        if snap_id is not None:
-            norm = dict(norm)
-            norm["_snapshot_id"] = snap_id
+        # Сохраняем слепок в БД (best-effort, фоновой пачкой)
+        _try_save_stats_to_db(realm, norm)
 
         return jsonify({"ok": True, "data": norm})
     except Exception as e:
@@ -304,6 +323,130 @@ def api_stats():
                 pass
         return jsonify({"ok": False, "error": "bridge error"}), 502
 
+def _overview_item(realm: str, d: Dict[str, Any], source: str) -> Dict[str, Any]:
+    tps = d.get("tps") or {}
+    return {
+        "realm": realm,
+        "source": source,
+        "ts": d.get("ts"),
+        "players": {"online": (d.get("players") or {}).get("online"), "max": (d.get("players") or {}).get("max")},
+        "tps": {"1m": tps.get("1m"), "5m": tps.get("5m"), "15m": tps.get("15m"), "mspt": tps.get("mspt")},
+        "mspt": tps.get("mspt") if tps.get("mspt") is not None else d.get("mspt"),
+        "heap": {"used": (d.get("heap") or {}).get("used"), "max": (d.get("heap") or {}).get("max")},
+        "jvm": {"uptime_ms": (d.get("jvm") or {}).get("uptime_ms")},
+    }
+
+@admin_bp.route("/gameservers/api/overview")
+@login_required
+def api_overview():
+    """
+    Сводка по всем realm одним ответом: онлайн-плагины + последние players/TPS/MSPT/heap.
+    Данные — из кэша последних снимков бриджа (плагины не опрашиваются), недостающие —
+    одним запросом «последний сэмпл на realm» из БД. Поддерживает ETag / If-None-Match (304).
+    """
+    online: Dict[str, int] = {}
+    realms: Dict[str, Dict[str, Any]] = {}
+    bridge_ok = False
+
+    ov = stats_overview()
+    if ov.get("type") == "stats.overview.result":
+        bridge_ok = True
+        p = ov.get("payload") or {}
+        online = {str(k): int(v or 0) for k, v in (p.get("online") or {}).items()}
+        for realm, ent in (p.get("latest") or {}).items():
+            norm = normalize_server_stats({"type": "server.stats", "realm": realm, "data": ent.get("data") or {}},
+                                          heavy=False)
+            norm["ts"] = int(ent.get("ts") or 0)
+            realms[realm] = _overview_item(realm, norm, "bridge")
+
+    if _db_stats_enabled() and stats_get_latest_all:
+        try:
+            with get_db_connection() as conn:  # type: ignore[misc]
+                rows = stats_get_latest_all(conn)  # type: ignore[misc]
+            for row in rows:
+                cur = realms.get(row["realm"])
+                if cur is None or (cur.get("ts") or 0) < (row.get("ts") or 0):
+                    realms[row["realm"]] = _overview_item(row["realm"], row, "db")
+        except Exception as e:
+            current_app.logger.warning("overview db failed: %s", e)
+
+    if not bridge_ok and not realms:
+        return jsonify({"ok": False, "error": ov.get("error") or "bridge unavailable"}), 502
+
+    for realm in online:
+        realms.setdefault(realm, _overview_item(realm, {}, "none"))
+    for realm, item in realms.items():
+        item["plugins"] = online.get(realm, 0)
+
+    resp = jsonify({"ok": True, "data": {"realms": realms, "online": online, "bridge": bridge_ok}})
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.add_etag()
+    return resp.make_conditional(request)
+
+@admin_bp.route("/gameservers/api/stats/stream")
+@login_required
+def api_stats_stream():
+    """
+    SSE: живая статистика realm вместо опроса /api/stats.
+    event: snapshot — полный нормализованный снимок (первым и после потерь),
+    event: delta — только изменившиеся ключи верхнего уровня.
+    interval (сек, необязательно) — не чаще одного события за столько секунд для этого клиента;
+    сервер в любом случае не пушит чаще SP_STATS_STREAM_INTERVAL.
+    """
+    realm = (request.args.get("realm") or "").strip()
+    if not realm:
+        return jsonify({"ok": False, "error": "realm required"}), 400
+    try:
+        interval = max(0.0, float(request.args.get("interval") or 0))
+    except ValueError:
+        interval = 0.0
+
+    viewer = stats_hub.open(realm)
+
+    def event(item: Dict[str, Any]) -> str:
+        if "_err" in item:
+            return f"event: err\ndata: {json.dumps(item, ensure_ascii=False)}\n\n"
+        return f"event: {item['event']}\ndata: {json.dumps(item['data'], ensure_ascii=False, default=str)}\n\n"
+
+    def gen():
+        yield "retry: 2000\n\n"
+        try:
+            for item in viewer.replay:
+                yield event(item)
+            next_at = 0.0
+            while True:
+                try:
+                    item = viewer.get(timeout=20)
+                except Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                wait = next_at - time.monotonic()
+                if wait > 0 and "_err" not in item:
+                    # клиент просил реже: копим и склеиваем дельты (snapshot перекрывает всё до него)
+                    time.sleep(wait)
+                    while True:
+                        try:
+                            more = viewer.get(timeout=0)
+                        except Empty:
+                            break
+                        if "_err" in more:
+                            continue
+                        if more["event"] == "snapshot":
+                            item = more
+                        else:
+                            item = {"event": item["event"], "data": {**item["data"], **more["data"]}}
+                next_at = time.monotonic() + interval
+                yield event(item)
+        except GeneratorExit:
+            pass
+        finally:
+            stats_hub.close(viewer)
+
+    resp = current_app.response_class(gen(), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
+
 @admin_bp.route("/gameservers/api/stats/latest")
 @login_required
 def api_stats_latest_from_db():
@@ -327,6 +470,8 @@ def api_stats_latest_from_db():
         current_app.logger.exception("stats_latest db failed: %s", e)
         return jsonify({"ok": False, "error": "db error"}), 500
 
+_PERCENTILE_RE = re.compile(r"p(?:[1-9]\d?)(?:\.\d+)?")
+
 @admin_bp.route("/gameservers/api/stats/series")
 @login_required
 def api_stats_series_from_db():
@@ -338,6 +483,7 @@ def api_stats_series_from_db():
       step: шаг агрегации в секундах (например, 60/120/300). По умолчанию 60.
       limit: максимальное число точек (бэкап-ограничение), по умолчанию 720.
       fields: CSV из известных ключей (players_online, tps_1m, mspt, heap_used, cpu_system_load, cpu_process_load, etc)
+      agg: avg (по умолчанию) или перцентиль p50/p95/p99/p99.9 — применяется к mspt
     """
     realm = (request.args.get("realm") or "").strip()
     if not realm:
@@ -365,6 +511,10 @@ def api_stats_series_from_db():
         }
         fields = [alias.get(f, f) for f in raw_fields]
 
+    agg = (request.args.get("agg") or "avg").strip().lower()
+    if agg != "avg" and not _PERCENTILE_RE.fullmatch(agg):
+        return jsonify({"ok": False, "error": "agg must be avg or pNN"}), 400
+
     since_ts = int(time.time() - minutes * 60)
 
     try:
@@ -372,9 +522,10 @@ def api_stats_series_from_db():
             if ensure_stats_schema:
                 ensure_stats_schema(conn)  # type: ignore[misc]
             series = stats_get_series(  # type: ignore[misc]
-                conn, realm, since_ts=since_ts, step_sec=step, limit=limit, fields=fields
+                conn, realm, since_ts=since_ts, step_sec=step, limit=limit, fields=fields,
+                agg=None if agg == "avg" else agg,
             )
-        return jsonify({"ok": True, "data": series})
+        return jsonify({"ok": True, "data": series, "agg": agg})
     except Exception as e:
         current_app.logger.exception("stats_series db failed: %s", e)
         return jsonify({"ok": False, "error": "db error"}), 500
@@ -559,103 +710,40 @@ def api_player_head():
 def api_console_stream():
     """
     SSE-прокси: bridge (WS) -> браузер.
-    Пропускаем кадры console.stream / bridge.log / console.out только для указанного realm.
-    При подключении отправляем в бридж кадр admin.hello с данными клиента.
+    Все вкладки одного realm читают общую подписку console_hub (одно соединение с бриджем
+    на процесс), новый зритель сначала получает хвост последних строк.
     """
     realm = (request.args.get("realm") or "").strip()
     if not realm:
         return jsonify({"ok": False, "error": "realm required"}), 400
 
-    BRIDGE_URL = os.getenv("SP_BRIDGE_URL", "ws://127.0.0.1:8765/ws")
-    BRIDGE_TOKEN = os.getenv("SP_TOKEN", "SUPER_SECRET")
-    BRIDGE_MAX_SIZE = int(os.getenv("SP_MAX_SIZE", "131072"))
-
     # метаданные клиента из query/headers
     client_meta = _client_meta()
     _log_client("console.stream.open", realm, client_meta)
     # продублируем в бридж отдельным кадром (fire-and-forget) на всякий случай
     _bridge_origin("console.stream.open", realm, client_meta)
 
-    q: Queue = Queue(maxsize=256)
-    STOP = object()
-
-    def worker():
-        async def run():
-            headers = {"Authorization": f"Bearer {BRIDGE_TOKEN}"}
-            try:
-                async with websockets.connect(
-                    BRIDGE_URL,
-                    extra_headers=headers,
-                    ping_interval=20,
-                    ping_timeout=20,
-                    max_size=BRIDGE_MAX_SIZE,
-                ) as ws:
-                    # помечаем admin-сессию и передаём метаданные клиента
-                    try:
-                        await ws.send(json.dumps({
-                            "type": "admin.hello",
-                            "realm": realm,
-                            "payload": {"realm": realm, "client": client_meta}
-                        }, ensure_ascii=False))
-                    except Exception:
-                        pass
-
-                    while True:
-                        raw = await ws.recv()
-                        try:
-                            obj = json.loads(raw)
-                        except Exception:
-                            continue
-                        t = obj.get("type")
-                        if t not in ("console.stream", "bridge.log", "console.out"):
-                            continue
-                        r = (
-                            obj.get("realm")
-                            or (obj.get("payload") or {}).get("realm")
-                            or (obj.get("data") or {}).get("realm")
-                        )
-                        if r != realm:
-                            continue
-                        payload = obj.get("payload") or obj
-                        try:
-                            q.put_nowait(payload)
-                        except Exception:
-                            pass
-            except Exception as e:
-                try:
-                    q.put_nowait({"_err": str(e)})
-                except Exception:
-                    pass
-            finally:
-                try:
-                    q.put_nowait(STOP)
-                except Exception:
-                    pass
-
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(run())
-        loop.close()
-
-    threading.Thread(target=worker, daemon=True).start()
+    viewer = console_hub.open(realm)
 
     def gen():
         yield "retry: 2000\n\n"
         try:
+            for item in viewer.replay:
+                yield f"data: {json.dumps(item, ensure_ascii=False)}\n\n"
             while True:
                 try:
-                    item = q.get(timeout=20)
+                    item = viewer.get(timeout=20)
                 except Empty:
                     yield ": keepalive\n\n"
                     continue
-                if item is STOP:
-                    break
                 if isinstance(item, dict) and "_err" in item:
                     yield f"event: err\ndata: {json.dumps(item, ensure_ascii=False)}\n\n"
                     continue
                 yield f"data: {json.dumps(item, ensure_ascii=False)}\n\n"
         except GeneratorExit:
             pass
+        finally:
+            console_hub.close(viewer)
 
     resp = current_app.response_class(gen(), mimetype="text/event-stream")
     resp.headers["Cache-Control"] = "no-cache"
@@ -20,6 +20,7 @@ from ...database import (
     init_db,
     get_luckperms_connection,
 )
+from ...services.promo import PromoService, valid_player_name, valid_uuid
 from . import admin_bp
 
 bp = Blueprint("promocode", __name__, url_prefix="/promocode")
@@ -156,6 +157,8 @@ LP_PREFIX = (
     or "luckperms_"
 ).strip("`")
 LP_SERVER = (os.getenv("LUCKPERMS_SERVER") or "global").strip()
+# выполнять promo_code_cmds кода при погашении (в фоне, через console.batch моста)
+PROMO_REDEEM_COMMANDS = (os.getenv("PROMO_REDEEM_COMMANDS") or "0").lower() in ("1", "true", "yes", "on")
 
 def _lp_tbl(core: str) -> str:
     return f"`{LP_PREFIX}{core}`"
@@ -791,6 +794,13 @@ def api_promo_redeem():
         return _err("code required")
     if not uuid:
         return _err("uuid required")
+    if PROMO_REDEEM_COMMANDS:
+        # ник/uuid попадут в консольные команды — принимаем только строгие форматы
+        uuid = _to_dashed_uuid(uuid)
+        if not valid_uuid(uuid):
+            return _err("invalid uuid")
+        if username and not valid_player_name(username):
+            return _err("invalid username")
 
     with get_db_connection() as conn:
         _ensure_schema(conn)
@@ -824,18 +834,29 @@ def api_promo_redeem():
             ),
         )
         conn.execute("UPDATE promo_codes SET uses_left = uses_left - 1 WHERE id = ? AND uses_left > 0", (code_id,))
-
-        return _ok({
-            "code": code,
-            "code_id": code_id,
-            "uses_left": int(p["uses_left"]) - 1,
-            "amount": amount,
-            "currency_key": currency_key,
-            "kit_id": kit_id,
-            "kit_items": kit_items,
-            "groups": groups,
-            "lp_applied": lp_applied,
-        })
+        code_realm = (p.get("realm") or "").strip() or None
+        uses_left = int(p["uses_left"]) - 1
+
+    res = {
+        "code": code,
+        "code_id": code_id,
+        "uses_left": uses_left,
+        "amount": amount,
+        "currency_key": currency_key,
+        "kit_id": kit_id,
+        "kit_items": kit_items,
+        "groups": groups,
+        "lp_applied": lp_applied,
+    }
+    if PROMO_REDEEM_COMMANDS:
+        # команды кода — после коммита погашения, в фоне (паузы run_delay_ms не держат запрос)
+        try:
+            res["commands"] = PromoService.queue_code_commands(
+                code_id=code_id, player=username or uuid, uuid=uuid, realm=realm or code_realm)
+        except Exception as e:
+            current_app.logger.error("promo commands not queued: code_id=%s: %s", code_id, e)
+            res["commands"] = {"queued": False, "error": str(e)}
+    return _ok(res)
 
 @bp.get("/api/promo/redemptions")
 @login_required
@@ -2,7 +2,10 @@
 from __future__ import annotations
 
 import os
+import re
 import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime
 from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
@@ -17,6 +20,23 @@ class PromoExpired(PromoError): ...
 class PromoNoUsesLeft(PromoError): ...
 class PromoRealmMismatch(PromoError): ...
 class KitNotFound(PromoError): ...
+class PromoBadPlayer(PromoError): ...
+
+log = logging.getLogger("promo")
+
+# promo_code_cmds выполняются в фоне: HTTP-запрос погашения не ждёт пауз run_delay_ms и лимитов моста
+PROMO_CMD_WORKERS = int(os.getenv("PROMO_CMD_WORKERS", "2"))
+_CMD_POOL: Optional[ThreadPoolExecutor] = None
+
+# подставляется в консольные команды — только ник Minecraft или UUID с дефисами
+_PLAYER_NAME_RE = re.compile(r"^[A-Za-z0-9_]{3,16}$")
+_UUID_RE = re.compile(r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$")
+
+def valid_player_name(name: Optional[str]) -> bool:
+    return bool(name) and bool(_PLAYER_NAME_RE.match(name))
+
+def valid_uuid(uuid: Optional[str]) -> bool:
+    return bool(uuid) and bool(_UUID_RE.match(uuid))
 
 # =============== Models (lightweight) ===============
 
@@ -501,6 +521,82 @@ class PromoService:
             if own:
                 conn.close()
 
+    @staticmethod
+    def run_code_commands(
+        *,
+        code_id: int,
+        player: str,
+        realm: Optional[str] = None,
+        uuid: Optional[str] = None,
+        conn: Optional[MySQLConnection] = None,
+    ) -> Dict[str, Any]:
+        """
+        Выполнить promo_code_cmds кода для игрока: по priority, с run_delay_ms и run_as,
+        одним console.batch на realm (команда с пустым realm идёт в realm погашения).
+        player — ник или UUID, uuid — UUID с дефисами; другое в консоль не подставляем (PromoBadPlayer).
+        Возвращает {realm: console.batch.result}. Блокирует на всё время пакета — из HTTP-обработчиков
+        вызывать queue_code_commands.
+        """
+        from ..modules.bridge_client import console_batch
+
+        if not (valid_player_name(player) or valid_uuid(player)):
+            raise PromoBadPlayer("invalid player name")
+        if uuid and not valid_uuid(uuid):
+            raise PromoBadPlayer("invalid uuid")
+
+        own = False
+        if conn is None:
+            conn = get_db_connection()
+            own = True
+        try:
+            rows = conn.query_all(
+                "SELECT run_as, realm, command_text, run_delay_ms FROM promo_code_cmds "
+                "WHERE code_id=? ORDER BY priority, id",
+                (int(code_id),),
+            )
+        finally:
+            if own:
+                conn.close()
+
+        by_realm: Dict[str, List[Dict[str, Any]]] = {}
+        for r in rows:
+            target = (r.get("realm") or realm or "").strip()
+            if not target:
+                raise PromoRealmMismatch("realm required for promo commands")
+            cmd = str(r.get("command_text") or "").replace("{player}", player).replace("{uuid}", uuid or "")
+            by_realm.setdefault(target, []).append({
+                "cmd": cmd,
+                "run_as": r.get("run_as") or "CONSOLE",
+                "player": player,
+                "delay_ms": int(r.get("run_delay_ms") or 0),
+            })
+        return {target: console_batch(target, cmds) for target, cmds in by_realm.items()}
+
+    @staticmethod
+    def queue_code_commands(*, code_id: int, player: str, realm: Optional[str] = None,
+                            uuid: Optional[str] = None) -> Dict[str, Any]:
+        """run_code_commands в фоновом пуле; итог пишется в лог. Возвращает {"queued": True}."""
+        global _CMD_POOL
+        if not (valid_player_name(player) or valid_uuid(player)) or (uuid and not valid_uuid(uuid)):
+            raise PromoBadPlayer("invalid player")
+        if _CMD_POOL is None:
+            _CMD_POOL = ThreadPoolExecutor(max_workers=max(1, PROMO_CMD_WORKERS), thread_name_prefix="promo-cmds")
+
+        def job() -> None:
+            try:
+                res = PromoService.run_code_commands(code_id=code_id, player=player, realm=realm, uuid=uuid)
+            except Exception:
+                log.exception("promo commands failed: code_id=%s player=%s", code_id, player)
+                return
+            for target, frame in res.items():
+                payload = frame.get("payload") or {}
+                lvl = logging.WARNING if payload.get("failed") else logging.INFO
+                log.log(lvl, "promo commands: code_id=%s player=%s realm=%s total=%s counts=%s",
+                        code_id, player, target, payload.get("total"), payload.get("counts"))
+
+        _CMD_POOL.submit(job)
+        return {"queued": True}
+
     @staticmethod
     def list_redemptions(
         *,
@@ -0,0 +1,142 @@
+# app/services/stats_writer.py
+"""
+Буферизованная запись снимков статистики в MySQL.
+
+Вызывающий код (stats_query в bridge_client, api_stats) только кладёт снимок в буфер.
+Фоновый поток раз в STATS_FLUSH_MS (или сразу при STATS_FLUSH_ROWS записях) пишет
+накопленное одной пачкой через save_server_stats_many. Снимки одного realm за одну
+и ту же секунду схлопываются: остаётся последний (api_stats присылает дополненную
+версию того же опроса). Буфер ограничен STATS_BUFFER_MAX — при недоступной БД
+старые снимки вытесняются, запросы не блокируются.
+"""
+from __future__ import annotations
+
+import os
+import logging
+import atexit
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from ..database import get_db_connection, ensure_stats_schema, save_server_stats_many
+
+log = logging.getLogger("stats_writer")
+
+STATS_FLUSH_MS = int(os.getenv("STATS_FLUSH_MS", "1000"))
+STATS_FLUSH_ROWS = int(os.getenv("STATS_FLUSH_ROWS", "200"))
+STATS_BUFFER_MAX = int(os.getenv("STATS_BUFFER_MAX", "5000"))
+STATS_FLUSH_TRIES = int(os.getenv("STATS_FLUSH_TRIES", "5"))
+
+
+class StatsWriter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._buf: "OrderedDict[Tuple[str, int], Dict[str, Any]]" = OrderedDict()
+        self._thread: Optional[threading.Thread] = None
+        self._pid = 0
+        self._atexit = False
+        self.written = 0
+        self.merged = 0
+        self.dropped = 0
+        self.failed_flushes = 0
+
+    # ---- lifecycle ----
+
+    def start(self) -> None:
+        """Создать схему (один раз) и запустить поток записи; повторный вызов безопасен."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="stats-writer", daemon=True)
+            self._thread.start()
+            if not self._atexit:
+                atexit.register(self.flush)
+                self._atexit = True
+        try:
+            with get_db_connection() as conn:
+                ensure_stats_schema(conn)
+        except Exception as e:
+            log.warning("stats schema init failed: %s", e)
+
+    def submit(self, stats: Dict[str, Any], *, realm: Optional[str] = None,
+               collected_at: Optional[datetime] = None) -> None:
+        realm = (realm or stats.get("realm") or "").strip() or "default"
+        if realm != stats.get("realm"):
+            stats = {**stats, "realm": realm}
+        at = collected_at or datetime.utcnow()
+        key = (realm, int(at.timestamp()))
+        with self._lock:
+            if key in self._buf:
+                self.merged += 1
+            self._buf[key] = {"stats": stats, "at": at}
+            self._buf.move_to_end(key)
+            while len(self._buf) > STATS_BUFFER_MAX:
+                self._buf.popitem(last=False)
+                self.dropped += 1
+            full = len(self._buf) >= STATS_FLUSH_ROWS
+        if self._thread is None or self._pid != os.getpid():
+            self.start()
+        if full:
+            self._wake.set()
+
+    def flush(self) -> int:
+        """Записать всё накопленное сейчас. Возвращает число записанных снимков."""
+        with self._lock:
+            if not self._buf:
+                return 0
+            batch = list(self._buf.items())
+            self._buf.clear()
+        written = 0
+        try:
+            with get_db_connection() as conn:
+                ensure_stats_schema(conn)
+                for i in range(0, len(batch), STATS_FLUSH_ROWS):
+                    chunk = batch[i:i + STATS_FLUSH_ROWS]
+                    save_server_stats_many(conn, [(v["stats"], v["at"]) for _, v in chunk])
+                    written += len(chunk)
+        except Exception as e:
+            self.failed_flushes += 1
+            log.warning("stats flush failed (%d pending): %s", len(batch) - written, e)
+            # вернём незаписанное в начало буфера; более свежие снимки тех же ключей важнее,
+            # а снимок, который не записался STATS_FLUSH_TRIES раз подряд, выбрасываем
+            with self._lock:
+                rest = OrderedDict()
+                for k, v in batch[written:]:
+                    v["tries"] = v.get("tries", 0) + 1
+                    if v["tries"] >= STATS_FLUSH_TRIES:
+                        self.dropped += 1
+                    elif k not in self._buf:
+                        rest[k] = v
+                rest.update(self._buf)
+                self._buf = rest
+                while len(self._buf) > STATS_BUFFER_MAX:
+                    self._buf.popitem(last=False)
+                    self.dropped += 1
+        self.written += written
+        return written
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(STATS_FLUSH_MS / 1000.0)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                log.exception("stats writer loop error")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = len(self._buf)
+        return {
+            "pending": pending,
+            "written": self.written,
+            "merged": self.merged,
+            "dropped": self.dropped,
+            "failed_flushes": self.failed_flushes,
+        }
+
+
+writer = StatsWriter()
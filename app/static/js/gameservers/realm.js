@@ -548,12 +548,26 @@
   }
 
   /* ------------ auto refresh ------------ */
+  // сервер сам пушит снимок и дальше только изменившиеся ключи; опрос остаётся запасным вариантом
+  let statsEs = null, streamData = {};
   function applyTimer(){
     clearInterval(timer);
-    if(document.getElementById("autorefresh").checked){
-      const sec = Math.max(2, parseInt(document.getElementById("refresh-interval").value,10)||3);
+    if (statsEs){ statsEs.close(); statsEs = null; }
+    if(!document.getElementById("autorefresh").checked) return;
+    const sec = Math.max(2, parseInt(document.getElementById("refresh-interval").value,10)||3);
+    if (!window.EventSource){
       timer = setInterval(fetchStats, sec*1000);
+      return;
     }
+    statsEs = new EventSource(`/admin/gameservers/api/stats/stream?realm=${encodeURIComponent(realm)}&interval=${sec}`);
+    statsEs.addEventListener("snapshot", e=>{
+      try{ streamData = JSON.parse(e.data)||{}; render(streamData); }catch{}
+    });
+    statsEs.addEventListener("delta", e=>{
+      try{ Object.assign(streamData, JSON.parse(e.data)||{}); render(streamData); }catch{}
+    });
+    statsEs.addEventListener("err", ()=> setStatusBadge("offline"));
+    statsEs.onerror = ()=> setStatusBadge("offline");
   }
 
   function initAuto(){
@@ -0,0 +1,527 @@
+# bridge/bench.py
+# -*- coding: utf-8 -*-
+"""
+Нагрузочный стенд бриджа: N имитаций плагинов и M имитаций админов на одной машине.
+
+Плагины шлют stats.report и console.out с заданной частотой и отвечают на server.stats
+и console.exec так же, как настоящий плагин (console.out + console_done с req_id).
+Админы делают stats.query / console.exec и меряют время до ответа; «зрители» подписаны
+на консоль всех realm и меряют задержку доставки console.out (ts в кадре -> приём).
+В конце — p50/p90/p99/max по каждой операции, пропускная способность и CPU/RSS процесса бриджа.
+
+По умолчанию бридж поднимается здесь же отдельным процессом на свободном порту;
+--url — гонять против уже запущенного (тогда CPU/память меряются только с --pid).
+
+--modes гоняет тот же сценарий по разу на каждый режим рантайма бриджа (JSON-кодек и цикл событий,
+SP_JSON_CODEC / SP_UVLOOP) и сводит кадры/сек и CPU в одну таблицу; --codec-micro — только
+сериализация кадров в этом процессе, без сети.
+
+Запуск из корня репозитория:
+  python bridge/bench.py --plugins 20 --admins 10 --viewers 5 --duration 30
+  python bridge/bench.py --plugins 50 --console-rate 100 --encoding msgpack --json result.json
+  python bridge/bench.py --modes json,orjson,ujson,orjson+uvloop --duration 15
+  python bridge/bench.py --codec-micro
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import importlib.util
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import websockets
+
+try:
+    import msgpack  # опционально: --encoding msgpack
+except Exception:
+    msgpack = None
+
+try:
+    import psutil  # опционально: без него CPU/RSS читаются из /proc (Linux)
+except Exception:
+    psutil = None
+
+HERE = Path(__file__).resolve().parent
+
+
+# ------------------ замеры ------------------
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return float("nan")
+    idx = min(len(sorted_values) - 1, max(0, int(round(q / 100.0 * (len(sorted_values) - 1)))))
+    return sorted_values[idx]
+
+
+class Recorder:
+    """Задержки по операциям (сек) и счётчики; до конца прогрева ничего не копит."""
+
+    def __init__(self):
+        self.active = False
+        self.lat: dict[str, list[float]] = {}
+        self.counts: dict[str, int] = {}
+
+    def observe(self, op: str, seconds: float) -> None:
+        if self.active:
+            self.lat.setdefault(op, []).append(seconds)
+
+    def count(self, name: str, n: int = 1) -> None:
+        if self.active:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def summary(self, elapsed: float) -> dict:
+        ops = {}
+        for op, values in sorted(self.lat.items()):
+            values.sort()
+            ops[op] = {
+                "n": len(values),
+                "rate": round(len(values) / elapsed, 1),
+                **{f"p{q}": round(percentile(values, q) * 1000, 2) for q in (50, 90, 99)},
+                "max": round(values[-1] * 1000, 2),
+            }
+        return {"latency_ms": ops, "counts": dict(sorted(self.counts.items())),
+                "rates": {k: round(v / elapsed, 1) for k, v in sorted(self.counts.items())}}
+
+
+class ProcWatch:
+    """CPU% и RSS процесса бриджа: psutil, если есть, иначе /proc/<pid>."""
+
+    def __init__(self, pid: int | None):
+        self.pid = pid
+        self.samples: list[tuple[float, float]] = []  # (cpu %, rss MiB)
+        self._proc = psutil.Process(pid) if (psutil is not None and pid) else None
+        self._last: tuple[float, float] | None = None
+
+    def _cpu_seconds(self) -> float | None:
+        if self._proc is not None:
+            t = self._proc.cpu_times()
+            return t.user + t.system
+        try:
+            fields = Path(f"/proc/{self.pid}/stat").read_text().rsplit(")", 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        except Exception:
+            return None
+
+    def _rss_mib(self) -> float | None:
+        if self._proc is not None:
+            return self._proc.memory_info().rss / 2**20
+        try:
+            for line in Path(f"/proc/{self.pid}/status").read_text().splitlines():
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+        except Exception:
+            return None
+        return None
+
+    def sample(self) -> None:
+        if not self.pid:
+            return
+        cpu, now = self._cpu_seconds(), time.monotonic()
+        rss = self._rss_mib()
+        if cpu is None or rss is None:
+            return
+        if self._last is not None:
+            self.samples.append(((cpu - self._last[0]) / max(1e-6, now - self._last[1]) * 100, rss))
+        self._last = (cpu, now)
+
+    def summary(self) -> dict | None:
+        if not self.samples:
+            return None
+        cpu = sorted(s[0] for s in self.samples)
+        return {"cpu_avg": round(sum(cpu) / len(cpu), 1), "cpu_p90": round(percentile(cpu, 90), 1),
+                "cpu_max": round(cpu[-1], 1), "rss_mib_max": round(max(s[1] for s in self.samples), 1),
+                "rss_mib_end": round(self.samples[-1][1], 1)}
+
+
+# ------------------ кадры ------------------
+
+class Codec:
+    def __init__(self, encoding: str):
+        if encoding == "msgpack" and msgpack is None:
+            raise SystemExit("--encoding msgpack: pip install msgpack")
+        self.binary = encoding == "msgpack"
+        self.subprotocols = ["sp.msgpack"] if self.binary else None
+
+    def dumps(self, obj: dict):
+        return msgpack.packb(obj, use_bin_type=True) if self.binary else json.dumps(obj, ensure_ascii=False)
+
+    def loads(self, raw) -> dict:
+        if isinstance(raw, (bytes, bytearray)):
+            return msgpack.unpackb(raw, raw=False) if msgpack is not None else {}
+        return json.loads(raw)
+
+
+def stats_frame(realm: str, rnd: random.Random, req_id: str | None = None) -> dict:
+    """stats.report того же размера и формы, что шлёт плагин (списки игроков/миров, плагины, GC)."""
+    online = rnd.randint(0, 150)
+    frame = {
+        "type": "stats.report", "realm": realm,
+        "data": {
+            "realm": realm, "motd": f"§a{realm}", "players_online": online, "players_max": 200,
+            "tps_1m": round(rnd.uniform(17, 20), 2), "tps_5m": 19.9, "tps_15m": 19.95,
+            "mspt": round(rnd.uniform(5, 60), 1),
+            "heap_used": rnd.randint(2 << 30, 6 << 30), "heap_max": 8 << 30,
+            "nonheap_used": 256 << 20, "nonheap_max": -1, "jvm_uptime_ms": int(time.time() * 1000) % 10**9,
+            "threads_live": 97, "threads_peak": 121, "threads_daemon": 54,
+            "gc": {"G1 Young Generation": {"count": 5120, "time_ms": 40211}},
+            "cpu_system_load": round(rnd.random(), 2), "cpu_process_load": round(rnd.random(), 2),
+            "entities_top_types": {f"minecraft:e{i}": 1000 - i * 7 for i in range(20)},
+            "plugins": {f"Plugin{i}": {"version": f"1.{i}.0", "enabled": True} for i in range(30)},
+            "players_list": [{"name": f"player{i}", "ping": 40 + i % 80, "world": "world"} for i in range(min(online, 60))],
+            "worlds": [{"name": w, "type": "NORMAL", "players": online // 3, "chunks": 2400}
+                       for w in ("world", "world_nether", "world_the_end")],
+        },
+    }
+    if req_id:
+        frame["req_id"] = req_id
+    return frame
+
+
+async def _connect(url: str, token: str, codec: Codec, **query):
+    qs = "&".join(f"{k}={v}" for k, v in {"token": token, **query}.items())
+    return await websockets.connect(f"{url}?{qs}", max_size=None, subprotocols=codec.subprotocols,
+                                    open_timeout=20, ping_interval=None)
+
+
+async def _every(rate: float, stop: asyncio.Event, fn) -> None:
+    """fn() с частотой rate в секунду (с джиттером старта), пока не выставлен stop."""
+    if rate <= 0:
+        return
+    period = 1.0 / rate
+    await asyncio.sleep(random.random() * period)
+    nxt = time.monotonic()
+    while not stop.is_set():
+        await fn()
+        nxt += period
+        delay = nxt - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            nxt = time.monotonic()  # не успеваем — не копим долг
+
+
+# ------------------ участники ------------------
+
+async def sim_plugin(i: int, args, codec: Codec, rec: Recorder, stop: asyncio.Event, ready: asyncio.Event) -> None:
+    realm = f"bench-{i}"
+    rnd = random.Random(i)
+    ws = await _connect(args.url, args.token, codec, role="plugin", realm=realm)
+    await ws.send(codec.dumps({"type": "hello", "realm": realm, "encodings": ["msgpack"] if codec.binary else []}))
+    await ws.recv()  # hello.ok
+    ready.set()
+    line_no = 0
+
+    async def send(obj: dict) -> None:
+        await ws.send(codec.dumps(obj))
+        rec.count("plugin_frames_out")
+
+    async def emit_stats():
+        await send(stats_frame(realm, rnd))
+
+    async def emit_console():
+        nonlocal line_no
+        line_no += 1
+        await send({"type": "console.out", "realm": realm,
+                    "payload": {"line": f"[Server thread/INFO]: bench line {line_no}", "ts": time.time()}})
+
+    async def serve():
+        async for raw in ws:
+            obj = codec.loads(raw)
+            t, rid = obj.get("type"), obj.get("req_id")
+            if t == "server.stats":
+                await send(stats_frame(realm, rnd, rid))
+            elif t == "console.exec":
+                await send({"type": "console.out", "realm": realm, "req_id": rid,
+                            "payload": {"line": f"> {obj.get('command')}", "ts": time.time()}})
+                await send({"type": "console_done", "realm": realm, "req_id": rid, "payload": {"ok": True}})
+
+    tasks = [asyncio.create_task(serve()),
+             asyncio.create_task(_every(args.stats_rate, stop, emit_stats)),
+             asyncio.create_task(_every(args.console_rate, stop, emit_console))]
+    await stop.wait()
+    for task in tasks:
+        task.cancel()
+    await ws.close()
+
+
+async def sim_admin(i: int, args, codec: Codec, rec: Recorder, stop: asyncio.Event) -> None:
+    """Запросы к случайным realm; ответ ждём по req_id (ack бриджа не считается)."""
+    rnd = random.Random(1000 + i)
+    ws = await _connect(args.url, args.token, codec)
+    # пустая подписка: адресные ответы приходят и так, а поток консоли админу-запросчику не нужен
+    await ws.send(codec.dumps({"type": "admin.subscribe", "topics": []}))
+    waiting: dict[str, tuple[str, float]] = {}
+    seq = 0
+
+    async def reader():
+        async for raw in ws:
+            obj = codec.loads(raw)
+            rid = obj.get("req_id")
+            item = waiting.get(rid) if rid else None
+            if item is None:
+                continue
+            op, started = item
+            t = obj.get("type")
+            if t == "bridge.throttled":
+                del waiting[rid]
+                rec.count("admin_throttled")
+            elif (op == "stats.query" and t in ("server.stats", "stats.report")) or \
+                    (op == "console.exec" and t == "console_done") or t == "bridge.warn":
+                del waiting[rid]
+                rec.observe(op, time.monotonic() - started)
+                rec.count("admin_replies" if t != "bridge.warn" else "admin_warn")
+
+    async def request():
+        nonlocal seq
+        seq += 1
+        rid = f"a{i}-{seq}"
+        realm = f"bench-{rnd.randrange(args.plugins)}"
+        if rnd.random() < args.exec_ratio:
+            op, frame = "console.exec", {"type": "console.exec", "realm": realm, "payload": {"cmd": "list"}}
+        else:
+            op, frame = "stats.query", {"type": "stats.query", "realm": realm}
+        waiting[rid] = (op, time.monotonic())
+        await ws.send(codec.dumps({**frame, "req_id": rid}))
+        rec.count("admin_requests")
+
+    task = asyncio.create_task(reader())
+    await _every(args.query_rate, stop, request)
+    await asyncio.sleep(min(2.0, args.timeout))
+    now = time.monotonic()
+    rec.count("admin_timeouts", sum(1 for _op, started in waiting.values() if now - started >= args.timeout))
+    task.cancel()
+    await ws.close()
+
+
+async def sim_viewer(i: int, args, codec: Codec, rec: Recorder, stop: asyncio.Event) -> None:
+    """Зритель консоли всех realm: задержка доставки console.out от отправки плагином."""
+    ws = await _connect(args.url, args.token, codec)
+    await ws.send(codec.dumps({"type": "admin.subscribe", "topics": [{"realm": "*", "types": ["console.out"]}]}))
+
+    async def reader():
+        async for raw in ws:
+            obj = codec.loads(raw)
+            if obj.get("type") != "console.out":
+                continue
+            ts = (obj.get("payload") or {}).get("ts")
+            if ts:
+                rec.observe("console.deliver", max(0.0, time.time() - ts))
+            rec.count("viewer_frames_in")
+
+    task = asyncio.create_task(reader())
+    await stop.wait()
+    task.cancel()
+    await ws.close()
+
+
+# ------------------ бридж ------------------
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _spawn_bridge(args) -> subprocess.Popen:
+    port = _free_port()
+    args.url = f"ws://127.0.0.1:{port}/ws"
+    env = {**os.environ, "SP_BRIDGE_LOG_LEVEL": os.getenv("SP_BRIDGE_LOG_LEVEL", "warning"), **args.bridge_env}
+    proc = subprocess.Popen(
+        [sys.executable, str(HERE / "bridge.py"), "--host", "127.0.0.1", "--port", str(port),
+         "--token", args.token, "--metrics-port", "0", *args.bridge_arg],
+        env=env, stdout=subprocess.DEVNULL if not args.bridge_log else None, stderr=subprocess.STDOUT,
+    )
+    for _ in range(100):
+        if proc.poll() is not None:
+            raise SystemExit(f"bridge exited with code {proc.returncode}")
+        with socket.socket() as s:
+            if s.connect_ex(("127.0.0.1", port)) == 0:
+                return proc
+        await asyncio.sleep(0.1)
+    proc.kill()
+    raise SystemExit("bridge did not start listening")
+
+
+# ------------------ main ------------------
+
+async def run(args) -> dict:
+    codec = Codec(args.encoding)
+    proc = await _spawn_bridge(args) if args.spawn else None
+    watch = ProcWatch(proc.pid if proc else args.pid)
+    rec = Recorder()
+    stop = asyncio.Event()
+    try:
+        readies = [asyncio.Event() for _ in range(args.plugins)]
+        tasks = [asyncio.create_task(sim_plugin(i, args, codec, rec, stop, readies[i])) for i in range(args.plugins)]
+        await asyncio.wait_for(asyncio.gather(*(r.wait() for r in readies)), timeout=30)
+        tasks += [asyncio.create_task(sim_viewer(i, args, codec, rec, stop)) for i in range(args.viewers)]
+        tasks += [asyncio.create_task(sim_admin(i, args, codec, rec, stop)) for i in range(args.admins)]
+
+        await asyncio.sleep(args.warmup)
+        rec.active = True
+        watch.sample()
+        started = time.monotonic()
+        while time.monotonic() - started < args.duration:
+            await asyncio.sleep(1.0)
+            watch.sample()
+        elapsed = time.monotonic() - started
+        stop.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        errors = [repr(r) for r in results if isinstance(r, BaseException)]
+    finally:
+        stop.set()
+        if proc is not None:
+            proc.terminate()
+            with contextlib.suppress(Exception):
+                proc.wait(timeout=5)
+
+    return {
+        "config": {k: getattr(args, k) for k in ("plugins", "admins", "viewers", "stats_rate", "console_rate",
+                                                 "query_rate", "exec_ratio", "duration", "encoding")},
+        "elapsed": round(elapsed, 2),
+        **rec.summary(elapsed),
+        "bridge": watch.summary(),
+        "errors": errors[:10],
+    }
+
+
+def print_report(r: dict) -> None:
+    c = r["config"]
+    print(f"plugins={c['plugins']} admins={c['admins']} viewers={c['viewers']} encoding={c['encoding']} "
+          f"stats={c['stats_rate']}/s console={c['console_rate']}/s query={c['query_rate']}/s "
+          f"exec_ratio={c['exec_ratio']}  ({r['elapsed']} s)")
+    print(f"  {'operation':<16}{'n':>8}{'rate/s':>9}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for op, s in r["latency_ms"].items():
+        print(f"  {op:<16}{s['n']:>8}{s['rate']:>9}{s['p50']:>9}{s['p90']:>9}{s['p99']:>9}{s['max']:>9}")
+    print("  throughput: " + ", ".join(f"{k}={v}/s" for k, v in r["rates"].items()))
+    b = r["bridge"]
+    if b:
+        print(f"  bridge: cpu avg {b['cpu_avg']}% p90 {b['cpu_p90']}% max {b['cpu_max']}%, "
+              f"rss max {b['rss_mib_max']} MiB (end {b['rss_mib_end']} MiB)")
+    for e in r["errors"]:
+        print("  error:", e)
+
+
+# ------------------ режимы рантайма ------------------
+
+def _mode_env(mode: str) -> dict | None:
+    """Режим "orjson+uvloop" -> env для бриджа; None — нужного модуля нет."""
+    codec, _, loop = mode.strip().lower().partition("+")
+    if codec != "json" and importlib.util.find_spec(codec) is None:
+        return None
+    if loop and importlib.util.find_spec(loop) is None:
+        return None
+    return {"SP_JSON_CODEC": codec, "SP_UVLOOP": "1" if loop == "uvloop" else "0"}
+
+
+def print_modes(rows: list[tuple[str, dict | None]]) -> None:
+    print(f"  {'mode':<16}{'fanout/s':>10}{'in/s':>9}{'cpu avg %':>11}{'frames/cpu-s':>14}"
+          f"{'deliver p99':>13}{'stats p99':>11}{'exec p99':>10}")
+    for mode, r in rows:
+        if r is None:
+            print(f"  {mode:<16}  (not installed, skipped)")
+            continue
+        out = round(r["rates"].get("viewer_frames_in", 0) + r["rates"].get("admin_replies", 0), 1)
+        inn = round(r["rates"].get("plugin_frames_out", 0) + r["rates"].get("admin_requests", 0), 1)
+        cpu = (r["bridge"] or {}).get("cpu_avg") or 0
+        per_cpu = round((out + inn) / (cpu / 100), 0) if cpu else float("nan")
+        lat = r["latency_ms"]
+        print(f"  {mode:<16}{out:>10}{inn:>9}{cpu:>11}{per_cpu:>14}"
+              f"{lat.get('console.deliver', {}).get('p99', '-'):>13}{lat.get('stats.query', {}).get('p99', '-'):>11}"
+              f"{lat.get('console.exec', {}).get('p99', '-'):>10}")
+
+
+def codec_micro(n: int) -> None:
+    """dumps+loads кадров stats.report / console.out в этом процессе: кадров в секунду на кодек."""
+    rnd = random.Random(1)
+    frames = [stats_frame("bench", rnd) for _ in range(4)] + [
+        {"type": "console.out", "realm": "bench", "payload": {"line": f"[Server thread/INFO]: line {i}", "ts": 0.0}}
+        for i in range(16)]
+    codecs = {"json": (lambda o: json.dumps(o, ensure_ascii=False), json.loads)}
+    if importlib.util.find_spec("orjson"):
+        import orjson
+        codecs["orjson"] = (lambda o: orjson.dumps(o, option=orjson.OPT_NON_STR_KEYS).decode(), orjson.loads)
+    if importlib.util.find_spec("ujson"):
+        import ujson
+        codecs["ujson"] = (lambda o: ujson.dumps(o, ensure_ascii=False), ujson.loads)
+    texts = [json.dumps(f, ensure_ascii=False) for f in frames]
+    print(f"  {'codec':<10}{'dumps/s':>12}{'loads/s':>12}   ({len(frames)} frames: 4 stats.report + 16 console.out)")
+    for name, (dumps, loads) in codecs.items():
+        best_d = best_l = float("inf")
+        for _ in range(3):
+            t = time.perf_counter()
+            for i in range(n):
+                dumps(frames[i % len(frames)])
+            best_d = min(best_d, time.perf_counter() - t)
+            t = time.perf_counter()
+            for i in range(n):
+                loads(texts[i % len(texts)])
+            best_l = min(best_l, time.perf_counter() - t)
+        print(f"  {name:<10}{int(n / best_d):>12}{int(n / best_l):>12}")
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Load test for bridge.py with simulated plugins and admins")
+    ap.add_argument("--plugins", type=int, default=10, help="simulated plugins (one realm each)")
+    ap.add_argument("--admins", type=int, default=5, help="admins issuing stats.query/console.exec")
+    ap.add_argument("--viewers", type=int, default=3, help="admins subscribed to console.out of every realm")
+    ap.add_argument("--stats-rate", type=float, default=0.5, help="stats.report per plugin per second")
+    ap.add_argument("--console-rate", type=float, default=20, help="console.out lines per plugin per second")
+    ap.add_argument("--query-rate", type=float, default=10, help="requests per admin per second")
+    ap.add_argument("--exec-ratio", type=float, default=0.3, help="share of console.exec among admin requests")
+    ap.add_argument("--duration", type=float, default=20, help="measured seconds")
+    ap.add_argument("--warmup", type=float, default=2, help="seconds before measuring")
+    ap.add_argument("--timeout", type=float, default=10, help="request counted as lost after this many seconds")
+    ap.add_argument("--encoding", choices=("json", "msgpack"), default="json")
+    ap.add_argument("--url", help="existing bridge ws://host:port/ws (default: spawn a local one)")
+    ap.add_argument("--pid", type=int, help="bridge pid for CPU/RSS when --url is used")
+    ap.add_argument("--token", default=os.getenv("SP_TOKEN", "bench"))
+    ap.add_argument("--bridge-arg", action="append", default=[], help="extra argument for the spawned bridge")
+    ap.add_argument("--bridge-log", action="store_true", help="show spawned bridge output")
+    ap.add_argument("--json", type=Path, help="also write the result as JSON (for comparing runs)")
+    ap.add_argument("--modes", help="compare bridge runtimes, e.g. json,orjson,ujson,orjson+uvloop")
+    ap.add_argument("--codec-micro", action="store_true", help="only measure JSON codecs in-process")
+    args = ap.parse_args()
+    if args.plugins < 1:
+        ap.error("--plugins must be >= 1")
+    args.spawn = not args.url
+    args.bridge_env = {}
+
+    if args.codec_micro:
+        codec_micro(50_000)
+        return 0
+    if args.modes:
+        if not args.spawn:
+            ap.error("--modes needs a spawned bridge (no --url)")
+        rows, out = [], {}
+        for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+            env = _mode_env(mode)
+            if env is not None:
+                args.bridge_env = env
+                out[mode] = asyncio.run(run(args))
+            rows.append((mode, out.get(mode)))
+        c = next(iter(out.values()))["config"] if out else vars(args)
+        print(f"plugins={c['plugins']} admins={c['admins']} viewers={c['viewers']} encoding={c['encoding']} "
+              f"console={c['console_rate']}/s per plugin, {args.duration} s per mode")
+        print_modes(rows)
+        if args.json:
+            args.json.write_text(json.dumps(out, ensure_ascii=False, indent=2), "utf-8")
+        return 1 if any(r["errors"] for r in out.values()) else 0
+
+    result = asyncio.run(run(args))
+    print_report(result)
+    if args.json:
+        args.json.write_text(json.dumps(result, ensure_ascii=False, indent=2), "utf-8")
+    return 1 if result["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
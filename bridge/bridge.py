@@ -3,20 +3,152 @@
 from __future__ import annotations
 
 import asyncio
+import bisect
+import hashlib
 import json
 import argparse
+import logging
 import os
+import time
+import uuid
 import contextlib
+from collections import OrderedDict, deque
+from fnmatch import fnmatchcase
+from functools import lru_cache
 from urllib.parse import urlparse, parse_qs
 from datetime import datetime
 
 import websockets
 from websockets.exceptions import ConnectionClosedOK, ConnectionClosedError
+from websockets.extensions.permessage_deflate import PerMessageDeflate, ServerPerMessageDeflateFactory
+from websockets.frames import CTRL_OPCODES, OP_CONT
+
+try:
+    import msgpack  # опционально: бинарные кадры (pip install msgpack)
+except Exception:
+    msgpack = None
+try:
+    import orjson  # опционально: быстрый JSON
+except Exception:
+    orjson = None
+try:
+    import ujson  # опционально: быстрый JSON, если нет orjson
+except Exception:
+    ujson = None
+try:
+    import uvloop  # опционально: быстрый цикл событий
+except Exception:
+    uvloop = None
 
 # realm -> set(ws)
 PLUGINS: dict[str, set] = {}
+# plugin ws -> возможности из hello (caps), например {"console.batch"}
+PLUGIN_CAPS: dict = {}
 # admin connections
 ADMINS: set = set()
+# админы без admin.subscribe — получают всё, как раньше
+FIREHOSE: set = set()
+# подписки: realm|"*" -> type-pattern -> set(ws)
+SUBS: dict[str, dict[str, set]] = {}
+# ws -> set((realm, pattern)) — чтобы быстро снять подписки при отключении
+ADMIN_TOPICS: dict = {}
+# req_id -> (admin ws, created monotonic, realm) — куда вернуть ответ плагина на конкретный запрос
+PENDING: dict[str, tuple] = {}
+PENDING_TTL = float(os.getenv("SP_REQ_TTL", "60"))
+_PENDING_SWEEP = {"at": 0.0}
+
+# кадры-потоки: даже с req_id их видят все админы (консоль нужна всем зрителям)
+STREAM_TYPES = {"console.out", "console.stream", "bridge.log"}
+
+# последний снимок статистики по realm: realm -> {"at": monotonic, "frame": dict}
+STATS_CACHE: dict[str, dict] = {}
+STATS_MAX_AGE = float(os.getenv("SP_STATS_MAX_AGE", "2"))
+# один запрос к плагину на realm, остальные ждут его: realm -> {"req_id", "at", "waiters": [(ws, req_id)]}
+STATS_INFLIGHT: dict[str, dict] = {}
+STATS_INFLIGHT_TTL = float(os.getenv("SP_STATS_INFLIGHT_TTL", "8"))
+STATS_TYPES = ("server.stats", "stats.report")
+
+# исходящие очереди на каждое соединение: ws -> Outbox
+OUTBOXES: dict = {}
+OUTBOX_SIZE = int(os.getenv("SP_OUTBOX_SIZE", "512"))
+# при переполнении такие кадры вытесняют самые старые из того же класса; остальные (управляющие)
+# означают, что клиент безнадёжно отстал — соединение закрываем
+OUTBOX_DROP_OLDEST = tuple(
+    t.strip() for t in os.getenv(
+        "SP_OUTBOX_DROP_OLDEST",
+        "console.*,console_done,stats.report,server.stats,bridge.log,bridge.binary,bridge.echo",
+    ).split(",") if t.strip()
+)
+
+# кодировка кадров на соединение: JSON всегда, MessagePack — по договорённости.
+# Договориться можно сабпротоколом при рукопожатии (sp.msgpack / sp.json) или в hello:
+# {"type": "hello", "encodings": ["msgpack", "json"]} -> hello.ok {"encoding": "msgpack"}
+# (сам hello.ok ещё текстом JSON, дальше — бинарные кадры в обе стороны).
+SUBPROTO_MSGPACK = "sp.msgpack"
+SUBPROTO_JSON = "sp.json"
+BINARY_ENABLED = msgpack is not None and os.getenv("SP_BINARY", "1") not in ("0", "", "false", "False")
+# ws -> "msgpack"; нет записи — JSON
+ENCODINGS: dict = {}
+
+# JSON-кодек кадров: SP_JSON_CODEC=auto|orjson|ujson|json (auto — первый установленный по порядку).
+# Все кодеки пишут UTF-8 без экранирования; то, что быстрый кодек сериализовать не может
+# (int больше 64 бит и т.п.), молча уходит в stdlib. Журнал и REPL остаются на stdlib json.
+def _pick_json_codec(name: str) -> str:
+    name = (name or "auto").strip().lower()
+    if name in ("auto", "orjson") and orjson is not None:
+        return "orjson"
+    if name in ("auto", "ujson") and ujson is not None:
+        return "ujson"
+    return "json"
+
+JSON_CODEC_WANTED = (os.getenv("SP_JSON_CODEC") or "auto").strip().lower()
+JSON_CODEC = _pick_json_codec(JSON_CODEC_WANTED)
+
+def _stdlib_dumps(obj, default=None) -> str:
+    return json.dumps(obj, ensure_ascii=False, default=default)
+
+if JSON_CODEC == "orjson":
+    _ORJSON_OPTS = orjson.OPT_NON_STR_KEYS
+
+    def json_dumps(obj, default=None) -> str:
+        try:
+            return orjson.dumps(obj, default=default, option=_ORJSON_OPTS).decode()
+        except TypeError:
+            return _stdlib_dumps(obj, default)
+
+    json_loads = orjson.loads
+elif JSON_CODEC == "ujson":
+    def json_dumps(obj, default=None) -> str:
+        if default is None:
+            try:
+                return ujson.dumps(obj, ensure_ascii=False)
+            except (TypeError, OverflowError):
+                pass
+        return _stdlib_dumps(obj, default)
+
+    json_loads = ujson.loads
+else:
+    json_dumps = _stdlib_dumps
+    json_loads = json.loads
+
+# цикл событий: SP_UVLOOP=auto|1|0 (auto — uvloop, если установлен)
+UVLOOP_WANTED = (os.getenv("SP_UVLOOP") or "auto").strip().lower()
+UVLOOP_ENABLED = uvloop is not None and UVLOOP_WANTED not in ("0", "", "false", "no", "off")
+
+# permessage-deflate. Уровень/memLevel/порог — для кадров, которые сжимает бридж (бридж -> клиент);
+# окна согласуются по направлениям: SERVER_WBITS — бридж -> клиент, CLIENT_WBITS — клиент -> бридж.
+# Кадры короче SP_DEFLATE_MIN_SIZE уходят несжатыми (RFC 7692 разрешает это на каждое сообщение).
+DEFLATE_ENABLED = os.getenv("SP_DEFLATE", "1") not in ("0", "", "false", "False")
+DEFLATE_LEVEL = int(os.getenv("SP_DEFLATE_LEVEL", "6"))
+DEFLATE_MEM_LEVEL = int(os.getenv("SP_DEFLATE_MEM_LEVEL", "5"))
+DEFLATE_MIN_SIZE = int(os.getenv("SP_DEFLATE_MIN_SIZE", "256"))
+DEFLATE_SERVER_WBITS = int(os.getenv("SP_DEFLATE_SERVER_WBITS", "12"))
+DEFLATE_CLIENT_WBITS = int(os.getenv("SP_DEFLATE_CLIENT_WBITS", "12"))
+# без context takeover словарь сбрасывается на каждый кадр: меньше памяти на соединение, хуже сжатие
+DEFLATE_SERVER_NO_CTX = os.getenv("SP_DEFLATE_SERVER_NO_CTX", "0") not in ("0", "", "false", "False")
+DEFLATE_CLIENT_NO_CTX = os.getenv("SP_DEFLATE_CLIENT_NO_CTX", "0") not in ("0", "", "false", "False")
+# суммарно по всем соединениям: raw — байты сообщений, wire — после сжатия
+DEFLATE_TOTALS = {"out_raw": 0, "out_wire": 0, "out_skipped": 0, "in_raw": 0, "in_wire": 0}
 
 # типы, которые чаще всего шлёт плагин — логируем их заметнее
 PLUGIN_TYPICAL_TYPES = {
@@ -35,7 +167,13 @@ PLUGIN_TYPICAL_TYPES = {
     "jp.balance", "jp.ok"
 }
 
-# === LOG HELPERS ===
+# === LOGGING ===
+# Уровень: SP_BRIDGE_LOG_LEVEL (debug|info|warning|error, --verbose = debug), SP_LOG_JSON=1 — строки JSON.
+# ev() ничего не форматирует, если уровень выключен; полезную нагрузку кадров пишем только на debug.
+DEBUG, INFO, WARNING, ERROR = logging.DEBUG, logging.INFO, logging.WARNING, logging.ERROR
+LOG_JSON = (os.getenv("SP_LOG_JSON") or "").lower() in ("1", "true", "yes", "y", "on")
+LOG_PAYLOAD_MAX = int(os.getenv("SP_LOG_MAX_PAYLOAD", "2000"))
+
 def _short_json(obj, limit=2000) -> str:
     try:
         s = json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
@@ -45,24 +183,222 @@ def _short_json(obj, limit=2000) -> str:
         return s
     return s[:limit] + f"...(+{len(s)-limit}b)"
 
+class _TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        fields = getattr(record, "fields", None) or {}
+        parts = [f"[bridge] {record.getMessage()}"]
+        for k, v in fields.items():
+            if isinstance(v, (dict, list)):
+                v = _short_json(v, LOG_PAYLOAD_MAX)
+            parts.append(f"{k}={v}")
+        line = " ".join(parts)
+        if record.levelno >= WARNING:
+            line = f"{record.levelname} {line}"
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        obj = {
+            "level": record.levelname,
+            "name": record.name,
+            "msg": record.getMessage(),
+            "time": self.formatTime(record, datefmt="%Y-%m-%dT%H:%M:%S"),
+        }
+        for k, v in (getattr(record, "fields", None) or {}).items():
+            if isinstance(v, (dict, list)):
+                s = _short_json(v, LOG_PAYLOAD_MAX)
+                v = v if len(s) < LOG_PAYLOAD_MAX else s
+            obj[k] = v
+        if record.exc_info:
+            obj["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(obj, ensure_ascii=False, default=str)
+
+def _setup_logger() -> logging.Logger:
+    lg = logging.getLogger("bridge")
+    if not lg.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(_JsonFormatter() if LOG_JSON else _TextFormatter())
+        lg.addHandler(handler)
+        lg.propagate = False
+    lg.setLevel(getattr(logging, (os.getenv("SP_BRIDGE_LOG_LEVEL") or "INFO").upper(), INFO))
+    return lg
+
+log = _setup_logger()
+
+def ev(level: int, event: str, /, **fields) -> None:
+    """Структурное событие: event + поля ключ=значение."""
+    if log.isEnabledFor(level):
+        log.log(level, event, extra={"fields": fields})
+
+def _frame_realm(obj) -> str | None:
+    if not isinstance(obj, dict):
+        return None
+    return obj.get("realm") or (obj.get("payload") or {}).get("realm")
+
 def _pretty_tag(obj) -> str:
     t = obj.get("type") if isinstance(obj, dict) else None
     return t or "?"
 
-def _log_recv(tag: str, realm: str | None, obj: dict, verbose: bool) -> None:
-    if tag in ("server.stats", "stats.report"):
-        print(f"[bridge] <- {tag} from realm='{realm}' payload={_short_json(obj)}")
+def _log_recv(tag: str, realm: str | None, obj: dict) -> None:
+    if not log.isEnabledFor(DEBUG):
         return
-    if tag in PLUGIN_TYPICAL_TYPES:
-        if verbose:
-            print(f"[bridge] <- {tag} from realm='{realm}' payload={_short_json(obj)}")
+    ev(DEBUG, "recv", type=tag if tag in PLUGIN_TYPICAL_TYPES else f"other:{tag}", realm=realm, payload=obj)
+
+# === METRICS ===
+# Prometheus text format на отдельном порту (SP_METRICS_PORT, 0 — выключено), только GET /metrics.
+METRICS_HOST = os.getenv("SP_METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("SP_METRICS_PORT", "9108"))
+# потолок числа рядов на метрику: типы кадров приходят от клиентов, лишнее сворачиваем в type="other"
+METRICS_MAX_SERIES = int(os.getenv("SP_METRICS_MAX_SERIES", "2000"))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _label(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Metrics:
+    def __init__(self):
+        self.frames_in: dict[tuple, int] = {}
+        self.bytes_in: dict[tuple, int] = {}
+        self.frames_out: dict[tuple, int] = {}
+        self.bytes_out: dict[tuple, int] = {}
+        self.dropped: dict[str, int] = {}
+        self.disconnects: dict[str, int] = {}
+        self.throttled: dict[tuple, int] = {}
+        self.coalesced: dict[tuple, int] = {}
+        # (realm, type) -> [счётчики по бакетам..., +Inf, sum]
+        self.latency: dict[tuple, list] = {}
+
+    @staticmethod
+    def _key(series: dict, realm, t) -> tuple:
+        key = (realm or "", t or "?")
+        if key not in series and len(series) >= METRICS_MAX_SERIES:
+            key = (realm or "", "other")
+        return key
+
+    def frame_in(self, realm, t, size: int) -> None:
+        key = self._key(self.frames_in, realm, t)
+        self.frames_in[key] = self.frames_in.get(key, 0) + 1
+        self.bytes_in[key] = self.bytes_in.get(key, 0) + size
+
+    def frame_out(self, realm, t, size: int) -> None:
+        key = self._key(self.frames_out, realm, t)
+        self.frames_out[key] = self.frames_out.get(key, 0) + 1
+        self.bytes_out[key] = self.bytes_out.get(key, 0) + size
+
+    def drop(self, t: str) -> None:
+        self.dropped[t] = self.dropped.get(t, 0) + 1
+
+    def disconnect(self, reason: str) -> None:
+        self.disconnects[reason] = self.disconnects.get(reason, 0) + 1
+
+    def throttle(self, realm, t) -> None:
+        key = self._key(self.throttled, realm, t)
+        self.throttled[key] = self.throttled.get(key, 0) + 1
+
+    def coalesce(self, realm, t) -> None:
+        key = self._key(self.coalesced, realm, t)
+        self.coalesced[key] = self.coalesced.get(key, 0) + 1
+
+    def observe(self, realm, t, seconds: float) -> None:
+        key = self._key(self.latency, realm, t)
+        h = self.latency.get(key)
+        if h is None:
+            h = self.latency[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+        for i, edge in enumerate(LATENCY_BUCKETS):
+            if seconds <= edge:
+                h[i] += 1
+                break
         else:
-            print(f"[bridge] <- {tag} from realm='{realm}'")
-        return
-    if verbose:
-        print(f"[bridge] <- other:{tag} from realm='{realm}' payload={_short_json(obj)}")
-    else:
-        print(f"[bridge] <- other:{tag} from realm='{realm}'")
+            h[len(LATENCY_BUCKETS)] += 1
+        h[-1] += seconds
+
+    def render(self) -> str:
+        out: list[str] = []
+
+        def family(name: str, kind: str, help_: str, rows) -> None:
+            out.append(f"# HELP {name} {help_}")
+            out.append(f"# TYPE {name} {kind}")
+            for labels, value in rows:
+                lab = ",".join(f'{k}="{_label(v)}"' for k, v in labels)
+                out.append(f"{name}{{{lab}}} {value}" if lab else f"{name} {value}")
+
+        def by_rt(series: dict):
+            return [((("realm", r), ("type", t)), v) for (r, t), v in sorted(series.items())]
+
+        family("bridge_frames_in_total", "counter", "Frames received, by realm and type.", by_rt(self.frames_in))
+        family("bridge_bytes_in_total", "counter", "Frame size received (text frames in characters).", by_rt(self.bytes_in))
+        family("bridge_frames_out_total", "counter", "Frames queued for sending.", by_rt(self.frames_out))
+        family("bridge_bytes_out_total", "counter", "Frame size queued for sending (text frames in characters).", by_rt(self.bytes_out))
+        family("bridge_connections", "gauge", "Open connections by role.", [
+            ((("role", "admin"),), len(ADMINS)),
+            ((("role", "firehose"),), len(FIREHOSE)),
+        ])
+        family("bridge_plugins", "gauge", "Plugin connections per realm.",
+               [((("realm", r),), len(s)) for r, s in sorted(PLUGINS.items())])
+        queued: dict[str, list] = {"admin": [0, 0], "plugin": [0, 0]}
+        for box in OUTBOXES.values():
+            q = queued["plugin" if box.label.startswith("plugin:") else "admin"]
+            q[0] += len(box.queue)
+            q[1] = max(q[1], len(box.queue))
+        family("bridge_outbox_queued", "gauge", "Frames waiting in connection outboxes (sum).",
+               [((("role", role),), v[0]) for role, v in queued.items()])
+        family("bridge_outbox_queued_max", "gauge", "Deepest single outbox by role.",
+               [((("role", role),), v[1]) for role, v in queued.items()])
+        family("bridge_dropped_frames_total", "counter", "Frames dropped on outbox overflow.",
+               [((("type", t),), v) for t, v in sorted(self.dropped.items())])
+        family("bridge_disconnects_total", "counter", "Connections closed by the bridge.",
+               [((("reason", r),), v) for r, v in sorted(self.disconnects.items())])
+        family("bridge_throttled_total", "counter", "Admin requests rejected by rate limits.", by_rt(self.throttled))
+        family("bridge_coalesced_total", "counter", "Admin reads served by an identical in-flight or fresh read.",
+               by_rt(self.coalesced))
+        family("bridge_pending_requests", "gauge", "Admin requests waiting for a plugin reply.", [((), len(PENDING))])
+        family("bridge_cluster_link_up", "gauge", "Outgoing link to a cluster peer is up.",
+               [((("node", n),), int(link.up)) for n, link in sorted(CLUSTER.links.items())])
+        family("bridge_cluster_remote_realms", "gauge", "Realms served by other cluster nodes.",
+               [((), len(CLUSTER.remote_realms()))])
+        family("bridge_cluster_forwarded_total", "counter", "Admin requests forwarded to other nodes.",
+               [((), CLUSTER.forwarded)])
+        family("bridge_deflate_bytes_total", "counter", "permessage-deflate bytes: raw vs on the wire.",
+               [((("direction", k.split("_")[0]), ("kind", k.split("_")[1])), v)
+                for k, v in DEFLATE_TOTALS.items() if k != "out_skipped"])
+
+        name = "bridge_route_latency_seconds"
+        out.append(f"# HELP {name} Admin request to first plugin reply.")
+        out.append(f"# TYPE {name} histogram")
+        for (r, t), h in sorted(self.latency.items()):
+            base = f'realm="{_label(r)}",type="{_label(t)}"'
+            acc = 0
+            for edge, n in zip(LATENCY_BUCKETS, h):
+                acc += n
+                out.append(f'{name}_bucket{{{base},le="{edge}"}} {acc}')
+            acc += h[len(LATENCY_BUCKETS)]
+            out.append(f'{name}_bucket{{{base},le="+Inf"}} {acc}')
+            out.append(f"{name}_sum{{{base}}} {h[-1]:.6f}")
+            out.append(f"{name}_count{{{base}}} {acc}")
+        return "\n".join(out) + "\n"
+
+METRICS = Metrics()
+
+async def _metrics_http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """Минимальный HTTP/1.0: GET /metrics -> text/plain; version=0.0.4."""
+    try:
+        request = await asyncio.wait_for(reader.readline(), timeout=5)
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and urlparse(parts[1]).path == "/metrics":
+            body, status, ctype = METRICS.render().encode(), "200 OK", "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            body, status, ctype = b"not found\n", "404 Not Found", "text/plain"
+        writer.write(f"HTTP/1.0 {status}\r\nContent-Type: {ctype}\r\nContent-Length: {len(body)}\r\n"
+                     f"Connection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except Exception:
+        pass
+    finally:
+        writer.close()
 
 # ------------------ helpers ------------------
 
@@ -112,56 +448,1379 @@ def _extract_realm(ws, path: str, first_msg: dict | None, default_realm: str) ->
         )
     return realm or default_realm
 
-async def _send_json(ws, obj: dict):
-    await ws.send(json.dumps(obj, ensure_ascii=False))
+class MeteredDeflate(PerMessageDeflate):
+    """permessage-deflate с порогом по размеру и счётчиками сжатых/исходных байт."""
+
+    def __init__(self, *args, min_size: int = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.min_size = min_size
+        self.counters = {"out_raw": 0, "out_wire": 0, "out_skipped": 0, "in_raw": 0, "in_wire": 0}
+
+    def _count(self, key: str, n: int) -> None:
+        self.counters[key] += n
+        DEFLATE_TOTALS[key] += n
+
+    def encode(self, frame):
+        if frame.opcode in CTRL_OPCODES:
+            return frame
+        raw = len(frame.data)
+        if frame.opcode is not OP_CONT and frame.fin and raw < self.min_size:
+            self._count("out_raw", raw)
+            self._count("out_wire", raw)
+            self._count("out_skipped", 1)
+            return frame
+        out = super().encode(frame)
+        self._count("out_raw", raw)
+        self._count("out_wire", len(out.data))
+        return out
+
+    def decode(self, frame, *, max_size=None):
+        if frame.opcode in CTRL_OPCODES:
+            return frame
+        wire = len(frame.data)
+        out = super().decode(frame, max_size=max_size)
+        self._count("in_wire", wire)
+        self._count("in_raw", len(out.data))
+        return out
+
+class MeteredDeflateFactory(ServerPerMessageDeflateFactory):
+    def process_request_params(self, params, accepted_extensions):
+        response, ext = super().process_request_params(params, accepted_extensions)
+        return response, MeteredDeflate(
+            ext.remote_no_context_takeover, ext.local_no_context_takeover,
+            ext.remote_max_window_bits, ext.local_max_window_bits, ext.compress_settings,
+            min_size=DEFLATE_MIN_SIZE,
+        )
+
+def _deflate_extensions() -> list:
+    if not DEFLATE_ENABLED:
+        return []
+    return [MeteredDeflateFactory(
+        server_no_context_takeover=DEFLATE_SERVER_NO_CTX,
+        client_no_context_takeover=DEFLATE_CLIENT_NO_CTX,
+        server_max_window_bits=DEFLATE_SERVER_WBITS,
+        client_max_window_bits=DEFLATE_CLIENT_WBITS,
+        compress_settings={"level": DEFLATE_LEVEL, "memLevel": DEFLATE_MEM_LEVEL},
+    )]
+
+def _deflate_stats(ws) -> dict | None:
+    for ext in getattr(ws, "extensions", None) or ():
+        if isinstance(ext, MeteredDeflate):
+            return dict(ext.counters)
+    return None
+
+def _pack(obj: dict) -> bytes:
+    return msgpack.packb(obj, use_bin_type=True, default=str)
+
+def _unpack(raw: bytes) -> dict | None:
+    try:
+        obj = msgpack.unpackb(raw, raw=False, strict_map_key=False)
+    except Exception:
+        return None
+    return obj if isinstance(obj, dict) else None
+
+def _encoding(ws) -> str:
+    return ENCODINGS.get(ws, "json")
 
-async def broadcast_admin(msg: dict):
-    dead = []
-    data = json.dumps(msg, ensure_ascii=False)
-    for ws in list(ADMINS):
+def _hello_encoding(hello: dict) -> str:
+    """Что выбрать по hello: msgpack, если клиент его умеет и бридж поддерживает."""
+    caps = hello.get("encodings") or (hello.get("payload") or {}).get("encodings") or ()
+    if isinstance(caps, str):
+        caps = [caps]
+    return "msgpack" if BINARY_ENABLED and "msgpack" in caps else "json"
+
+class Wire:
+    """
+    Кадр и его сериализации для fan-out: каждая кодировка считается не больше одного раза.
+    text/binary — исходный кадр как пришёл, если его можно переслать без перекодирования.
+    """
+    __slots__ = ("obj", "text", "binary")
+
+    def __init__(self, obj: dict, *, text: str | None = None, binary: bytes | None = None):
+        self.obj = obj
+        self.text = text
+        self.binary = binary
+
+    def data_for(self, ws) -> str | bytes:
+        if ENCODINGS.get(ws) == "msgpack":
+            if self.binary is None:
+                self.binary = _pack(self.obj)
+            return self.binary
+        if self.text is None:
+            self.text = json_dumps(self.obj)
+        return self.text
+
+class Outbox:
+    """
+    Ограниченная очередь исходящих кадров одного соединения + задача-писатель.
+    Отправители только кладут уже сериализованную строку и не ждут сокет,
+    поэтому медленный браузер не тормозит остальных и цикл чтения плагина.
+    """
+    __slots__ = ("ws", "label", "maxsize", "queue", "wakeup", "task", "closed",
+                 "sent", "dropped", "dropped_by_type")
+
+    def __init__(self, ws, label: str, maxsize: int = OUTBOX_SIZE):
+        self.ws = ws
+        self.label = label
+        self.maxsize = max(1, maxsize)
+        self.queue: deque = deque()  # (data, type)
+        self.wakeup = asyncio.Event()
+        self.closed = False
+        self.sent = 0
+        self.dropped = 0
+        self.dropped_by_type: dict[str, int] = {}
+        self.task = asyncio.get_running_loop().create_task(self._writer())
+
+    def _count_drop(self, t: str) -> None:
+        self.dropped += 1
+        self.dropped_by_type[t] = self.dropped_by_type.get(t, 0) + 1
+        METRICS.drop(t)
+
+    def push(self, data: str | bytes, t: str) -> bool:
+        if self.closed:
+            return False
+        if len(self.queue) >= self.maxsize:
+            if not _drop_oldest_allowed(t):
+                ev(WARNING, "outbox overflow on control frame, disconnecting", conn=self.label, type=t)
+                METRICS.disconnect("backpressure")
+                self.close(code=1013, reason="backpressure")
+                return False
+            # вытесняем самый старый «сбрасываемый» кадр; если таких нет — сбрасываем текущий
+            for i, (_d, old_t) in enumerate(self.queue):
+                if _drop_oldest_allowed(old_t):
+                    del self.queue[i]
+                    self._count_drop(old_t)
+                    break
+            else:
+                self._count_drop(t)
+                return True
+        self.queue.append((data, t))
+        self.wakeup.set()
+        return True
+
+    async def _writer(self) -> None:
         try:
-            await ws.send(data)
+            while True:
+                while not self.queue:
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                data, _t = self.queue.popleft()
+                await self.ws.send(data)
+                self.sent += 1
+        except asyncio.CancelledError:
+            pass
         except Exception:
-            dead.append(ws)
-    for ws in dead:
-        ADMINS.discard(ws)
+            self.closed = True
+
+    def close(self, *, code: int = 1000, reason: str = "") -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        self.task.cancel()
+        asyncio.get_running_loop().create_task(self.ws.close(code=code, reason=reason))
+
+    def stats(self) -> dict:
+        return {"conn": self.label, "encoding": _encoding(self.ws), "deflate": _deflate_stats(self.ws),
+                "queued": len(self.queue), "sent": self.sent,
+                "dropped": self.dropped, "dropped_by_type": dict(self.dropped_by_type)}
+
+@lru_cache(maxsize=1024)
+def _drop_oldest_allowed(t: str) -> bool:
+    return any(fnmatchcase(t, pattern) for pattern in OUTBOX_DROP_OLDEST)
+
+def _open_outbox(ws, label: str) -> Outbox:
+    box = OUTBOXES.get(ws)
+    if box is None:
+        box = OUTBOXES[ws] = Outbox(ws, label)
+    return box
+
+def _close_outbox(ws) -> None:
+    box = OUTBOXES.pop(ws, None)
+    if box is not None and not box.closed:
+        box.closed = True
+        box.task.cancel()
+
+def _push(ws, data: str | bytes, t: str, realm: str | None = None) -> bool:
+    box = OUTBOXES.get(ws)
+    if box is None:
+        return False
+    METRICS.frame_out(realm, t, len(data))
+    return box.push(data, t)
+
+async def _send_json(ws, obj: dict):
+    # имя историческое: кодировка — та, о которой договорилось соединение
+    data = Wire(obj).data_for(ws)
+    if ws in OUTBOXES:
+        if not _push(ws, data, obj.get("type") or "?", obj.get("realm")):
+            raise ConnectionError("outbox closed")
+        return
+    # соединение ещё не зарегистрировано (рукопожатие) — пишем напрямую
+    await ws.send(data)
+
+@lru_cache(maxsize=4096)
+def _type_matches(pattern: str, t: str) -> bool:
+    return pattern == t or pattern == "*" or fnmatchcase(t, pattern)
+
+def _subscribers_for(realm: str | None, t: str) -> set:
+    """Кому из админов отдать кадр (realm, type): firehose + подходящие подписки."""
+    out = set(FIREHOSE)
+    for key in ((realm, "*") if realm else ("*",)):
+        by_pattern = SUBS.get(key)
+        if not by_pattern:
+            continue
+        for pattern, wss in by_pattern.items():
+            if _type_matches(pattern, t):
+                out |= wss
+    return out
+
+def subscribe(ws, topics: list[tuple[str, str]], *, replace: bool) -> set:
+    if replace:
+        unsubscribe(ws, None)
+    FIREHOSE.discard(ws)
+    mine = ADMIN_TOPICS.setdefault(ws, set())
+    for realm, pattern in topics:
+        SUBS.setdefault(realm, {}).setdefault(pattern, set()).add(ws)
+        mine.add((realm, pattern))
+    return mine
+
+def unsubscribe(ws, topics: list[tuple[str, str]] | None) -> set:
+    mine = ADMIN_TOPICS.get(ws, set())
+    for realm, pattern in list(mine if topics is None else topics):
+        wss = SUBS.get(realm, {}).get(pattern)
+        if wss is not None:
+            wss.discard(ws)
+            if not wss:
+                del SUBS[realm][pattern]
+                if not SUBS[realm]:
+                    del SUBS[realm]
+        mine.discard((realm, pattern))
+    return mine
+
+def _drop_admin(ws) -> None:
+    ADMINS.discard(ws)
+    RATE_BUCKETS.pop(ws, None)
+    RATE_ACTOR_BUCKETS.pop(ws, None)
+    FIREHOSE.discard(ws)
+    unsubscribe(ws, None)
+    ADMIN_TOPICS.pop(ws, None)
+    _forget_admin(ws)
+
+def _parse_topics(obj: dict) -> list[tuple[str, str]]:
+    """
+    topics: [{"realm": "anarchy", "types": ["console.*", "bridge.log"]}, ...]
+    realm "*" (или пусто) — все реалмы; типы — точные или glob-шаблоны.
+    """
+    p = obj.get("payload") or {}
+    raw = obj.get("topics") if obj.get("topics") is not None else p.get("topics")
+    out: list[tuple[str, str]] = []
+    for item in raw or []:
+        if not isinstance(item, dict):
+            continue
+        realm = str(item.get("realm") or "*")
+        types = item.get("types") or item.get("type") or ["*"]
+        if isinstance(types, str):
+            types = [types]
+        out.extend((realm, str(t)) for t in types if t)
+    return out
+
+async def broadcast_admin(msg: dict, extra: set | None = None, *, wire: Wire | None = None):
+    wire = wire or Wire(msg)
+    # кадр realm получает seq и остаётся в буфере досылки даже без единого подписчика сейчас
+    msg, wire = REPLAY.record(msg, wire)
+    targets = _subscribers_for(msg.get("realm"), msg.get("type") or "?")
+    if extra:
+        targets |= extra
+    if not targets:
+        return
+    # сериализуем не больше раза на кодировку, дальше — только в очереди соединений
+    t = msg.get("type") or "?"
+    for ws in targets:
+        if not _push(ws, wire.data_for(ws), t, msg.get("realm")):
+            _drop_admin(ws)
+
+def _remember_request(req_id: str, ws, realm: str | None, t: str | None = None) -> None:
+    now = time.monotonic()
+    # t — тип запроса для гистограммы задержки; после первого ответа сбрасывается в None
+    PENDING[req_id] = (ws, now, realm, t)
+    if now - _PENDING_SWEEP["at"] >= 5.0:
+        _PENDING_SWEEP["at"] = now
+        for rid in [r for r, (_ws, ts, _realm, _t) in PENDING.items() if now - ts > PENDING_TTL]:
+            PENDING.pop(rid, None)
+
+def _forget_admin(ws) -> None:
+    for rid in [r for r, (w, _ts, _realm, _t) in PENDING.items() if w is ws]:
+        PENDING.pop(rid, None)
+
+def _waiting_on_realm(realm: str | None) -> set:
+    """Админы с незакрытыми запросами к realm — им идут ответы старых плагинов без req_id."""
+    return {w for (w, _ts, r, _t) in PENDING.values() if r == realm}
+
+async def route_reply(msg: dict, wire: Wire | None = None, *, forward: bool = True) -> None:
+    """
+    Ответ плагина: если в нём есть известный req_id — только спросившему админу,
+    иначе — подписчикам топика (и тем, кто ждёт ответа от этого realm).
+    forward=False — кадр уже пришёл от соседнего узла кластера, дальше не рассылаем.
+    """
+    rid = msg.get("req_id")
+    # ответ на команду пакета, который разворачивает сам бридж: забирает console.batch
+    if rid and BATCH_WAITS and _batch_frame(rid, msg) and msg.get("type") not in STREAM_TYPES:
+        return
+    # старый плагин без req_id: кадр относим к команде пакета в полёте и рассылаем как обычно
+    if not rid and BATCH_LEGACY and msg.get("realm") in BATCH_LEGACY:
+        _batch_frame(BATCH_LEGACY[msg["realm"]], msg)
+    # ответ на схлопнутое чтение — всем, кто его ждал
+    if rid and COALESCE_BY_RID and _coalesced_reply(rid, msg):
+        return
+    route = PENDING.get(rid) if rid else None
+    if route is None or msg.get("type") in STREAM_TYPES:
+        await broadcast_admin(msg, extra=None if rid else _waiting_on_realm(msg.get("realm")), wire=wire)
+        if forward:
+            CLUSTER.broadcast(msg)
+        return
+    ws, started, realm, req_type = route
+    if req_type is not None:
+        METRICS.observe(realm, req_type, time.monotonic() - started)
+        PENDING[rid] = (ws, started, realm, None)
+    if not _push(ws, (wire or Wire(msg)).data_for(ws), msg.get("type") or "?", msg.get("realm")):
+        _drop_admin(ws)
 
 def realm_has_plugins(realm: str) -> bool:
     return realm in PLUGINS and len(PLUGINS[realm]) > 0
 
 def _single_online_realm() -> str | None:
-    live = [r for r, s in PLUGINS.items() if len(s) > 0]
-    return live[0] if len(live) == 1 else None
-
-async def route_to_realm(realm: str | None, msg: dict):
+    live = {r for r, s in PLUGINS.items() if len(s) > 0} | set(CLUSTER.remote_realms())
+    return next(iter(live)) if len(live) == 1 else None
+
+def _online_counts() -> dict[str, int]:
+    """Плагины по realm во всём кластере (локальные + объявленные соседями)."""
+    counts = dict(CLUSTER.remote_realms())
+    for r, s in PLUGINS.items():
+        if s:
+            counts[r] = counts.get(r, 0) + len(s)
+    return counts
+
+async def route_to_realm(realm: str | None, msg: dict, origin=None, *, forward: bool = True):
     if not realm:
         realm = _single_online_realm()
+    # плагин realm подключён к соседнему узлу — отдаём запрос туда (ответ вернётся cluster.reply)
+    node = CLUSTER.node_for(realm) if forward else None
+    if node is not None and CLUSTER.forward(node, {**msg, "realm": realm}):
+        ev(DEBUG, "route to node", type=msg.get("type"), realm=realm, node=node)
+        return
     if not realm or not realm_has_plugins(realm):
-        print(f"[bridge] NO PLUGIN for realm='{realm}', drop: {msg.get('type')}")
-        await broadcast_admin({
+        ev(WARNING, "no plugin for realm, drop", realm=realm, type=msg.get("type"))
+        warn = {
             "type": "bridge.warn",
             "payload": {
                 "message": f"No plugin online for realm '{realm}'",
                 "request": msg
             }
-        })
+        }
+        if origin is not None and msg.get("req_id"):
+            PENDING.pop(msg["req_id"], None)
+            with contextlib.suppress(Exception):
+                await _send_json(origin, {**warn, "req_id": msg["req_id"], "realm": realm})
+            return
+        await broadcast_admin(warn)
         return
     t = msg.get("type")
-    print(f"[bridge] ROUTE {t} -> realm='{realm}'")
-    data = json.dumps(msg, ensure_ascii=False)
-    dead = []
+    ev(DEBUG, "route", type=t, realm=realm)
+    wire = Wire(msg)
     for ws in list(PLUGINS[realm]):
+        if not _push(ws, wire.data_for(ws), t or "?", realm):
+            PLUGINS[realm].discard(ws)
+
+# ------------------ stats cache ------------------
+
+async def serve_stats(ws, realm: str | None, req_id: str, norm: dict, *, forward: bool = True) -> None:
+    """
+    stats.query: свежий (моложе STATS_MAX_AGE) снимок отдаём из кэша без похода к плагину;
+    одновременные промахи по одному realm схлопываются в один server.stats к плагину.
+    В кластере кэш пополняется и снимками соседей (cluster.stats), промах уходит узлу плагина.
+    """
+    realm = realm or _single_online_realm()
+    now = time.monotonic()
+    cached = STATS_CACHE.get(realm) if realm else None
+    if cached and now - cached["at"] <= STATS_MAX_AGE and (realm_has_plugins(realm) or CLUSTER.node_for(realm)):
+        await _send_json(ws, {**cached["frame"], "req_id": req_id, "cached": True,
+                              "age_ms": int((now - cached["at"]) * 1000)})
+        return
+
+    if forward and CLUSTER.node_for(realm):
+        _remember_request(req_id, ws, realm, "server.stats")
+        await route_to_realm(realm, {**norm, "realm": realm}, origin=ws)
+        return
+    if not realm or not realm_has_plugins(realm):
+        await route_to_realm(realm, norm, origin=ws, forward=False)
+        return
+
+    inflight = STATS_INFLIGHT.get(realm)
+    if inflight and now - inflight["at"] <= STATS_INFLIGHT_TTL:
+        inflight["waiters"].append((ws, req_id))
+        return
+
+    upstream = f"stats-{uuid.uuid4().hex}"
+    waiters = (inflight or {}).get("waiters", []) + [(ws, req_id)]
+    STATS_INFLIGHT[realm] = {"req_id": upstream, "at": now, "waiters": waiters}
+    await route_to_realm(realm, {**norm, "realm": realm, "req_id": upstream}, origin=None)
+
+async def on_plugin_stats(realm: str, obj: dict) -> None:
+    """Запомнить снимок и раздать его всем, кто ждал ответа на схлопнутый запрос."""
+    entry = STATS_CACHE[realm] = {"at": time.monotonic(), "ts": time.time(), "frame": obj}
+    CLUSTER.share_stats(realm, entry)
+    inflight = STATS_INFLIGHT.get(realm)
+    if not inflight:
+        return
+    rid = obj.get("req_id")
+    # старые плагины не возвращают req_id — считаем ответом первый server.stats
+    if rid != inflight["req_id"] and not (rid is None and obj.get("type") == "server.stats"):
+        return
+    del STATS_INFLIGHT[realm]
+    METRICS.observe(realm, "server.stats", time.monotonic() - inflight["at"])
+    for ws, req_id in inflight["waiters"]:
+        with contextlib.suppress(Exception):
+            await _send_json(ws, {**obj, "req_id": req_id})
+
+# тяжёлые блоки снимка, которые обзору всех realm не нужны
+OVERVIEW_SKIP = {"players_list", "worlds", "worlds_map", "entities_top_types", "entities_total_types",
+                 "plugins", "mem_pools", "gc", "fs"}
+
+def stats_overview() -> dict:
+    """Последний известный снимок каждого realm из кэша (без похода к плагинам) + кто онлайн."""
+    latest = {}
+    for realm, cached in STATS_CACHE.items():
+        frame = cached["frame"]
+        data = frame.get("data") or frame.get("payload") or {}
+        latest[realm] = {
+            "ts": cached["ts"],
+            "data": {k: v for k, v in data.items() if k not in OVERVIEW_SKIP},
+        }
+    return {"online": _online_counts(), "latest": latest}
+
+# ------------------ rate limits & coalescing ------------------
+#
+# Запросы админа, которые уходят плагину, проходят через token bucket на (соединение, realm, type):
+# SP_RATE_LIMITS="console.exec=5:10,..." — тип (glob) = запросов в секунду:запас. Первое совпадение
+# по порядку; тип без совпадения не ограничивается. Сверх лимита плагину ничего не уходит, админ
+# получает bridge.throttled {type, realm, retry_after_ms, limit}. Ответы из кэша снимков и
+# присоединение к схлопнутому чтению токенов не тратят.
+# Второй слой — справедливость внутри общего сокета: кадр с "actor" (панель ставит пользователя
+# сессии или "background") дополнительно тратит токен из bucket актора с долей SP_RATE_ACTOR_SHARE
+# от лимита. Бакет соединения списывается всегда, так что сменой actor лимит не обойти; акторов
+# на соединение не больше SP_RATE_ACTORS_MAX (вытесняется давно не приходивший).
+# Одинаковые идемпотентные чтения (COALESCE_TYPES с тем же realm и payload) схлопываются: к плагину
+# идёт один запрос, ответ раздаётся всем ждущим со своими req_id и ещё COALESCE_MS отдаётся сразу.
+# Только для плагинов, которые возвращают req_id (caps "req_id" или "console.batch" в hello); если
+# ответа нет COALESCE_INFLIGHT_TTL секунд, ждущие получают bridge.warn и следующий запрос идёт заново.
+# server.stats схлопывается отдельно — кэшем снимков (serve_stats).
+RATE_LIMIT_ENABLED = os.getenv("SP_RATE_LIMIT", "1") not in ("0", "", "false", "False")
+COALESCE_MS = float(os.getenv("SP_COALESCE_MS", "250"))
+COALESCE_INFLIGHT_TTL = float(os.getenv("SP_COALESCE_INFLIGHT_TTL", str(STATS_INFLIGHT_TTL)))
+COALESCE_TYPES = tuple(
+    t.strip() for t in os.getenv(
+        "SP_COALESCE_TYPES", "lp.user.info,lp.group.info,jp.balance.get,player.is_online,cmdwl.commands",
+    ).split(",") if t.strip()
+)
+
+def _parse_limits(raw: str) -> list[tuple[str, float, float]]:
+    """Разбор "console.exec=5:10,lp.*=5" -> [(pattern, rate, burst)]; без burst — burst = rate."""
+    out = []
+    for part in raw.split(","):
+        pattern, _, spec = part.strip().partition("=")
+        rate, _, burst = spec.partition(":")
+        with contextlib.suppress(ValueError):
+            if pattern.strip() and float(rate) > 0:
+                out.append((pattern.strip(), float(rate), float(burst or rate)))
+    return out
+
+RATE_LIMITS = _parse_limits(os.getenv(
+    "SP_RATE_LIMITS",
+    "console.exec=5:20,console.execLines=2:5,console.batch=1:3,server.stats=5:10,"
+    "lp.*=10:20,jp.*=10:20,*=20:40",
+))
+RATE_ACTOR_SHARE = min(1.0, max(0.0, float(os.getenv("SP_RATE_ACTOR_SHARE", "0.5"))))
+RATE_ACTORS_MAX = int(os.getenv("SP_RATE_ACTORS_MAX", "32"))
+# ws -> (realm, type) -> [tokens, last monotonic]
+RATE_BUCKETS: dict = {}
+# ws -> OrderedDict actor -> (realm, type) -> [tokens, last monotonic]
+RATE_ACTOR_BUCKETS: dict = {}
+
+@lru_cache(maxsize=1024)
+def _limit_for(t: str) -> tuple[float, float] | None:
+    for pattern, rate, burst in RATE_LIMITS:
+        if _type_matches(pattern, t):
+            return rate, burst
+    return None
+
+def _refill(buckets: dict, key: tuple, rate: float, burst: float, now: float) -> list:
+    b = buckets.get(key)
+    if b is None:
+        b = buckets[key] = [burst, now]
+    b[0] = min(burst, b[0] + (now - b[1]) * rate)
+    b[1] = now
+    return b
+
+def _actor_buckets(ws, actor: str) -> dict:
+    actors = RATE_ACTOR_BUCKETS.get(ws)
+    if actors is None:
+        actors = RATE_ACTOR_BUCKETS[ws] = OrderedDict()
+    buckets = actors.get(actor)
+    if buckets is None:
+        buckets = actors[actor] = {}
+        while len(actors) > RATE_ACTORS_MAX:
+            actors.popitem(last=False)
+    else:
+        actors.move_to_end(actor)
+    return buckets
+
+def _take_token(ws, actor: str, realm: str | None, t: str) -> float:
+    """0 — запрос можно пропустить; иначе сколько секунд ждать до следующего токена."""
+    limit = _limit_for(t) if RATE_LIMIT_ENABLED else None
+    if limit is None:
+        return 0.0
+    rate, burst = limit
+    now = time.monotonic()
+    conn = _refill(RATE_BUCKETS.setdefault(ws, {}), (realm, t), rate, burst, now)
+    if conn[0] < 1.0:
+        return (1.0 - conn[0]) / rate
+    if actor and RATE_ACTOR_SHARE < 1.0 and RATE_ACTORS_MAX > 0:
+        a_rate, a_burst = rate * RATE_ACTOR_SHARE, max(1.0, burst * RATE_ACTOR_SHARE)
+        mine = _refill(_actor_buckets(ws, actor), (realm, t), a_rate, a_burst, now)
+        if mine[0] < 1.0:
+            return (1.0 - mine[0]) / a_rate
+        mine[0] -= 1.0
+    conn[0] -= 1.0
+    return 0.0
+
+async def throttled(ws, actor: str, realm: str | None, t: str, req_id: str) -> bool:
+    """True — запрос превысил лимит и уже получил bridge.throttled."""
+    wait = _take_token(ws, actor, realm, t)
+    if not wait:
+        return False
+    rate, burst = _limit_for(t)
+    METRICS.throttle(realm, t)
+    ev(DEBUG, "throttled", remote=getattr(ws, "remote_address", None), actor=actor, realm=realm, type=t)
+    with contextlib.suppress(Exception):
+        await _send_json(ws, {
+            "type": "bridge.throttled",
+            "req_id": req_id,
+            "realm": realm,
+            "payload": {"type": t, "realm": realm, "retry_after_ms": max(1, int(wait * 1000)),
+                        "limit": {"rate": rate, "burst": burst}},
+        })
+    return True
+
+# ключ чтения -> {"req_id": upstream, "at", "waiters": [(ws, req_id)], "reply": кадр|None, "done_at"}
+COALESCE: dict[tuple, dict] = {}
+# upstream req_id -> ключ
+COALESCE_BY_RID: dict[str, tuple] = {}
+_COALESCE_SWEEP = {"at": 0.0}
+
+@lru_cache(maxsize=256)
+def _coalescable(t: str) -> bool:
+    return any(_type_matches(p, t) for p in COALESCE_TYPES)
+
+def _echoes_req_id(realm: str) -> bool:
+    """Все плагины realm на этом узле объявили, что возвращают req_id в ответах."""
+    plugins = PLUGINS.get(realm) or ()
+    return bool(plugins) and all(PLUGIN_CAPS.get(ws, set()) & {"req_id", "console.batch"} for ws in plugins)
+
+def _coalesce_key(realm: str, norm: dict) -> tuple:
+    body = {k: v for k, v in norm.items() if k not in ("req_id", "realm")}
+    return realm, norm.get("type"), json.dumps(body, sort_keys=True, ensure_ascii=False, default=str)
+
+def _served_locally(realm: str | None, t: str, norm: dict) -> bool:
+    """Запрос обслужат без плагина: свежий снимок в кэше, летящий server.stats или такое же чтение."""
+    realm = realm or _single_online_realm()
+    if not realm:
+        return False
+    now = time.monotonic()
+    if t == "server.stats":
+        cached = STATS_CACHE.get(realm)
+        if cached and now - cached["at"] <= STATS_MAX_AGE and (realm_has_plugins(realm) or CLUSTER.node_for(realm)):
+            return True
+        inflight = STATS_INFLIGHT.get(realm)
+        return bool(inflight) and now - inflight["at"] <= STATS_INFLIGHT_TTL and realm_has_plugins(realm)
+    if _coalescable(t):
+        entry = COALESCE.get(_coalesce_key(realm, norm))
+        return entry is not None and _coalesce_live(entry, now)
+    return False
+
+def _coalesce_live(entry: dict, now: float) -> bool:
+    if entry["done_at"] is None:
+        return now - entry["at"] <= COALESCE_INFLIGHT_TTL
+    return now - entry["done_at"] <= COALESCE_MS / 1000.0
+
+def _sweep_coalesce(now: float) -> None:
+    if now - _COALESCE_SWEEP["at"] < 1.0:
+        return
+    _COALESCE_SWEEP["at"] = now
+    for key, entry in list(COALESCE.items()):
+        if entry["done_at"] is not None and not _coalesce_live(entry, now):
+            COALESCE.pop(key, None)
+            COALESCE_BY_RID.pop(entry["req_id"], None)
+
+def _expire_coalesce(key: tuple, upstream: str) -> None:
+    """Плагин не ответил на схлопнутое чтение за COALESCE_INFLIGHT_TTL: ждущим — bridge.warn."""
+    entry = COALESCE.get(key)
+    if entry is None or entry["req_id"] != upstream or entry["reply"] is not None:
+        return
+    COALESCE.pop(key, None)
+    COALESCE_BY_RID.pop(upstream, None)
+    realm, t = key[0], key[1]
+    ev(WARNING, "coalesced read timed out", realm=realm, type=t, waiters=len(entry["waiters"]))
+    for ws, req_id in entry["waiters"]:
+        warn = {"type": "bridge.warn", "req_id": req_id, "realm": realm,
+                "payload": {"message": f"Plugin did not answer {t} in {COALESCE_INFLIGHT_TTL:g}s",
+                            "request": {"type": t, "realm": realm}, "reason": "timeout"}}
+        if not _push(ws, Wire(warn).data_for(ws), "bridge.warn", realm):
+            _drop_admin(ws)
+
+async def coalesce_read(ws, realm: str | None, req_id: str, norm: dict) -> bool:
+    """True — запрос обслужен (свежий ответ) или присоединён к уже летящему такому же."""
+    realm = realm or _single_online_realm()
+    # ответ сопоставляется только по req_id — плагины, которые его не возвращают, и realm на
+    # соседнем узле (их caps здесь не известны) идут обычным путём
+    if not realm or not _echoes_req_id(realm):
+        return False
+    now = time.monotonic()
+    _sweep_coalesce(now)
+    key = _coalesce_key(realm, norm)
+    entry = COALESCE.get(key)
+    if entry is not None and not _coalesce_live(entry, now):
+        COALESCE.pop(key, None)
+        COALESCE_BY_RID.pop(entry["req_id"], None)
+        entry = None
+    if entry is not None:
+        METRICS.coalesce(realm, norm.get("type"))
+        if entry["reply"] is not None:
+            await _send_json(ws, {**entry["reply"], "req_id": req_id, "coalesced": True})
+        else:
+            entry["waiters"].append((ws, req_id))
+        return True
+    upstream = f"co-{uuid.uuid4().hex}"
+    COALESCE[key] = {"req_id": upstream, "at": now, "waiters": [(ws, req_id)], "reply": None, "done_at": None}
+    COALESCE_BY_RID[upstream] = key
+    asyncio.get_running_loop().call_later(COALESCE_INFLIGHT_TTL, _expire_coalesce, key, upstream)
+    await route_to_realm(realm, {**norm, "realm": realm, "req_id": upstream})
+    return True
+
+def _coalesced_reply(rid: str, msg: dict) -> bool:
+    """Ответ плагина на схлопнутое чтение: раздать ждущим. False — это не наш req_id."""
+    key = COALESCE_BY_RID.get(rid)
+    entry = COALESCE.get(key) if key else None
+    if entry is None:
+        return False
+    if entry["reply"] is None:
+        entry["reply"] = msg
+        entry["done_at"] = time.monotonic()
+        METRICS.observe(key[0], key[1], entry["done_at"] - entry["at"])
+    for ws, req_id in entry["waiters"]:
+        if not _push(ws, Wire({**msg, "req_id": req_id}).data_for(ws), msg.get("type") or "?", msg.get("realm")):
+            _drop_admin(ws)
+    return True
+
+# ------------------ console batch ------------------
+#
+# console.batch {commands: [{cmd, run_as, player, delay_ms}], stop_on_error, timeout_ms} — пачка
+# команд одним запросом, один итоговый кадр console.batch.result с результатом каждой команды.
+# Плагин, объявивший в hello caps: ["console.batch"], получает пачку как есть. Для остальных
+# бридж сам разворачивает её в console.exec по порядку (до BATCH_WINDOW команд в полёте,
+# delay_ms — пауза перед командой) и собирает console_done по req_id "<req_id>#<i>".
+# Плагины без caps "req_id" ответы им не помечают: для них команды идут строго по одной на realm,
+# и вывод/console_done без req_id относятся к команде в полёте (кадры при этом расходятся как обычно;
+# console.exec другого админа в тот же realm в это время может быть принят за неё).
+BATCH_MAX = int(os.getenv("SP_BATCH_MAX", "5000"))                   # команд в одном кадре
+BATCH_WINDOW = max(1, int(os.getenv("SP_BATCH_WINDOW", "32")))        # команд без console_done
+BATCH_CMD_TIMEOUT = float(os.getenv("SP_BATCH_CMD_TIMEOUT", "10"))    # ждать console_done, сек
+BATCH_OUTPUT_LINES = int(os.getenv("SP_BATCH_OUTPUT_LINES", "20"))    # строк вывода на команду в итоге
+# req_id команды пакета -> состояние её ожидания
+BATCH_WAITS: dict[str, dict] = {}
+# realm плагина без req_id -> req_id команды пакета в полёте; пакеты в такой realm идут по очереди
+BATCH_LEGACY: dict[str, str] = {}
+BATCH_LEGACY_LOCKS: dict[str, asyncio.Lock] = {}
+
+def _batch_commands(p: dict) -> list[dict]:
+    out = []
+    for item in p.get("commands") or p.get("lines") or []:
+        if isinstance(item, str):
+            item = {"cmd": item}
+        if not isinstance(item, dict):
+            continue
+        cmd = str(item.get("cmd") or item.get("command") or item.get("command_text") or "").strip().lstrip("/")
+        if not cmd:
+            continue
+        out.append({
+            "cmd": cmd,
+            "run_as": str(item.get("run_as") or "CONSOLE").upper(),
+            "player": item.get("player"),
+            "delay_ms": max(0, int(item.get("delay_ms") or item.get("run_delay_ms") or 0)),
+        })
+    return out
+
+def _plugin_supports(realm: str, cap: str) -> bool:
+    return any(cap in PLUGIN_CAPS.get(ws, ()) for ws in PLUGINS.get(realm, ()))
+
+def _batch_frame(rid: str, msg: dict) -> bool:
+    """Кадр плагина с req_id команды пакета: копим вывод, console_done/ошибка закрывают ожидание."""
+    wait = BATCH_WAITS.get(rid)
+    if wait is None:
+        return False
+    t = msg.get("type") or "?"
+    p = msg.get("payload") if isinstance(msg.get("payload"), dict) else {}
+    if t in STREAM_TYPES:
+        line = p.get("line") or p.get("text") or msg.get("line")
+        if line is not None and len(wait["output"]) < wait["max_lines"]:
+            wait["output"].append(str(line))
+        return True
+    if t == "console_done" or t == "error" or t.endswith(".error"):
+        ok = t == "console_done" and p.get("ok", True) is not False and not p.get("error")
+        if not wait["future"].done():
+            wait["future"].set_result((ok, p.get("error") or msg.get("error")))
+        return True
+    return t == "bridge.ack"
+
+async def run_batch(ws, realm: str | None, req_id: str, norm: dict, *, forward: bool = True) -> None:
+    realm = realm or _single_online_realm()
+    if forward and CLUSTER.node_for(realm):
+        _remember_request(req_id, ws, realm, "console.batch")
+        await route_to_realm(realm, {**norm, "realm": realm}, origin=ws)
+        return
+    p = norm.get("payload") or {}
+    commands = _batch_commands(p)
+    if len(commands) > BATCH_MAX:
+        await _send_json(ws, {"type": "console.batch.result", "req_id": req_id, "realm": realm,
+                              "error": f"too many commands: {len(commands)} > {BATCH_MAX}"})
+        return
+    if not realm or not realm_has_plugins(realm) or _plugin_supports(realm, "console.batch"):
+        _remember_request(req_id, ws, realm, "console.batch")
+        await route_to_realm(realm, {**norm, "realm": realm, "payload": {**p, "commands": commands}}, origin=ws)
+        return
+    asyncio.get_running_loop().create_task(_expand_batch(ws, realm, req_id, commands, p))
+
+async def _expand_batch(ws, realm: str, req_id: str, commands: list[dict], p: dict) -> None:
+    if _echoes_req_id(realm):
+        await _expand_batch_run(ws, realm, req_id, commands, p, legacy=False)
+        return
+    lock = BATCH_LEGACY_LOCKS.setdefault(realm, asyncio.Lock())
+    async with lock:
+        await _expand_batch_run(ws, realm, req_id, commands, p, legacy=True)
+
+async def _expand_batch_run(ws, realm: str, req_id: str, commands: list[dict], p: dict, *, legacy: bool) -> None:
+    started = time.monotonic()
+    stop_on_error = bool(p.get("stop_on_error"))
+    timeout = float(p.get("timeout_ms") or BATCH_CMD_TIMEOUT * 1000) / 1000.0
+    max_lines = min(BATCH_OUTPUT_LINES, int(p.get("output_lines", BATCH_OUTPUT_LINES)))
+    # stop_on_error или плагин без req_id — следующая команда уходит только после результата предыдущей
+    window = asyncio.Semaphore(1 if stop_on_error or legacy else BATCH_WINDOW)
+    results: list[dict] = [{"i": i, "cmd": c["cmd"], "status": "skipped"} for i, c in enumerate(commands)]
+    waits: list[tuple] = []
+    failed = asyncio.Event()
+
+    async def collect(i: int, rid: str, wait: dict) -> None:
         try:
-            await ws.send(data)
-        except Exception:
-            dead.append(ws)
-    for ws in dead:
-        PLUGINS[realm].discard(ws)
+            ok, error = await asyncio.wait_for(wait["future"], timeout)
+            results[i]["status"] = "ok" if ok else "error"
+            if error:
+                results[i]["error"] = str(error)
+        except asyncio.TimeoutError:
+            results[i]["status"] = "timeout"
+        finally:
+            BATCH_WAITS.pop(rid, None)
+            if BATCH_LEGACY.get(realm) == rid:
+                BATCH_LEGACY.pop(realm, None)
+            window.release()
+            if wait["output"]:
+                results[i]["output"] = wait["output"]
+            if results[i]["status"] != "ok":
+                failed.set()
+
+    try:
+        for i, c in enumerate(commands):
+            if c["delay_ms"]:
+                await asyncio.sleep(c["delay_ms"] / 1000.0)
+            await window.acquire()
+            if stop_on_error and failed.is_set():
+                window.release()
+                break
+            if c["run_as"] != "CONSOLE":
+                # console.exec старых плагинов выполняет всё от консоли — от имени игрока не запускаем
+                results[i].update(status="error", error="run_as PLAYER requires plugin console.batch support")
+                window.release()
+                failed.set()
+                continue
+            if not realm_has_plugins(realm):
+                results[i].update(status="error", error="plugin offline")
+                window.release()
+                failed.set()
+                continue
+            rid = f"{req_id}#{i}"
+            wait = BATCH_WAITS[rid] = {"future": asyncio.get_running_loop().create_future(), "output": [],
+                                       "max_lines": max_lines}
+            if legacy:
+                BATCH_LEGACY[realm] = rid
+            await route_to_realm(realm, {"type": "console.exec", "realm": realm, "command": c["cmd"], "req_id": rid},
+                                 forward=False)
+            results[i]["status"] = "sent"
+            waits.append(asyncio.create_task(collect(i, rid, wait)))
+        if waits:
+            await asyncio.gather(*waits)
+    finally:
+        for task in waits:
+            task.cancel()
+        for i in range(len(commands)):
+            BATCH_WAITS.pop(f"{req_id}#{i}", None)
+        if BATCH_LEGACY.get(realm, "").startswith(f"{req_id}#"):
+            BATCH_LEGACY.pop(realm, None)
+
+    counts: dict[str, int] = {}
+    for r in results:
+        counts[r["status"]] = counts.get(r["status"], 0) + 1
+    elapsed = time.monotonic() - started
+    METRICS.observe(realm, "console.batch", elapsed)
+    ev(INFO, "console batch", realm=realm, req_id=req_id, total=len(commands), legacy=legacy, **counts)
+    with contextlib.suppress(Exception):
+        await _send_json(ws, {
+            "type": "console.batch.result",
+            "req_id": req_id,
+            "realm": realm,
+            "payload": {"total": len(commands), "ok": counts.get("ok", 0),
+                        "failed": len(commands) - counts.get("ok", 0), "counts": counts,
+                        "elapsed_ms": int(elapsed * 1000), "match": "legacy" if legacy else "req_id",
+                        "results": results},
+        })
+
+# ------------------ replay ------------------
+#
+# Кадры плагинов, разосланные подписчикам (консоль, lp.user.changed, jp.*, bridge.info ...),
+# получают сквозной номер seq и оседают в кольцевом буфере своего realm. Админ, переживший обрыв,
+# переподключается с resume_from=<последний увиденный seq> (в admin.subscribe или в query) и
+# получает только пропущенное, а не перезапрашивает всё состояние. epoch меняется при рестарте
+# бриджа: seq другого epoch не имеет смысла — тогда клиенту отвечают gap и он делает полный запрос.
+# Ответы на конкретный req_id в буфер не попадают.
+REPLAY_SIZE = int(os.getenv("SP_REPLAY_SIZE", "1000"))             # кадров на realm (0 — выключено)
+REPLAY_BYTES = int(os.getenv("SP_REPLAY_BYTES", str(1 << 20)))     # байт на realm
+REPLAY_PACE = 16                                                  # свободных мест в outbox при досылке
+
+def _parse_caps(raw: str) -> dict[str, int]:
+    """Разбор "a=10,b*=2" -> {"a": 10, "b*": 2}; кривые записи пропускаем."""
+    out: dict[str, int] = {}
+    for part in raw.split(","):
+        key, _, val = part.strip().partition("=")
+        with contextlib.suppress(ValueError):
+            if key.strip():
+                out[key.strip()] = int(val)
+    return out
+
+# realm -> лимит кадров (перекрывает REPLAY_SIZE)
+REPLAY_REALM_CAPS = _parse_caps(os.getenv("SP_REPLAY_REALM_CAPS", ""))
+# тип (glob) -> сколько последних кадров этого типа держать; снимки статистики — это состояние,
+# а не события: достаточно последнего
+REPLAY_TYPE_CAPS = _parse_caps(os.getenv("SP_REPLAY_TYPE_CAPS", "stats.report=1,server.stats=1,bridge.echo=0"))
+
+@lru_cache(maxsize=1024)
+def _replay_type_cap(t: str) -> int | None:
+    for pattern, cap in REPLAY_TYPE_CAPS.items():
+        if _type_matches(pattern, t):
+            return cap
+    return None
+
+def _splice_seq(text: str | None, seq: int) -> str | None:
+    """Дописать "seq" в уже сериализованный JSON-объект, чтобы не кодировать кадр заново."""
+    if not text:
+        return None
+    body = text.rstrip()
+    if not body.endswith("}") or body.endswith("{}"):
+        return None
+    return f'{body[:-1]},"seq":{seq}}}'
+
+class ReplayRing:
+    """Последние кадры одного realm: (seq, type, frame, size); seq возрастают."""
+    __slots__ = ("realm", "frames", "bytes", "by_type", "lost_upto", "max_frames")
+
+    def __init__(self, realm: str):
+        self.realm = realm
+        self.frames: deque = deque()
+        self.bytes = 0
+        self.by_type: dict[str, int] = {}
+        # последний seq, вытесненный по размеру: кто просит resume_from меньше — получил дыру
+        self.lost_upto = 0
+        self.max_frames = REPLAY_REALM_CAPS.get(realm, REPLAY_SIZE)
+
+    def add(self, seq: int, t: str, frame: dict, size: int) -> None:
+        cap = _replay_type_cap(t)
+        if cap is not None and cap <= 0:
+            return
+        self.frames.append((seq, t, frame, size))
+        self.bytes += size
+        n = self.by_type[t] = self.by_type.get(t, 0) + 1
+        if cap is not None and n > cap:
+            # лимит типа: убираем самый старый кадр того же типа (его заменил свежий — это не дыра)
+            for i, item in enumerate(self.frames):
+                if item[1] == t:
+                    del self.frames[i]
+                    self._forget(item)
+                    break
+        while self.frames and (len(self.frames) > self.max_frames or self.bytes > REPLAY_BYTES):
+            item = self.frames.popleft()
+            self._forget(item)
+            self.lost_upto = item[0]
+
+    def _forget(self, item: tuple) -> None:
+        self.bytes -= item[3]
+        left = self.by_type[item[1]] - 1
+        if left:
+            self.by_type[item[1]] = left
+        else:
+            del self.by_type[item[1]]
+
+    def since(self, seq: int, patterns: list[str]) -> list[tuple]:
+        return [(s, f) for s, t, f, _ in self.frames
+                if s > seq and any(_type_matches(p, t) for p in patterns)]
+
+    def stats(self) -> dict:
+        return {"frames": len(self.frames), "bytes": self.bytes, "lost_upto": self.lost_upto,
+                "first": self.frames[0][0] if self.frames else None,
+                "last": self.frames[-1][0] if self.frames else None}
+
+class Replay:
+    def __init__(self):
+        self.epoch = uuid.uuid4().hex[:12]
+        self.seq = 0
+        self.rings: dict[str, ReplayRing] = {}
+
+    def record(self, msg: dict, wire: Wire) -> tuple[dict, Wire]:
+        """Выдать кадру seq и запомнить его; возвращает кадр/Wire с seq для рассылки."""
+        realm = msg.get("realm")
+        if not REPLAY_SIZE or not realm:
+            return msg, wire
+        self.seq += 1
+        seq = self.seq
+        stamped = {**msg, "seq": seq}
+        # исходный текст (ретрансляция без перекодирования) дополняем на месте; msgpack пересоберётся
+        wire = Wire(stamped, text=_splice_seq(wire.text, seq))
+        ring = self.rings.get(realm)
+        if ring is None:
+            ring = self.rings[realm] = ReplayRing(realm)
+        size = len(wire.text) if wire.text is not None else len(wire.data_for(None))
+        ring.add(seq, msg.get("type") or "?", stamped, size)
+        return stamped, wire
+
+    def _patterns(self, ws) -> dict[str, list[str]]:
+        """realm|"*" -> шаблоны типов, на которые подписан админ (firehose — всё)."""
+        if ws in FIREHOSE:
+            return {"*": ["*"]}
+        out: dict[str, list[str]] = {}
+        for realm, pattern in ADMIN_TOPICS.get(ws, ()):
+            out.setdefault(realm, []).append(pattern)
+        return out
+
+    async def resume(self, ws, since: int, epoch: str | None = None, req_id: str | None = None) -> None:
+        """Дослать админу кадры его подписок с seq > since, затем bridge.resume с итогом."""
+        result = {"epoch": self.epoch, "from": since, "to": self.seq, "replayed": 0, "gap": False}
+        if epoch and epoch != self.epoch:
+            # бридж перезапускался — номера из прошлой жизни ничего не значат
+            result.update(gap=True, reason="epoch")
+        elif since < self.seq:
+            by_realm = self._patterns(ws)
+            frames: list[tuple] = []
+            for realm, ring in self.rings.items():
+                patterns = by_realm.get(realm, []) + by_realm.get("*", [])
+                if not patterns:
+                    continue
+                if ring.lost_upto > since:
+                    result["gap"] = True
+                    result["reason"] = "evicted"
+                frames.extend(ring.since(since, patterns))
+            frames.sort(key=lambda item: item[0])
+            box = OUTBOXES.get(ws)
+            for _seq, frame in frames:
+                # досылка не должна переполнить очередь: управляющий кадр в полной очереди рвёт соединение
+                while box is not None and not box.closed and len(box.queue) >= box.maxsize - REPLAY_PACE:
+                    await asyncio.sleep(0.01)
+                if box is None or box.closed:
+                    return
+                _push(ws, Wire({**frame, "replayed": True}).data_for(ws), frame.get("type") or "?", frame.get("realm"))
+                result["replayed"] += 1
+        ev(INFO if result["gap"] or result["replayed"] else DEBUG, "replay",
+           remote=getattr(ws, "remote_address", None), **result)
+        frame = {"type": "bridge.resume", "payload": result}
+        if req_id:
+            frame["req_id"] = req_id
+        await _send_json(ws, frame)
+
+    def stats(self) -> dict:
+        return {"enabled": bool(REPLAY_SIZE), "epoch": self.epoch, "seq": self.seq,
+                "realms": {r: ring.stats() for r, ring in self.rings.items()}}
+
+REPLAY = Replay()
+
+def _resume_from(obj: dict) -> tuple[int | None, str | None]:
+    """resume_from/epoch из кадра admin.subscribe (на верхнем уровне или в payload)."""
+    p = obj.get("payload") or {}
+    raw = obj.get("resume_from", p.get("resume_from"))
+    epoch = obj.get("epoch", p.get("epoch"))
+    try:
+        return (int(raw) if raw is not None else None), (str(epoch) if epoch else None)
+    except (TypeError, ValueError):
+        return None, None
+
+# ------------------ cluster ------------------
+#
+# Несколько бриджей делят трафик realm-ов. Узлы известны заранее (SP_CLUSTER_PEERS), каждый
+# узел держит исходящую связь к каждому соседу и по ней шлёт служебные кадры cluster.*:
+#   cluster.hello     {node, realms: {realm: plugins}} — при установке связи
+#   cluster.realm     {realm, count}                   — плагин realm подключился/отключился
+#   cluster.route     {msg}                            — запрос админа для realm, чей плагин у соседа
+#   cluster.reply     {data}                           — ответ плагина админу узла-отправителя
+#   cluster.broadcast {msg}                            — кадр плагина для подписчиков (консоль и т.п.)
+#   cluster.stats     {realm, ts, frame}               — свежий снимок статистики (кэш/обзор на всех узлах)
+# Таблица realm -> узел строится по факту подключения плагинов; консистентное хеширование
+# определяет, какой узел «должен» держать realm: чужому плагину hello.ok подсказывает redirect
+# (кто не умеет переподключаться, продолжает работать через пересылку).
+NODE_ID = os.getenv("SP_NODE_ID") or uuid.uuid4().hex[:8]
+CLUSTER_VNODES = int(os.getenv("SP_CLUSTER_VNODES", "64"))
+CLUSTER_QUEUE = int(os.getenv("SP_CLUSTER_QUEUE", "2048"))
+CLUSTER_REDIRECT = os.getenv("SP_CLUSTER_REDIRECT", "1") not in ("0", "", "false", "False")
+
+def _parse_peers(raw: str) -> dict[str, str]:
+    """"b=ws://10.0.0.2:8765/ws,c=ws://10.0.0.3:8765/ws" -> {"b": url, "c": url}"""
+    peers = {}
+    for item in (raw or "").split(","):
+        node, sep, url = item.strip().partition("=")
+        if sep and node.strip() and url.strip():
+            peers[node.strip()] = url.strip()
+    return peers
+
+class HashRing:
+    """Консистентное хеширование realm -> узел (виртуальные узлы сглаживают распределение)."""
+
+    def __init__(self, nodes, vnodes: int = CLUSTER_VNODES):
+        self.points = sorted(
+            (self._hash(f"{node}#{i}"), node) for node in set(nodes) for i in range(max(1, vnodes))
+        )
+        self.keys = [h for h, _node in self.points]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+    def owner(self, key: str, alive=None) -> str | None:
+        """Первый живой узел по часовой стрелке от хеша ключа."""
+        if not self.points:
+            return None
+        start = bisect.bisect(self.keys, self._hash(key))
+        for i in range(len(self.points)):
+            node = self.points[(start + i) % len(self.points)][1]
+            if alive is None or node in alive:
+                return node
+        return None
+
+class PeerProxy:
+    """
+    «Админ» на соседнем узле: запросы, пришедшие через cluster.route, запоминаются в PENDING
+    с этим объектом, а его Outbox отправляет ответы обратно кадрами cluster.reply.
+    """
+    remote_address = None
+    subprotocol = None
+
+    def __init__(self, cluster: "Cluster", node: str):
+        self.cluster = cluster
+        self.node = node
+
+    async def send(self, data) -> None:
+        if isinstance(data, (bytes, bytearray)):
+            data = json_dumps(_unpack(bytes(data)) or {})
+        if not self.cluster.send(self.node, {"type": "cluster.reply", "data": data}):
+            raise ConnectionError(f"no link to node {self.node}")
+
+    async def close(self, code: int = 1000, reason: str = "") -> None:
+        return None
+
+class WsLink:
+    """Исходящая связь к соседу: своя очередь, переподключение с backoff 1..30 с."""
+
+    def __init__(self, cluster: "Cluster", node: str, url: str, token: str):
+        self.cluster = cluster
+        self.node = node
+        self.url = url
+        self.token = token
+        self.up = False
+        self.queue: deque = deque()
+        self.wakeup = asyncio.Event()
+        self.dropped = 0
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    def send(self, frame: dict) -> bool:
+        if len(self.queue) >= CLUSTER_QUEUE:
+            self.queue.popleft()
+            self.dropped += 1
+        self.queue.append(json_dumps(frame, default=str))
+        self.wakeup.set()
+        return True
+
+    async def _run(self) -> None:
+        backoff = 1.0
+        while True:
+            try:
+                async with websockets.connect(
+                    self.url, ping_interval=20, ping_timeout=20, max_size=None,
+                    extra_headers={"Authorization": f"Bearer {self.token}", "X-Role": "peer", "X-Node": self.cluster.node_id},
+                ) as ws:
+                    self.up = True
+                    backoff = 1.0
+                    ev(INFO, "cluster link up", node=self.node, url=self.url)
+                    await ws.send(json_dumps(self.cluster.hello_frame()))
+                    while True:
+                        while not self.queue:
+                            self.wakeup.clear()
+                            await self.wakeup.wait()
+                        await ws.send(self.queue[0])
+                        self.queue.popleft()
+            except asyncio.CancelledError:
+                return
+            except Exception as e:
+                if self.up:
+                    ev(WARNING, "cluster link down", node=self.node, error=str(e))
+            self.up = False
+            await asyncio.sleep(backoff)
+            backoff = min(30.0, backoff * 2)
+
+    def close(self) -> None:
+        self.up = False
+        self.task.cancel()
+
+class LocalLink:
+    """
+    Связь с узлом в этом же процессе — замена WsLink для тестов и локальной отладки.
+    Кадры проходят через JSON, как по сети, и доставляются следующей итерацией цикла.
+    """
+
+    def __init__(self, target: "Cluster", from_node: str):
+        self.target = target
+        self.from_node = from_node
+        self.up = True
+        self.dropped = 0
+
+    def send(self, frame: dict) -> bool:
+        if not self.up:
+            return False
+        frame = json_loads(json_dumps(frame, default=str))
+        asyncio.get_running_loop().create_task(self.target.on_frame(self.from_node, frame))
+        return True
+
+    def close(self) -> None:
+        if self.up:
+            self.up = False
+            self.target.peer_down(self.from_node)
+
+class Cluster:
+    def __init__(self, node_id: str, peers: dict[str, str] | None = None):
+        self.node_id = node_id
+        self.peers = dict(peers or {})
+        self.ring = HashRing([node_id, *self.peers])
+        self.links: dict[str, object] = {}
+        self.incoming: dict[str, object] = {}
+        self.proxies: dict[str, PeerProxy] = {}
+        # realm -> (узел, число плагинов) по объявлениям соседей
+        self.routes: dict[str, tuple[str, int]] = {}
+        self.forwarded = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.links)
+
+    # ---- membership ----
+
+    async def start(self, token: str) -> None:
+        for node, url in self.peers.items():
+            if node != self.node_id and node not in self.links:
+                self.links[node] = WsLink(self, node, url, token)
+        if self.peers:
+            ev(INFO, "cluster mode", node=self.node_id, peers=",".join(sorted(self.peers)))
+
+    def attach(self, node: str, link) -> None:
+        """Подключить готовую связь (LocalLink в тестах) и представиться соседу."""
+        self.links[node] = link
+        if node not in self.peers:
+            self.peers[node] = ""
+            self.ring = HashRing([self.node_id, *self.peers])
+        link.send(self.hello_frame())
+
+    @staticmethod
+    def link_local(a: "Cluster", b: "Cluster") -> None:
+        a.attach(b.node_id, LocalLink(b, a.node_id))
+        b.attach(a.node_id, LocalLink(a, b.node_id))
+
+    def alive(self) -> set:
+        return {self.node_id} | {n for n, link in self.links.items() if link.up}
+
+    def preferred(self, realm: str) -> str | None:
+        return self.ring.owner(realm, self.alive())
+
+    def node_for(self, realm: str | None) -> str | None:
+        """Соседний узел, к которому подключён плагин realm (None — локально или нигде)."""
+        if not realm or not self.links or realm_has_plugins(realm):
+            return None
+        route = self.routes.get(realm)
+        if route is None:
+            return None
+        link = self.links.get(route[0])
+        return route[0] if link is not None and link.up else None
+
+    def remote_realms(self) -> dict[str, int]:
+        return {r: n for r, (node, n) in self.routes.items() if n > 0 and node in self.links}
+
+    # ---- outgoing ----
+
+    def send(self, node: str, frame: dict) -> bool:
+        link = self.links.get(node)
+        return link.send(frame) if link is not None else False
+
+    def send_all(self, frame: dict) -> None:
+        for link in self.links.values():
+            link.send(frame)
+
+    def hello_frame(self) -> dict:
+        return {"type": "cluster.hello", "node": self.node_id,
+                "realms": {r: len(s) for r, s in PLUGINS.items() if s}}
+
+    def realm_changed(self, realm: str) -> None:
+        if self.links:
+            self.send_all({"type": "cluster.realm", "realm": realm, "count": len(PLUGINS.get(realm) or ())})
+
+    def forward(self, node: str, msg: dict) -> bool:
+        self.forwarded += 1
+        return self.send(node, {"type": "cluster.route", "msg": msg})
+
+    def broadcast(self, msg: dict) -> None:
+        if self.links:
+            self.send_all({"type": "cluster.broadcast", "msg": msg})
+
+    def share_stats(self, realm: str, entry: dict) -> None:
+        if self.links:
+            self.send_all({"type": "cluster.stats", "realm": realm, "ts": entry["ts"], "frame": entry["frame"]})
+
+    def redirect_for(self, realm: str) -> str | None:
+        """URL узла, который по хешу должен держать realm, если это не мы."""
+        if not CLUSTER_REDIRECT or not self.links:
+            return None
+        owner = self.preferred(realm)
+        if owner is None or owner == self.node_id:
+            return None
+        return self.peers.get(owner) or None
+
+    def proxy(self, node: str) -> PeerProxy:
+        proxy = self.proxies.get(node)
+        box = OUTBOXES.get(proxy) if proxy is not None else None
+        if proxy is None or box is None or box.closed:
+            proxy = self.proxies[node] = PeerProxy(self, node)
+            _open_outbox(proxy, f"peer:{node}")
+        return proxy
+
+    # ---- incoming ----
+
+    async def serve_peer(self, ws, node: str) -> None:
+        self.incoming[node] = ws
+        ev(INFO, "peer connected", node=node, remote=ws.remote_address)
+        try:
+            async for raw in ws:
+                try:
+                    frame = json_loads(raw)
+                except Exception:
+                    continue
+                METRICS.frame_in(None, frame.get("type") or "?", len(raw))
+                await self.on_frame(node, frame)
+        except (ConnectionClosedOK, ConnectionClosedError):
+            pass
+        finally:
+            if self.incoming.get(node) is ws:
+                del self.incoming[node]
+                self.peer_down(node)
+
+    def peer_down(self, node: str) -> None:
+        gone = [r for r, (n, _c) in self.routes.items() if n == node]
+        for realm in gone:
+            del self.routes[realm]
+        proxy = self.proxies.pop(node, None)
+        if proxy is not None:
+            _forget_admin(proxy)
+            _close_outbox(proxy)
+        ev(INFO, "peer disconnected", node=node, realms=len(gone))
+        for realm in gone:
+            asyncio.get_running_loop().create_task(broadcast_admin({
+                "type": "bridge.info", "realm": realm,
+                "payload": {"message": f"Plugin offline realm='{realm}' (node {node} lost)"},
+            }))
+
+    async def on_frame(self, node: str, frame: dict) -> None:
+        t = frame.get("type")
+        if t == "cluster.hello":
+            for realm in [r for r, (n, _c) in self.routes.items() if n == node]:
+                del self.routes[realm]
+            for realm, count in (frame.get("realms") or {}).items():
+                self.routes[realm] = (node, int(count or 0))
+            ev(INFO, "cluster hello", node=node, realms=len(frame.get("realms") or {}))
+        elif t == "cluster.realm":
+            realm, count = frame.get("realm"), int(frame.get("count") or 0)
+            if not realm:
+                return
+            was = self.routes.get(realm)
+            if count > 0:
+                self.routes[realm] = (node, count)
+            elif was is not None and was[0] == node:
+                del self.routes[realm]
+            if (was is None or was[1] == 0) != (count == 0):
+                state = "online" if count else "offline"
+                await broadcast_admin({"type": "bridge.info", "realm": realm,
+                                       "payload": {"message": f"Plugin {state} realm='{realm}' (node {node})"}})
+        elif t == "cluster.route":
+            msg = frame.get("msg") or {}
+            realm, req_id = msg.get("realm"), msg.get("req_id")
+            proxy = self.proxy(node)
+            if msg.get("type") == "server.stats" and req_id:
+                await serve_stats(proxy, realm, req_id, msg, forward=False)
+                return
+            if msg.get("type") == "console.batch" and req_id:
+                await run_batch(proxy, realm, req_id, msg, forward=False)
+                return
+            if req_id:
+                _remember_request(req_id, proxy, realm, msg.get("type"))
+            await route_to_realm(realm, msg, origin=proxy if req_id else None, forward=False)
+        elif t == "cluster.reply":
+            try:
+                msg = json_loads(frame.get("data") or "{}")
+            except Exception:
+                return
+            await route_reply(msg, forward=False)
+        elif t == "cluster.broadcast":
+            msg = frame.get("msg")
+            if isinstance(msg, dict):
+                await broadcast_admin(msg)
+        elif t == "cluster.stats":
+            realm = frame.get("realm")
+            if realm and not realm_has_plugins(realm) and isinstance(frame.get("frame"), dict):
+                ts = float(frame.get("ts") or time.time())
+                STATS_CACHE[realm] = {"at": time.monotonic() - max(0.0, time.time() - ts), "ts": ts,
+                                      "frame": frame["frame"]}
+
+    def stats(self) -> dict:
+        return {
+            "node": self.node_id,
+            "links": {n: {"up": link.up, "queued": len(getattr(link, "queue", ())), "dropped": link.dropped}
+                      for n, link in self.links.items()},
+            "incoming": sorted(self.incoming),
+            "routes": {r: n for r, (n, _c) in self.routes.items()},
+            "forwarded": self.forwarded,
+        }
+
+CLUSTER = Cluster(NODE_ID, _parse_peers(os.getenv("SP_CLUSTER_PEERS", "")))
 
 # ------------------ admin side mapping ------------------
 
 _ADMIN_FIRST_TYPES = {
-    "bridge.list", "console.exec", "cmd.exec", "cmd.execLines",
+    "bridge.list", "console.exec", "cmd.exec", "cmd.execLines", "console.batch",
     "stats.query", "server.stats", "maintenance.set", "broadcast", "player.is_online",
     "ops.set", "cmdwl.set", "cmdwl.commands",
     "lp.web.open", "lp.web.apply",
@@ -258,14 +1917,12 @@ async def handler(ws, path, token_required: str, default_realm: str, *, verbose:
     # auth
     provided = _extract_token(ws, path)
     if token_required and provided != token_required:
-        print(
-            f"[bridge] unauthorized from {ws.remote_address}. "
-            f"Provided token len={len(provided)} matches={provided == token_required}"
-        )
+        ev(WARNING, "unauthorized", remote=ws.remote_address, token_len=len(provided))
+        METRICS.disconnect("unauthorized")
         await ws.close(code=4401, reason="unauthorized")
         return
 
-    print(f"[bridge] connect from {ws.remote_address}")
+    ev(INFO, "connect", remote=ws.remote_address, subprotocol=ws.subprotocol)
 
     # По умолчанию считаем клиента АДМИНОМ,
     # пока он не подтвердит, что он плагин.
@@ -277,17 +1934,29 @@ async def handler(ws, path, token_required: str, default_realm: str, *, verbose:
     hinted_role = _extract_role(ws, path)
     if hinted_role == "plugin":
         role = "plugin"
+    if hinted_role == "peer":
+        # соседний узел кластера: только служебные кадры cluster.*
+        node = ws.request_headers.get("X-Node") or (_extract_qs(path).get("node") or ["?"])[0]
+        await CLUSTER.serve_peer(ws, node)
+        return
+
+    # бинарные кадры с самого начала, если договорились сабпротоколом
+    if ws.subprotocol == SUBPROTO_MSGPACK:
+        ENCODINGS[ws] = "msgpack"
 
     first_msg = None
     try:
         # пробуем прочитать первый фрейм (до 5с)
         try:
             raw = await asyncio.wait_for(ws.recv(), timeout=5)
-            try:
-                first_msg = json.loads(raw)
-            except Exception:
-                first_msg = {}
-            print("[bridge] first frame:", _short_json(first_msg))
+            if isinstance(raw, (bytes, bytearray)):
+                first_msg = (_unpack(raw) if _encoding(ws) == "msgpack" else None) or {}
+            else:
+                try:
+                    first_msg = json_loads(raw)
+                except Exception:
+                    first_msg = {}
+            ev(DEBUG, "first frame", payload=first_msg)
         except Exception:
             first_msg = None
 
@@ -297,46 +1966,58 @@ async def handler(ws, path, token_required: str, default_realm: str, *, verbose:
         # если явно плагин по заголовку или типу первого кадра — помечаем как плагин
         if hinted_role == "plugin" or (isinstance(first_msg, dict) and _is_plugin_first_type(first_msg.get("type") or "")):
             role = "plugin"
+        if first_msg is not None:
+            METRICS.frame_in(realm if role == "plugin" else _frame_realm(first_msg), _pretty_tag(first_msg), len(raw))
 
         # ---- регистрация (ТОЛЬКО если это точно плагин) ----
         if role == "plugin":
+            _open_outbox(ws, f"plugin:{realm}:{ws.remote_address}")
             PLUGINS.setdefault(realm, set()).add(ws)
             registered_as_plugin = True
-            print(f"[bridge] plugin registered realm='{realm}'")
-            await _send_json(ws, {
-                "type": "hello.ok",
-                "realm": realm,
-                "server_time": datetime.utcnow().isoformat() + "Z"
-            })
+            ev(INFO, "plugin registered", realm=realm, remote=ws.remote_address)
+            CLUSTER.realm_changed(realm)
+            await _send_hello_ok(ws, realm, first_msg if isinstance(first_msg, dict) else {})
             await broadcast_admin({
                 "type": "bridge.info",
+                "realm": realm,
                 "payload": {"message": f"Plugin online realm='{realm}'"}
             })
             # если плагин первым прислал кадр — ретранслируем админам
             if isinstance(first_msg, dict) and first_msg:
-                _log_recv(first_msg.get("type") or "?", realm, first_msg, verbose)
+                _log_recv(first_msg.get("type") or "?", realm, first_msg)
                 await broadcast_admin({**first_msg, "realm": realm})
         else:
+            _open_outbox(ws, f"admin:{ws.remote_address}")
             ADMINS.add(ws)
-            print("[bridge] admin connected")
+            FIREHOSE.add(ws)
+            ev(INFO, "admin connected", remote=ws.remote_address)
             if isinstance(first_msg, dict) and first_msg:
                 await process_admin(ws, first_msg, verbose=verbose)
+            # firehose-клиент без admin.subscribe может попросить досылку прямо в URL: ?resume_from=N&epoch=E
+            qs = _extract_qs(path)
+            if qs.get("resume_from") and ws in FIREHOSE:
+                with contextlib.suppress(ValueError):
+                    await REPLAY.resume(ws, int(qs["resume_from"][0]), (qs.get("epoch") or [None])[0])
 
         # ---- основной цикл ----
         async for raw in ws:
             if isinstance(raw, (bytes, bytearray)):
-                await broadcast_admin({"type": "bridge.binary", "realm": realm, "len": len(raw)})
-                continue
-
-            try:
-                obj = json.loads(raw)
-            except Exception:
-                if role == "plugin":
-                    await broadcast_admin({"type": "bridge.echo", "realm": realm, "payload": raw})
-                else:
-                    await _send_json(ws, {"type": "bridge.ack", "payload": {"seenText": raw}})
-                continue
+                obj = _unpack(raw) if _encoding(ws) == "msgpack" else None
+                if obj is None:
+                    METRICS.frame_in(realm, "binary", len(raw))
+                    await broadcast_admin({"type": "bridge.binary", "realm": realm, "len": len(raw)})
+                    continue
+            else:
+                try:
+                    obj = json_loads(raw)
+                except Exception:
+                    if role == "plugin":
+                        await broadcast_admin({"type": "bridge.echo", "realm": realm, "payload": raw})
+                    else:
+                        await _send_json(ws, {"type": "bridge.ack", "payload": {"seenText": raw}})
+                    continue
 
+            METRICS.frame_in(realm if role == "plugin" else _frame_realm(obj), obj.get("type") or "?", len(raw))
             if role == "plugin":
                 t = obj.get("type") or "?"
                 # базовые ответы
@@ -344,45 +2025,112 @@ async def handler(ws, path, token_required: str, default_realm: str, *, verbose:
                     await _send_json(ws, {"type": "pong", "realm": realm})
                     continue
                 if t == "hello":
-                    await _send_json(ws, {
-                        "type": "hello.ok",
-                        "realm": realm,
-                        "server_time": datetime.utcnow().isoformat() + "Z"
-                    })
+                    await _send_hello_ok(ws, realm, obj)
                     continue
 
-                _log_recv(t, realm, obj, verbose)
-                # транслируем админам всё, добавив realm
-                await broadcast_admin({**obj, "realm": realm})
+                _log_recv(t, realm, obj)
+                msg = {**obj, "realm": realm}
+                # плагин сам проставил realm — кадр уходит админам в исходном виде, без перекодирования
+                wire = None
+                if obj.get("realm") == realm:
+                    wire = Wire(msg, binary=bytes(raw)) if isinstance(raw, (bytes, bytearray)) else Wire(msg, text=raw)
+                if t in STATS_TYPES:
+                    await on_plugin_stats(realm, msg)
+                # ответ на конкретный запрос — спросившему, остальное — подписчикам
+                await route_reply(msg, wire)
             else:
                 await process_admin(ws, obj, verbose=verbose)
 
     except (ConnectionClosedOK, ConnectionClosedError):
         pass
     finally:
+        _close_outbox(ws)
+        ENCODINGS.pop(ws, None)
+        PLUGIN_CAPS.pop(ws, None)
         if registered_as_plugin and realm:
             if ws in PLUGINS.get(realm, set()):
                 PLUGINS[realm].discard(ws)
-                print(f"[bridge] plugin disconnected realm='{realm}'")
+                ev(INFO, "plugin disconnected", realm=realm)
+                CLUSTER.realm_changed(realm)
                 await broadcast_admin({
                     "type": "bridge.info",
+                    "realm": realm,
                     "payload": {"message": f"Plugin offline realm='{realm}'"}
                 })
         elif ws in ADMINS:
-            ADMINS.discard(ws)
-            print("[bridge] admin disconnected")
+            _drop_admin(ws)
+            ev(INFO, "admin disconnected", remote=ws.remote_address)
+
+async def _send_hello_ok(ws, realm: str, hello: dict) -> None:
+    """hello.ok + выбор кодировки по capability из hello (если её не задал сабпротокол)."""
+    enc = _encoding(ws) if ws.subprotocol else _hello_encoding(hello)
+    caps = hello.get("caps") or (hello.get("payload") or {}).get("caps") or ()
+    if caps:
+        PLUGIN_CAPS[ws] = {caps} if isinstance(caps, str) else {str(c) for c in caps}
+    ok = {
+        "type": "hello.ok",
+        "realm": realm,
+        "encoding": enc,
+        "server_time": datetime.utcnow().isoformat() + "Z"
+    }
+    # в кластере realm «принадлежит» узлу по хешу — плагин может переподключиться туда
+    redirect = CLUSTER.redirect_for(realm)
+    if redirect:
+        ok["redirect"] = redirect
+    await _send_json(ws, ok)
+    if enc == "msgpack" and _encoding(ws) != "msgpack":
+        ENCODINGS[ws] = "msgpack"
+        ev(INFO, "switched to msgpack frames", realm=realm)
 
 async def process_admin(ws, obj: dict, *, verbose: bool):
-    # нормализуем запрос
-    norm = _map_admin_request(obj)
+    # нормализуем запрос; req_id клиента сохраняем (или выдаём свой), чтобы вернуть ответ адресно
+    req_id = str(obj.get("req_id") or uuid.uuid4().hex)
+
+    # подписки на (realm, type-pattern) — после первой подписки firehose для сокета выключается
+    if obj.get("type") in ("admin.subscribe", "admin.unsubscribe"):
+        topics = _parse_topics(obj)
+        if obj.get("type") == "admin.subscribe":
+            mine = subscribe(ws, topics, replace=bool(obj.get("replace", (obj.get("payload") or {}).get("replace"))))
+        else:
+            mine = unsubscribe(ws, topics or None)
+        await _send_json(ws, {
+            "type": obj["type"] + ".ok",
+            "req_id": req_id,
+            "payload": {"topics": [{"realm": r, "type": t} for r, t in sorted(mine)],
+                        "epoch": REPLAY.epoch, "seq": REPLAY.seq},
+        })
+        since, epoch = _resume_from(obj)
+        if obj.get("type") == "admin.subscribe" and since is not None:
+            await REPLAY.resume(ws, since, epoch, req_id)
+        return
+    # пачка аудита из панели: только журналируем, ответ не нужен (отправитель не ждёт)
+    if obj.get("type") == "admin.origin.batch":
+        p = obj.get("payload") or {}
+        items = p.get("items") or []
+        for it in items:
+            if isinstance(it, dict):
+                client = it.get("client") or {}
+                ev(INFO, "origin", realm=it.get("realm"), action=it.get("action"),
+                   ip=client.get("ip") or "-", page=client.get("page") or "-")
+        if p.get("dropped"):
+            ev(WARNING, "origin batch: entries dropped by sender", dropped=p["dropped"])
+        return
+    norm = {**_map_admin_request(obj), "req_id": req_id}
     t = norm.get("type")
     p = norm.get("payload") or {}
     realm = norm.get("realm") or p.get("realm")
 
+    # лимиты — до ACK: ограниченный запрос получает только bridge.throttled; то, что отдадим
+    # из кэша или присоединим к летящему чтению, до плагина не дойдёт — его не считаем
+    if t not in {"bridge.list", "bridge.stats", "stats.overview"} and not _served_locally(realm, t, norm):
+        actor = str(obj.get("actor") or p.get("actor") or "")[:64]
+        if await throttled(ws, actor, realm, t, req_id):
+            return
+
     # быстрый ACK админам
-    if t not in {"bridge.list"}:
+    if t not in {"bridge.list", "bridge.stats", "stats.overview"}:
         with contextlib.suppress(Exception):
-            await _send_json(ws, {"type": "bridge.ack", "payload": {"seenType": t}})
+            await _send_json(ws, {"type": "bridge.ack", "req_id": req_id, "payload": {"seenType": t}})
 
     # прямые типы для плагина
     direct_to_plugin = {
@@ -396,17 +2144,42 @@ async def process_admin(ws, obj: dict, *, verbose: bool):
         "lp.user.info", "lp.group.info",
         "jp.balance.get", "jp.balance.set", "jp.balance.add", "jp.balance.take",
     }
+    if t == "server.stats":
+        await serve_stats(ws, realm, req_id, norm)
+        return
+    if t == "console.batch":
+        await run_batch(ws, realm, req_id, norm)
+        return
+
     if t in direct_to_plugin:
-        await route_to_realm(realm, norm)
+        if _coalescable(t) and await coalesce_read(ws, realm, req_id, norm):
+            return
+        _remember_request(req_id, ws, realm or _single_online_realm(), t)
+        await route_to_realm(realm, norm, origin=ws)
         return
 
     if t == "bridge.list":
         listing = {r: len(s) for r, s in PLUGINS.items()}
-        await _send_json(ws, {"type": "bridge.list.result", "payload": listing})
+        listing.update({r: n + len(PLUGINS.get(r) or ()) for r, n in CLUSTER.remote_realms().items()})
+        await _send_json(ws, {"type": "bridge.list.result", "req_id": req_id, "payload": listing})
+        return
+
+    if t == "stats.overview":
+        await _send_json(ws, {"type": "stats.overview.result", "req_id": req_id, "payload": stats_overview()})
+        return
+
+    if t == "bridge.stats":
+        await _send_json(ws, {
+            "type": "bridge.stats.result",
+            "req_id": req_id,
+            "payload": {"connections": [box.stats() for box in OUTBOXES.values()], "binary": BINARY_ENABLED,
+                        "deflate": {"enabled": DEFLATE_ENABLED, "min_size": DEFLATE_MIN_SIZE, **DEFLATE_TOTALS},
+                        "cluster": CLUSTER.stats(), "replay": REPLAY.stats()},
+        })
         return
 
     # неизвестное — просто подтвердим
-    await _send_json(ws, {"type": "bridge.ack", "payload": {"seenType": t, "note": "unknown"}})
+    await _send_json(ws, {"type": "bridge.ack", "req_id": req_id, "payload": {"seenType": t, "note": "unknown"}})
 
 # ------------------ REPL (optional) ------------------
 
@@ -640,6 +2413,7 @@ async def repl(uri, token, default_realm: str, *, verbose: bool):
 # ------------------ main ------------------
 
 async def main():
+    global STATS_MAX_AGE, CLUSTER
     ap = argparse.ArgumentParser()
     ap.add_argument("--host", default=os.getenv("SP_BRIDGE_HOST", "0.0.0.0"))
     ap.add_argument("--port", type=int, default=int(os.getenv("SP_BRIDGE_PORT", "8765")))
@@ -649,26 +2423,58 @@ async def main():
     ap.add_argument("--repl", action="store_true", help="run local REPL admin client")
     ap.add_argument("--verbose", action="store_true",
                     default=os.getenv("BRIDGE_VERBOSE", "0") not in ("0", "", "false", "False"),
-                    help="print full payloads for all frames")
+                    help="log every frame with payload (same as SP_BRIDGE_LOG_LEVEL=debug)")
     ap.add_argument("--max-size", type=int, default=int(os.getenv("SP_MAX_SIZE", str(1024 * 1024))))
+    ap.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                    help="Prometheus /metrics port on SP_METRICS_HOST (0 = off)")
+    ap.add_argument("--node-id", default=NODE_ID, help="cluster node id (SP_NODE_ID)")
+    ap.add_argument("--peers", default=os.getenv("SP_CLUSTER_PEERS", ""),
+                    help="cluster peers: id=ws://host:port/ws,... (empty = single node)")
+    ap.add_argument("--stats-max-age", type=float, default=STATS_MAX_AGE,
+                    help="serve stats.query from cache if the last snapshot is younger (sec, 0 = always ask plugin)")
     args = ap.parse_args()
+    STATS_MAX_AGE = args.stats_max_age
+    CLUSTER = Cluster(args.node_id, {n: u for n, u in _parse_peers(args.peers).items() if n != args.node_id})
+    if args.verbose:
+        log.setLevel(DEBUG)
 
     async def ws_handler(ws, path):
         if urlparse(path).path != "/ws":
             await ws.close(code=4404, reason="not_found"); return
         return await handler(ws, path, args.token, args.realm, verbose=args.verbose)
 
-    print(f"[bridge] starting ws server on ws://{args.host}:{args.port}/ws "
-          f"(token len={len(args.token)}, default realm='{args.realm}')")
+    ev(INFO, "starting ws server", url=f"ws://{args.host}:{args.port}/ws", token_len=len(args.token),
+       default_realm=args.realm, max_size=args.max_size)
+    ev(INFO, "runtime", loop=type(asyncio.get_running_loop()).__module__.split(".")[0], json=JSON_CODEC,
+       **({"json_wanted": JSON_CODEC_WANTED} if JSON_CODEC_WANTED not in ("auto", JSON_CODEC) else {}))
+    if DEFLATE_ENABLED:
+        ev(INFO, "permessage-deflate", level=DEFLATE_LEVEL, mem_level=DEFLATE_MEM_LEVEL, min_size=DEFLATE_MIN_SIZE,
+           wbits_out=DEFLATE_SERVER_WBITS, wbits_in=DEFLATE_CLIENT_WBITS)
+    await CLUSTER.start(args.token)
+    metrics_server = None
+    if args.metrics_port:
+        metrics_server = await asyncio.start_server(_metrics_http, METRICS_HOST, args.metrics_port)
+        ev(INFO, "metrics", url=f"http://{METRICS_HOST}:{args.metrics_port}/metrics")
 
     async with websockets.serve(
         ws_handler, args.host, args.port,
-        ping_interval=20, ping_timeout=20, max_size=args.max_size
+        ping_interval=20, ping_timeout=20, max_size=args.max_size,
+        subprotocols=[SUBPROTO_MSGPACK, SUBPROTO_JSON] if BINARY_ENABLED else [SUBPROTO_JSON],
+        compression=None, extensions=_deflate_extensions(),
     ):
         if args.repl:
             await repl(f"ws://127.0.0.1:{args.port}/ws", args.token, args.realm, verbose=args.verbose)
         else:
             await asyncio.Future()
+    if metrics_server is not None:
+        metrics_server.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if UVLOOP_ENABLED and hasattr(uvloop, "run"):
+        uvloop.run(main())
+    else:
+        if UVLOOP_ENABLED:
+            uvloop.install()  # uvloop < 0.18
+        elif UVLOOP_WANTED in ("1", "true", "yes", "on"):
+            ev(WARNING, "SP_UVLOOP=1 but uvloop is not installed, using asyncio loop")
+        asyncio.run(main())
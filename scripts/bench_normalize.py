@@ -0,0 +1,188 @@
+# panel_new/scripts/bench_normalize.py
+# -*- coding: utf-8 -*-
+"""
+Микро-бенчмарк normalize_server_stats: прежняя реализация (словарь собирается заново с цепочками
+d.get(...) or ...) против текущей из bridge_client (блок tps читается один раз, порядок миров
+кэшируется) и её же с heavy=False (тяжёлые блоки не читаются).
+
+Кадры — записанные ответы плагина (полный stats.report, лёгкий server.stats без списков,
+кадр с worlds_map вместо worlds). Можно подать свои: --frames file.jsonl (по кадру в строке,
+например выгрузка из логов бриджа).
+
+Запуск из корня репозитория:
+  python scripts/bench_normalize.py [-n 20000] [--frames frames.jsonl]
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import json
+import sys
+import timeit
+from pathlib import Path
+from typing import Any, Dict, List
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def _load_bridge_client():
+    # без импорта пакета app (Flask-приложение и его зависимости бенчмарку не нужны)
+    import types
+    for name, path in (("app", ROOT / "app"), ("app.modules", ROOT / "app" / "modules")):
+        mod = types.ModuleType(name)
+        mod.__path__ = [str(path)]
+        sys.modules.setdefault(name, mod)
+    spec = importlib.util.spec_from_file_location("app.modules.bridge_client", ROOT / "app" / "modules" / "bridge_client.py")
+    mod = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = mod
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def legacy_normalize(obj: Dict[str, Any]) -> Dict[str, Any]:
+    """Прежняя реализация — эталон для сравнения и проверки результата."""
+    t = obj.get("type")
+    d = obj.get("data") or obj.get("payload") or {}
+    realm = d.get("realm") or obj.get("realm")
+    players_block = d.get("players") or {}
+    worlds_list = d.get("worlds") or []
+    worlds_map = d.get("worlds_map") or {}
+    if not worlds_list and isinstance(worlds_map, dict):
+        tmp = []
+        for name, info in worlds_map.items():
+            if not isinstance(info, dict):
+                continue
+            item = dict(info)
+            item.setdefault("name", name)
+            item.setdefault("type", item.get("environment") or "NORMAL")
+            item.setdefault("players", item.get("players") or 0)
+            tmp.append(item)
+        worlds_list = sorted(tmp, key=lambda x: str(x.get("name", "")).lower())
+    return {
+        "type": t,
+        "realm": realm,
+        "players": {
+            "online": d.get("players_online", players_block.get("online")),
+            "max": d.get("players_max", players_block.get("max")),
+        },
+        "motd": d.get("motd"),
+        "tps": {
+            "1m": d.get("tps_1m") if d.get("tps_1m") is not None else (d.get("tps") or {}).get("1m"),
+            "5m": d.get("tps_5m") if d.get("tps_5m") is not None else (d.get("tps") or {}).get("5m"),
+            "15m": d.get("tps_15m") if d.get("tps_15m") is not None else (d.get("tps") or {}).get("15m"),
+            "mspt": d.get("mspt") if d.get("mspt") is not None else (d.get("tps") or {}).get("mspt"),
+        },
+        "heap": {"used": d.get("heap_used"), "max": d.get("heap_max")},
+        "nonheap": {"used": d.get("nonheap_used"), "max": d.get("nonheap_max")},
+        "jvm": {
+            "uptime_ms": d.get("jvm_uptime_ms"),
+            "classes": {
+                "loaded": d.get("classes_loaded"),
+                "total_loaded": d.get("classes_total_loaded"),
+                "unloaded": d.get("classes_unloaded"),
+            },
+            "threads": {"live": d.get("threads_live"), "peak": d.get("threads_peak"), "daemon": d.get("threads_daemon")},
+            "gc": d.get("gc") or {},
+            "mem_pools": d.get("mem_pools") or {},
+        },
+        "os": {
+            "name": d.get("os_name"),
+            "arch": d.get("os_arch"),
+            "cores": d.get("os_cores"),
+            "cpu_load": {"system": d.get("cpu_system_load"), "process": d.get("cpu_process_load")},
+        },
+        "fs": d.get("fs") or {},
+        "entities_top_types": d.get("entities_top_types") or {},
+        "entities_total_types": d.get("entities_total_types") or {},
+        "plugins": d.get("plugins") or {},
+        "players_list": d.get("players_list") or [],
+        "worlds": worlds_list,
+        "worlds_map": worlds_map,
+    }
+
+
+def recorded_frames() -> List[Dict[str, Any]]:
+    full = {
+        "type": "stats.report", "realm": "survival",
+        "data": {
+            "realm": "survival", "motd": "§aSurvival", "players_online": 37, "players_max": 200,
+            "tps_1m": 19.98, "tps_5m": 19.95, "tps_15m": 19.97, "mspt": 23.4,
+            "heap_used": 5_368_709_120, "heap_max": 8_589_934_592,
+            "nonheap_used": 268_435_456, "nonheap_max": -1, "jvm_uptime_ms": 86_400_000,
+            "classes_loaded": 24_512, "classes_total_loaded": 24_880, "classes_unloaded": 368,
+            "threads_live": 97, "threads_peak": 121, "threads_daemon": 54,
+            "gc": {"G1 Young Generation": {"count": 5120, "time_ms": 40_211}, "G1 Old Generation": {"count": 0, "time_ms": 0}},
+            "mem_pools": {p: {"used": 1 << 26, "max": 1 << 28} for p in ("G1 Eden Space", "G1 Old Gen", "G1 Survivor Space", "Metaspace", "CodeCache")},
+            "os_name": "Linux", "os_arch": "amd64", "os_cores": 8,
+            "cpu_system_load": 0.41, "cpu_process_load": 0.33,
+            "fs": {"/": {"total": 512 << 30, "free": 201 << 30}},
+            "entities_top_types": {f"minecraft:e{i}": 1000 - i * 7 for i in range(20)},
+            "entities_total_types": {f"minecraft:e{i}": 2000 - i * 11 for i in range(60)},
+            "plugins": {f"Plugin{i}": {"version": f"1.{i}.0", "enabled": True} for i in range(45)},
+            "players_list": [{"name": f"player{i}", "uuid": f"00000000-0000-0000-0000-{i:012d}", "ping": 40 + i,
+                              "world": "world"} for i in range(37)],
+            "worlds": [{"name": w, "type": "NORMAL", "players": 12, "entities": 3100, "chunks": 2400}
+                       for w in ("world", "world_nether", "world_the_end")],
+        },
+    }
+    light = {
+        "type": "server.stats", "realm": "survival",
+        "data": {
+            "players": {"online": 37, "max": 200},
+            "tps": {"1m": 19.98, "5m": 19.95, "15m": 19.97, "mspt": 23.4},
+            "heap_used": 5_368_709_120, "heap_max": 8_589_934_592,
+            "cpu_system_load": 0.41, "cpu_process_load": 0.33,
+        },
+    }
+    worlds_map = {
+        "type": "stats.report", "realm": "lobby",
+        "data": {
+            "players_online": 5, "players_max": 100, "tps_1m": 20.0, "mspt": 3.1,
+            "worlds_map": {w: {"environment": env, "players": p, "chunks": 400}
+                           for w, env, p in (("Lobby", "NORMAL", 5), ("arena_2", "NORMAL", 0),
+                                             ("Arena_1", "NETHER", 0), ("event", "THE_END", 0))},
+        },
+    }
+    return [full, light, worlds_map]
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Бенчмарк нормализации кадров статистики")
+    ap.add_argument("-n", type=int, default=20000, help="кадров на замер (по кругу из набора)")
+    ap.add_argument("--frames", type=Path, help="jsonl с записанными кадрами")
+    args = ap.parse_args()
+
+    frames = recorded_frames()
+    if args.frames:
+        frames = [json.loads(line) for line in args.frames.read_text("utf-8").splitlines() if line.strip()]
+    if not frames:
+        print("нет кадров")
+        return 1
+
+    bc = _load_bridge_client()
+    for f in frames:
+        if bc.normalize_server_stats(f) != legacy_normalize(f):
+            print(f"РАСХОЖДЕНИЕ на кадре type={f.get('type')} realm={f.get('realm')}")
+            return 1
+
+    def run(fn, **kw):
+        def loop():
+            for i in range(args.n):
+                fn(frames[i % len(frames)], **kw)
+        loop()  # прогрев (кэш порядка миров)
+        best = min(timeit.repeat(loop, number=1, repeat=5))
+        return best / args.n * 1e6
+
+    before = run(legacy_normalize)
+    after = run(bc.normalize_server_stats)
+    light = run(bc.normalize_server_stats, heavy=False)
+    print(f"кадров в наборе: {len(frames)}, замер: {args.n} кадров, лучший из 5")
+    print(f"  before (legacy)           {before:8.2f} мкс/кадр")
+    print(f"  after                     {after:8.2f} мкс/кадр  x{before / after:.2f}")
+    print(f"  after  (heavy=False)       {light:8.2f} мкс/кадр  x{before / light:.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())